@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import metrics
+
+# Concurrent backend calls allowed per operation; unlisted operations get DEFAULT_LIMIT
+DEFAULT_LIMITS = {"complete": 4, "search": 8, "metadata": 2, "document_urls": 2}
+DEFAULT_LIMIT = 4
+
+class Overloaded(RuntimeError):
+    """Raised when an operation's admission queue is full or its wait times out"""
+
+class _Call:
+    """One in-flight call that later identical calls wait on"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller of a key runs the function; callers that arrive while it
+    is running wait and get the same result, or the same exception. Nothing is
+    kept once the call returns, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs):
+        """Run func once for all concurrent callers of key; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+class AdmissionController:
+    """Per-operation concurrency limits with a bounded wait queue.
+
+    At most ``limits[operation]`` calls of an operation run at once; up to
+    ``max_queue`` more wait for a slot, for at most ``queue_timeout`` seconds.
+    A call beyond that is refused with ``Overloaded`` rather than adding to
+    the pile of warehouse queries. ``run`` also coalesces identical calls, so
+    only one of them takes a slot.
+    """
+
+    def __init__(self, limits: Dict[str, int] = None, default_limit: int = DEFAULT_LIMIT,
+                 max_queue: int = 32, queue_timeout: float = 30.0):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.single_flight = SingleFlight()
+        self._running = Counter()
+        self._waiting = Counter()
+        self._cond = threading.Condition()
+        self.counts = Counter()
+
+    def limit(self, operation: str) -> int:
+        return self.limits.get(operation, self.default_limit)
+
+    @contextmanager
+    def admit(self, operation: str, timeout: float = None):
+        """Hold one of the operation's slots for the duration of a with block"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        with self._cond:
+            if self._running[operation] >= self.limit(operation):
+                if self._waiting[operation] >= self.max_queue:
+                    self.counts[f"{operation}_rejected"] += 1
+                    raise Overloaded(f"Too many {operation} requests queued")
+                self._waiting[operation] += 1
+                try:
+                    while self._running[operation] >= self.limit(operation):
+                        remaining = timeout - (time.perf_counter() - start)
+                        if remaining <= 0:
+                            self.counts[f"{operation}_timed_out"] += 1
+                            raise Overloaded(f"No {operation} slot free after {timeout:.1f}s")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[operation] -= 1
+            self._running[operation] += 1
+            self.counts[f"{operation}_admitted"] += 1
+        metrics.observe(f"{operation}_queue_seconds", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[operation] -= 1
+                self._cond.notify_all()
+
+    def run(self, operation: str, key: Hashable, func: Callable[..., Any], *args, **kwargs):
+        """Run func under the operation's limit, sharing it with identical in-flight calls"""
+        def admitted():
+            with self.admit(operation):
+                return func(*args, **kwargs)
+
+        if key is None:
+            return admitted()
+        result, shared = self.single_flight.do((operation, key), admitted)
+        if shared:
+            with self._cond:
+                self.counts[f"{operation}_coalesced"] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Running and queued calls per operation, with admission counters"""
+        with self._cond:
+            operations = sorted(set(self.limits) | set(self._running) | set(self._waiting))
+            return {
+                "operations": {
+                    operation: {
+                        "limit": self.limit(operation),
+                        "running": self._running[operation],
+                        "queued": self._waiting[operation],
+                        **{
+                            outcome: self.counts[f"{operation}_{outcome}"]
+                            for outcome in ("admitted", "coalesced", "rejected", "timed_out")
+                        },
+                    }
+                    for operation in operations
+                },
+                "in_flight_keys": self.single_flight.in_flight(),
+                "max_queue": self.max_queue,
+            }
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "complete=4,search=8" into a dict"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            operation, value = item.split("=", 1)
+            limits[operation.strip()] = int(value)
+    return limits
+
+# Shared by every session in the process, like the session pool it protects
+admission = AdmissionController(
+    limits=_parse_limits(os.getenv("CARECONNECT_ADMISSION_LIMITS", "")),
+    max_queue=int(os.getenv("CARECONNECT_ADMISSION_QUEUE", "32")),
+    queue_timeout=float(os.getenv("CARECONNECT_ADMISSION_TIMEOUT_SECONDS", "30")),
+)
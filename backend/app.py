@@ -1,13 +1,27 @@
+import asyncio
 import streamlit as st
+from admission import Overloaded, admission
 from connection import SnowflakeConnection
 from conversation_handler import ConversationHandler
+from conversation_store import ConversationStore
 from cortex_completion import CortexCompletion
+from metrics import metrics
+from prefetch import RetrievalPrefetcher
+from tokens import count_tokens
+from warmup import warm_up
+import hashlib
+import hmac
 import os
 import time
-from upload_prescription import upload_and_extract_prescription  # Import the prescription functionality
-from snowflake.snowpark.context import get_active_session
+import uuid
+from typing import Optional, Tuple
+from upload_prescription import content_hash, get_prescription_index, upload_and_extract_prescription  # Import the prescription functionality
 
 
+# Messages shown per page of the chat transcript
+HISTORY_PAGE_SIZE = 20
+# Chunks of a new upload read before its prefetch starts; drugs are usually named up front
+PREFETCH_AFTER_CHUNKS = 2
 
 def initialize_session_state():
     """Initialize session state variables"""
@@ -24,8 +38,18 @@ def initialize_session_state():
         st.session_state.conversation_handler = None
     if 'cortex_completion' not in st.session_state:
         st.session_state.cortex_completion = None
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = None
     if 'show_documents' not in st.session_state:
         st.session_state.show_documents = False
+    if 'stream' not in st.session_state:
+        st.session_state.stream = True
+    if 'use_cache' not in st.session_state:
+        st.session_state.use_cache = True
+    if 'pin_model' not in st.session_state:
+        st.session_state.pin_model = False
+    if 'history_pages' not in st.session_state:
+        st.session_state.history_pages = 1
 
 @st.cache_resource
 def get_snowflake_connection():
@@ -34,6 +58,8 @@ def get_snowflake_connection():
     if not connection.connect():
         st.error("Failed to connect to Snowflake. Please check your credentials.")
         return None
+    # Fill the metadata caches before the first question arrives
+    warm_up(connection)
     return connection
 
 def config_sidebar():
@@ -43,6 +69,10 @@ def config_sidebar():
         st.session_state.conversation_handler.available_models,
         key="model_name"
     )
+    st.session_state.pin_model = st.sidebar.checkbox(
+        'Always use this model', value=False,
+        help="When off, a faster model may answer if this one is slow or failing"
+    )
 
     st.sidebar.selectbox(
         'Select what products you are looking for',
@@ -51,6 +81,8 @@ def config_sidebar():
     )
 
     st.session_state.rag = st.sidebar.checkbox('Use your own documents as context?', value=True)
+    st.session_state.stream = st.sidebar.checkbox('Stream responses', value=True)
+    st.session_state.use_cache = st.sidebar.checkbox('Reuse cached answers', value=True)
 
     st.sidebar.divider()
     st.session_state.show_documents = st.sidebar.checkbox("Show Source Documents", value=False)
@@ -65,9 +97,53 @@ def config_sidebar():
     with st.sidebar.expander("Session State"):
         # Filter out connection objects from display
         display_state = {k: v for k, v in st.session_state.items()
-                         if k not in ['connection', 'conversation_handler', 'cortex_completion']}
+                         if k not in ['connection', 'conversation_handler', 'cortex_completion', 'prefetcher']}
         st.write(display_state)
 
+    with st.sidebar.expander("Cache"):
+        st.write(st.session_state.cortex_completion.cache_stats())
+
+    with st.sidebar.expander("Prefetch"):
+        st.write(st.session_state.prefetcher.stats())
+
+    with st.sidebar.expander("Model routing"):
+        st.write(st.session_state.cortex_completion.router.snapshot())
+
+    with st.sidebar.expander("Connection pool"):
+        st.write(st.session_state.connection.get_pool().stats())
+
+    with st.sidebar.expander("Admission"):
+        st.write(admission.stats())
+
+    if metrics.enabled:
+        with st.sidebar.expander("Metrics"):
+            st.write(metrics.summary())
+            st.download_button("Export turns (JSON lines)", metrics.to_jsonl(),
+                               file_name="careconnect_turns.jsonl", mime="application/jsonl")
+            st.download_button("Export Prometheus metrics", metrics.to_prometheus(),
+                               file_name="careconnect_metrics.prom", mime="text/plain")
+
+def conversation_session() -> Tuple[str, Optional[ConversationStore]]:
+    """Id under which this user's conversation is kept, and the store to keep it in.
+
+    Never taken from the URL, where a shared or bookmarked link would hand
+    out the medical history. A user signed in through Streamlit
+    authentication gets an id derived from their identity with
+    CARECONNECT_SESSION_SECRET and the shared store (None), so their
+    conversation resumes after a reload or restart. Anyone else could never
+    resume theirs, so it is kept in an in-memory store that goes away with
+    the session rather than written to disk.
+    """
+    secret = os.getenv("CARECONNECT_SESSION_SECRET")
+    user = getattr(st, "user", None)
+    try:
+        email = user.get("email") if user is not None and user.get("is_logged_in") else None
+    except Exception:
+        email = None
+    if secret and email:
+        return hmac.new(secret.encode("utf-8"), email.lower().encode("utf-8"), hashlib.sha256).hexdigest(), None
+    return uuid.uuid4().hex, ConversationStore()
+
 def initialize_handlers():
     """Initialize handlers if not already in session state"""
     if st.session_state.connection is None:
@@ -76,16 +152,23 @@ def initialize_handlers():
             return False
 
     if st.session_state.conversation_handler is None:
-        session = st.session_state.connection.get_session()
-        st.session_state.conversation_handler = ConversationHandler(session)
+        pool = st.session_state.connection.get_pool()
+        # Links from older versions carried the session id; it is no longer honored
+        if "session" in st.query_params:
+            del st.query_params["session"]
+        session_id, store = conversation_session()
+        st.session_state.conversation_handler = ConversationHandler(pool, session_id=session_id, store=store)
 
     if st.session_state.cortex_completion is None:
-        session = st.session_state.connection.get_session()
+        pool = st.session_state.connection.get_pool()
         st.session_state.cortex_completion = CortexCompletion(
-            session, 
+            pool, 
             st.session_state.connection.get_root()
         )
 
+    if st.session_state.prefetcher is None:
+        st.session_state.prefetcher = RetrievalPrefetcher(st.session_state.cortex_completion)
+
     return True
 
 def main():
@@ -101,12 +184,37 @@ def main():
     # Configure sidebar
     config_sidebar()
     uploaded_prescription = st.file_uploader("Upload a Prescription (.doc, .docx, or .pdf)", type=["doc", "docx", "pdf"])
-    prescription_text_chunks = []
+    prescription_index = None
+    prescription_key = None
     if uploaded_prescription:
-        prescription_text_chunks = upload_and_extract_prescription(uploaded_prescription)
+        # Start searching for the prescription's drugs before the first question, as soon
+        # as its opening chunks are read; a different upload or category restarts it
+        prescription_key = content_hash(uploaded_prescription)
+        prefetch_key = (prescription_key, st.session_state.category_value)
+        opening_chunks = []
+
+        def on_chunk(chunk):
+            opening_chunks.append(chunk)
+            if len(opening_chunks) == PREFETCH_AFTER_CHUNKS:
+                st.session_state.prefetcher.start(prefetch_key, opening_chunks, st.session_state.category_value)
 
-    # Chat interface with memory management
-    for msg in st.session_state.conversation_handler.get_history():
+        prescription_text_chunks = upload_and_extract_prescription(uploaded_prescription, on_chunk)
+        if prescription_text_chunks:
+            prescription_index = get_prescription_index(uploaded_prescription, prescription_text_chunks)
+            # No-op when the opening chunks already started it
+            st.session_state.prefetcher.start(
+                prefetch_key, prescription_text_chunks, st.session_state.category_value
+            )
+    else:
+        st.session_state.prefetcher.cancel()
+
+    # Only the newest pages of the conversation are rendered on each rerun
+    messages = st.session_state.conversation_handler.get_page(HISTORY_PAGE_SIZE * st.session_state.history_pages)
+    if messages and messages[0].seq > 0:
+        if st.button(f"Load earlier messages ({messages[0].seq} more)"):
+            st.session_state.history_pages += 1
+            st.rerun()
+    for msg in messages:
         with st.chat_message(msg.role):
             st.write(msg.content)
 
@@ -121,40 +229,102 @@ def main():
             st.write(question)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                # Get response
-                prescription_text = " ".join(prescription_text_chunks) if prescription_text_chunks else ""
-
-                response_text, relative_paths = st.session_state.cortex_completion.complete(
-                    question,
-                    st.session_state.model_name,
-                    st.session_state.rag,
-                    prescription_text,
-                    st.session_state.category_value
+            # Only the prescription chunks relevant to this question go into the prompt
+            prescription_text = (
+                prescription_index.select(question, st.session_state.model_name) if prescription_index else ""
+            )
+            chat_history = st.session_state.conversation_handler.render_history(st.session_state.model_name)
+            try:
+                if st.session_state.stream:
+                    with st.spinner("Thinking..."):
+                        response_stream, relative_paths = st.session_state.cortex_completion.complete_stream(
+                            question,
+                            st.session_state.model_name,
+                            st.session_state.rag,
+                            prescription_text,
+                            st.session_state.category_value,
+                            use_cache=st.session_state.use_cache,
+                            chat_history=chat_history,
+                            pin_model=st.session_state.pin_model,
+                            prescription_key=prescription_key
+                        )
+                    # Resolve the source document links while the answer streams
+                    url_future = st.session_state.cortex_completion.prefetch_document_urls(relative_paths)
+                    response_text = st.write_stream(response_stream)
+                    urls = url_future.result()
+                    stats = st.session_state.cortex_completion.last_stream_stats
+                    timings = {
+                        "time_to_first_token": stats.get('time_to_first_token', 0.0),
+                        "completion": stats.get('total_time', 0.0),
+                    }
+                    if stats.get('cached'):
+                        st.caption("Answered from cache")
+                    elif stats:
+                        st.caption(
+                            f"First token in {stats['time_to_first_token']:.2f}s, "
+                            f"total {stats['total_time']:.2f}s"
+                        )
+                else:
+                    with st.spinner("Thinking..."):
+                        # Get response; document links are resolved alongside generation
+                        response_text, relative_paths, urls, timings = asyncio.run(
+                            st.session_state.cortex_completion.acomplete(
+                                question,
+                                st.session_state.model_name,
+                                st.session_state.rag,
+                                prescription_text,
+                                st.session_state.category_value,
+                                use_cache=st.session_state.use_cache,
+                                chat_history=chat_history,
+                                pin_model=st.session_state.pin_model,
+                                prescription_key=prescription_key
+                            )
+                        )
+                    st.write(response_text)
+                    st.caption(", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+            except Overloaded as e:
+                # The backend is saturated; the question is not stored, so it can simply be asked again
+                print(f"Error answering question: {str(e)}")
+                st.warning("CareConnect is busy right now. Please try again in a moment.")
+                return
+            except (RuntimeError, TimeoutError) as e:
+                # Every model failed, or no Snowflake session freed up in time
+                print(f"Error answering question: {str(e)}")
+                st.error("CareConnect could not answer this question right now. Please try again.")
+                return
+
+            if st.session_state.rag:
+                st.session_state.prefetcher.record_turn(question, relative_paths)
+
+            model_used = st.session_state.cortex_completion.last_model_used
+            if model_used and model_used != st.session_state.model_name:
+                st.caption(f"Answered by {model_used}")
+
+            if metrics.enabled:
+                metrics.record_turn(
+                    model=model_used or st.session_state.model_name,
+                    category=st.session_state.category_value,
+                    rag=st.session_state.rag,
+                    response_tokens=count_tokens(response_text),
+                    **st.session_state.cortex_completion.last_prompt_stats,
+                    **{f"{stage}_seconds": seconds for stage, seconds in timings.items()}
                 )
-                
-                st.write(response_text)
-                # print(relative_paths)
-                # Store the conversation
-                st.session_state.conversation_handler.add_message("user", question)
-                st.session_state.conversation_handler.add_message("assistant", response_text)
-
-                # Cache related documents
-                st.session_state.related_docs = [
-                    (path, st.session_state.cortex_completion.get_document_url(path)) for path in relative_paths
-                ]
-                # config_sidebar()
-                session = get_active_session()
-                if relative_paths != "None" and st.session_state.show_documents:
-                    with st.sidebar.expander("Related Documents" , expanded=True):
-                        for path in relative_paths:
-                            cmd2 = f"select GET_PRESIGNED_URL(@docs, '{path}', 360) as URL_LINK from directory(@docs)"
-                            df_url_link = session.sql(cmd2).to_pandas()
-                            url_link = df_url_link._get_value(0,'URL_LINK')
-        
-                            display_url = f"Doc: [{path}]({url_link})"
-                            st.sidebar.markdown(display_url)
-                
+
+            # print(relative_paths)
+            # Store the conversation
+            st.session_state.conversation_handler.add_message("user", question)
+            st.session_state.conversation_handler.add_message("assistant", response_text)
+
+            # Cache related documents
+            st.session_state.related_docs = [
+                (path, urls[path]) for path in relative_paths if path in urls
+            ]
+            # config_sidebar()
+            if st.session_state.related_docs and st.session_state.show_documents:
+                with st.sidebar.expander("Related Documents" , expanded=True):
+                    for path, url_link in st.session_state.related_docs:
+                        display_url = f"Doc: [{path}]({url_link})"
+                        st.sidebar.markdown(display_url)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,259 @@
+"""Micro and macro benchmarks for the chat backend against the offline stand-in.
+
+    python benchmarks.py --sessions 1 4 16 --turns 10 --output bench.json
+    python benchmarks.py --output new.json --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from admission import AdmissionController
+from cache import CompletionCache, LRUCache, metadata_cache
+from connection import SnowflakeConnection
+from conversation_handler import ConversationHandler
+from conversation_store import ConversationStore
+from cortex_completion import CortexCompletion
+from fake_backend import FakeBackend
+from metrics import percentiles
+from semantic_cache import SemanticCache
+from warmup import warm_up
+
+QUESTIONS = [
+    "What is the usual adult dosage of amoxicillin?",
+    "Can I take ibuprofen with alcohol?",
+    "What are the side effects of metformin?",
+    "How often should I take lisinopril?",
+    "How should atorvastatin be stored?",
+    "Is dizziness a common side effect of amlodipine?",
+]
+PRESCRIPTION = (
+    "Rx: Amoxicillin 500 mg, one capsule three times daily for 7 days. "
+    "Ibuprofen 200 mg as needed for pain, no more than 4 tablets per day."
+)
+
+def bench(func: Callable[[], Any], repeat: int = 200, warmup: int = 5) -> Dict[str, float]:
+    """Time repeated calls of func, in microseconds per call"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+def make_cortex(connection: SnowflakeConnection, admission: AdmissionController = None) -> CortexCompletion:
+    """CortexCompletion with private caches so runs do not share state"""
+    return CortexCompletion(
+        connection.get_pool(), connection.get_root(),
+        completion_cache=CompletionCache(), retrieval_cache=LRUCache(), document_url_cache=LRUCache(),
+        semantic_cache=SemanticCache(), admission=admission or AdmissionController(),
+    )
+
+def sample_pdf(pages: int = 5) -> bytes:
+    """A small text PDF built in memory with PyMuPDF"""
+    import fitz
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Page {page_number}. {PRESCRIPTION}", fontsize=10)
+    return document.tobytes()
+
+def micro_benchmarks(connection: SnowflakeConnection, repeat: int) -> Dict[str, Any]:
+    """Per-call cost of the CPU-bound building blocks of a turn"""
+    results: Dict[str, Any] = {}
+    cortex = make_cortex(connection)
+    question = QUESTIONS[0]
+    search_response = cortex.get_similar_chunks(cortex.search_query(question, PRESCRIPTION))
+
+    results["create_prompt"] = bench(
+        lambda: cortex.create_prompt(question, True, PRESCRIPTION, "ALL", "", search_response=search_response,
+                                     model_name="mistral-large2"),
+        repeat,
+    )
+    results["retrieval_cache_hit"] = bench(
+        lambda: cortex.get_similar_chunks(cortex.search_query(question, PRESCRIPTION)), repeat
+    )
+
+    handler = ConversationHandler(connection.get_pool(), store=ConversationStore())
+    for i in range(50):
+        handler.add_message("user", QUESTIONS[i % len(QUESTIONS)])
+        handler.add_message("assistant", "The usual adult dosage is 500 mg three times daily. " * 3)
+    handler.render_history("mistral-large2")
+    results["render_history"] = bench(lambda: handler.render_history("mistral-large2"), repeat)
+
+    try:
+        from upload_prescription import PrescriptionIndex, extract_text_from_doc
+        pdf = sample_pdf()
+        results["extract_text_from_doc"] = bench(lambda: extract_text_from_doc(pdf, "sample.pdf"), max(repeat // 10, 5))
+        index = PrescriptionIndex(extract_text_from_doc(pdf, "sample.pdf"))
+        results["prescription_select"] = bench(lambda: index.select(question, "mistral-large2"), repeat)
+    except ImportError as e:
+        results["extract_text_from_doc"] = {"skipped": str(e)}
+    return results
+
+async def _session_loop(connection: SnowflakeConnection, turns: int, offset: int, use_cache: bool,
+                        latencies: List[float], admission: AdmissionController):
+    cortex = make_cortex(connection, admission)
+    handler = ConversationHandler(connection.get_pool(), store=ConversationStore(), admission=admission)
+    loop = asyncio.get_running_loop()
+    for turn in range(turns):
+        question = QUESTIONS[(offset + turn) % len(QUESTIONS)]
+        start = time.perf_counter()
+        chat_history = await loop.run_in_executor(cortex.executor, handler.render_history, "mistral-large2")
+        response_text, _, _, _ = await cortex.acomplete(
+            question, "mistral-large2", True, PRESCRIPTION, "ALL",
+            use_cache=use_cache, chat_history=chat_history,
+        )
+        latencies.append(time.perf_counter() - start)
+        handler.add_message("user", question)
+        handler.add_message("assistant", response_text)
+
+def macro_benchmark(connection: SnowflakeConnection, sessions: int, turns: int, use_cache: bool) -> Dict[str, Any]:
+    """End-to-end turn latency and throughput with concurrent sessions"""
+    latencies: List[float] = []
+    # Sessions share one controller, as they do in the app
+    admission = AdmissionController()
+
+    async def run():
+        await asyncio.gather(*(
+            _session_loop(connection, turns, offset, use_cache, latencies, admission) for offset in range(sessions)
+        ))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "wall_time": elapsed,
+        "throughput_turns_per_second": len(latencies) / elapsed,
+        "latency_seconds": percentiles(latencies),
+        "pool": connection.get_pool().stats(),
+        "admission": admission.stats()["operations"],
+    }
+
+IMPORT_MODULES = ["connection", "conversation_handler", "cortex_completion", "upload_prescription", "app"]
+
+def import_times(modules: List[str] = IMPORT_MODULES) -> Dict[str, Any]:
+    """Seconds to import each module in a fresh interpreter"""
+    results: Dict[str, Any] = {}
+    for module in modules:
+        code = f"import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)"
+        run = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        if run.returncode == 0:
+            results[module] = float(run.stdout.strip().splitlines()[-1])
+        else:
+            results[module] = {"skipped": run.stderr.strip().splitlines()[-1] if run.stderr.strip() else "failed"}
+    return results
+
+def first_turn(backend_options: Dict[str, float], warm: bool) -> Dict[str, Any]:
+    """Latency of a new process's first turn, with or without the startup warm-up"""
+    metadata_cache.invalidate()
+    backend = FakeBackend.with_sample_data(**backend_options)
+    connection = SnowflakeConnection(backend=backend)
+    connection.connect()
+    result: Dict[str, Any] = {"warm": warm}
+    if warm:
+        start = time.perf_counter()
+        warm_up(connection, background=False)
+        result["warm_up_seconds"] = time.perf_counter() - start
+    statements = backend.statements
+
+    start = time.perf_counter()
+    handler = ConversationHandler(connection.get_pool(), store=ConversationStore())
+    handler.get_available_categories()
+    cortex = make_cortex(connection)
+    asyncio.run(cortex.acomplete(QUESTIONS[0], "mistral-large2", True, PRESCRIPTION, "ALL"))
+    result["first_turn_seconds"] = time.perf_counter() - start
+    result["first_turn_statements"] = backend.statements - statements
+    connection.close()
+    return result
+
+def startup_benchmarks(backend_options: Dict[str, float]) -> Dict[str, Any]:
+    return {
+        "import_seconds": import_times(),
+        "first_turn": [first_turn(backend_options, warm) for warm in (False, True)],
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print the relative change of every p50 between two result files"""
+    print(f"{'benchmark':40} {'baseline':>12} {'current':>12} {'change':>8}")
+    rows = []
+    for name, result in current["micro"].items():
+        if "p50" in result and "p50" in baseline["micro"].get(name, {}):
+            rows.append((f"micro/{name} p50 (us)", baseline["micro"][name]["p50"], result["p50"]))
+    for name, seconds in current.get("startup", {}).get("import_seconds", {}).items():
+        old = baseline.get("startup", {}).get("import_seconds", {}).get(name)
+        if isinstance(seconds, float) and isinstance(old, float):
+            rows.append((f"startup/import {name} (s)", old, seconds))
+    previous = {run["sessions"]: run for run in baseline["macro"]}
+    for run in current["macro"]:
+        if run["sessions"] in previous:
+            old = previous[run["sessions"]]
+            rows.append((f"macro/{run['sessions']} sessions p50 (s)",
+                         old["latency_seconds"]["p50"], run["latency_seconds"]["p50"]))
+            rows.append((f"macro/{run['sessions']} sessions turns/s",
+                         old["throughput_turns_per_second"], run["throughput_turns_per_second"]))
+    for label, old, new in rows:
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{label:40} {old:12.4f} {new:12.4f} {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200, help="iterations per micro benchmark")
+    parser.add_argument("--complete-latency", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--sql-latency", type=float, default=0.005)
+    parser.add_argument("--use-cache", action="store_true", help="let turns hit the completion and retrieval caches")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    args = parser.parse_args()
+
+    backend_options = dict(
+        complete_latency=args.complete_latency, tokens_per_second=args.tokens_per_second,
+        search_latency=args.search_latency, sql_latency=args.sql_latency,
+    )
+    backend = FakeBackend.with_sample_data(**backend_options)
+    connection = SnowflakeConnection(backend=backend)
+    connection.connect()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": vars(args),
+        },
+        "startup": startup_benchmarks(backend_options),
+        "micro": micro_benchmarks(connection, args.repeat),
+        "macro": [macro_benchmark(connection, n, args.turns, args.use_cache) for n in args.sessions],
+    }
+    connection.close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Answer a JSONL file of questions through the same path as a chat turn.
+
+    python bulk_answer.py questions.jsonl answers.jsonl --concurrency 8 --rate 4
+
+Each input line is a JSON object with ``question`` and optionally ``id``,
+``category``, ``prescription_text`` and ``model``; lines without an id are
+numbered by position. Answers are appended to the output file as they finish,
+so an interrupted run picks up where it stopped: ids already answered without
+an error are skipped, and for a repeated id the last line wins.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from connection import SnowflakeConnection
+from cortex_completion import CortexCompletion
+from metrics import percentiles
+
+class RateLimiter:
+    """Spaces request starts at most ``rate`` per second; 0 disables the limit"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def read_questions(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (id, item) pairs lazily so large files are never loaded whole"""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield str(item.get("id", line_number)), item
+
+def answered_ids(path: str) -> Set[str]:
+    """Ids that already have a successful answer in the output file"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted write
+                continue
+            if record.get("error"):
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    return done
+
+async def answer_one(cortex: CortexCompletion, item_id: str, item: Dict[str, Any], args) -> Dict[str, Any]:
+    start = time.perf_counter()
+    record: Dict[str, Any] = {"id": item_id, "question": item.get("question")}
+    try:
+        # The chat path without document URLs, which a batch run never shows
+        loop = asyncio.get_running_loop()
+        response_text, relative_paths = await loop.run_in_executor(cortex.executor, functools.partial(
+            cortex.complete, item["question"], item.get("model", args.model), args.use_rag,
+            item.get("prescription_text", ""), item.get("category", args.category), use_cache=args.use_cache,
+        ))
+        record.update(answer=response_text, relative_paths=sorted(relative_paths), error=None)
+    except Exception as e:
+        print(f"Error answering {item_id}: {str(e)}")
+        record.update(answer=None, relative_paths=[], error=str(e))
+    record["latency"] = time.perf_counter() - start
+    return record
+
+async def run(cortex: CortexCompletion, args) -> Dict[str, Any]:
+    """Answer every pending question with bounded concurrency; returns run statistics"""
+    done = answered_ids(args.output) if args.resume else set()
+    limiter = RateLimiter(args.rate)
+    slots = asyncio.Semaphore(max(args.concurrency, 1))
+    latencies: List[float] = []
+    counts = {"answered": 0, "errors": 0, "skipped": 0}
+    tasks = set()
+
+    with open(args.output, "a" if args.resume else "w") as out:
+        async def worker(item_id: str, item: Dict[str, Any]):
+            try:
+                record = await answer_one(cortex, item_id, item, args)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                counts["errors" if record["error"] else "answered"] += 1
+                if not record["error"]:
+                    latencies.append(record["latency"])
+            finally:
+                slots.release()
+
+        start = time.perf_counter()
+        for item_id, item in read_questions(args.input):
+            if item_id in done:
+                counts["skipped"] += 1
+                continue
+            # Only `concurrency` questions are ever read ahead of the answers
+            await slots.acquire()
+            await limiter.wait()
+            task = asyncio.create_task(worker(item_id, item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    stats: Dict[str, Any] = {**counts, "wall_time": elapsed}
+    stats["throughput_per_second"] = counts["answered"] / elapsed if elapsed else 0.0
+    if latencies:
+        stats["latency_seconds"] = percentiles(latencies)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file answers are appended to")
+    parser.add_argument("--model", default="mistral-large2")
+    parser.add_argument("--category", default="ALL")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions in flight at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="max questions started per second (0 = no limit)")
+    parser.add_argument("--no-rag", dest="use_rag", action="store_false", help="answer without retrieval")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="bypass the completion cache")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="overwrite the output file")
+    args = parser.parse_args()
+
+    connection = SnowflakeConnection()
+    if not connection.connect():
+        raise SystemExit("Failed to connect to Snowflake")
+    try:
+        cortex = CortexCompletion(connection.get_pool(), connection.get_root())
+        stats = asyncio.run(run(cortex, args))
+    finally:
+        connection.close()
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class LRUCache:
+    """Thread-safe in-memory cache with LRU eviction and an optional TTL.
+
+    When ``max_bytes`` is set, ``sizeof`` is used to weigh each value and
+    entries are evicted until the total fits.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or _sizeof
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """Store value under key, evicting the least recently used entries"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when key is None"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self._bytes = 0
+            else:
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self._bytes -= old[2]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _sizeof(value) -> int:
+    """Approximate the memory held by a cached value"""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bytes):
+        return len(value)
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+
+class CompletionCache:
+    """Exact-match cache for COMPLETE responses.
+
+    Entries live in a bounded in-memory LRU; when ``db_path`` is set they are
+    also written to a SQLite file so answers survive a Streamlit restart.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 24 * 3600, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.db_path = db_path
+        self.disk_hits = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "create table if not exists completions "
+                    "(key text primary key, response text not null, created_at real not null)"
+                )
+                self._db.execute("delete from completions where created_at < ?", (time.time() - ttl,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Error opening completion cache at {db_path}: {str(e)}")
+                self._db = None
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, category: str, use_rag: bool) -> str:
+        """Hash the inputs that determine a completion"""
+        payload = json.dumps([model_name, prompt, category, bool(use_rag)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached response, checking memory before the SQLite tier"""
+        response = self.memory.get(key)
+        if response is not None or self._db is None:
+            return response
+        with self._db_lock:
+            row = self._db.execute(
+                "select response, created_at from completions where key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        age = time.time() - created_at
+        if age >= self.ttl:
+            with self._db_lock:
+                self._db.execute("delete from completions where key = ?", (key,))
+                self._db.commit()
+            return None
+        self.disk_hits += 1
+        self.memory.set(key, response, ttl=self.ttl - age)
+        return response
+
+    def set(self, key: str, response: str):
+        """Store a response in memory and, if enabled, on disk"""
+        self.memory.set(key, response)
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "insert or replace into completions (key, response, created_at) values (?, ?, ?)",
+                (key, response, time.time()),
+            )
+            self._db.commit()
+
+    def clear(self):
+        """Drop every cached response"""
+        self.memory.invalidate()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("delete from completions")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for both tiers"""
+        stats = self.memory.stats()
+        # A disk hit was first counted as a memory miss
+        stats["hits"] += self.disk_hits
+        stats["misses"] -= self.disk_hits
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["disk_hits"] = self.disk_hits
+        stats["persistent"] = self._db is not None
+        return stats
+
+
+# Shared by every session in the process so repeated questions hit across users
+completion_cache = CompletionCache(
+    max_entries=int(os.getenv("CARECONNECT_COMPLETION_CACHE_SIZE", "512")),
+    db_path=os.getenv("CARECONNECT_COMPLETION_CACHE_DB"),
+)
+
+# Cortex Search responses, keyed on the normalized search request. The TTL is
+# reset from the service's TARGET_LAG when CortexCompletion resolves it.
+retrieval_cache = LRUCache(
+    max_entries=int(os.getenv("CARECONNECT_RETRIEVAL_CACHE_SIZE", "256")),
+    max_bytes=int(os.getenv("CARECONNECT_RETRIEVAL_CACHE_BYTES", str(32 * 1024 * 1024))),
+    ttl=60,
+)
+
+
+# Category list, stage listing and search service settings. Read on every
+# Streamlit rerun, so they are served from here and refreshed after a TTL.
+metadata_cache = LRUCache(
+    max_entries=16,
+    ttl=float(os.getenv("CARECONNECT_METADATA_TTL_SECONDS", "300")),
+)
+
+
+def invalidate_retrieval_cache():
+    """Forget cached search results, e.g. after new documents are ingested"""
+    retrieval_cache.invalidate()
+
+# Callbacks run after documents are ingested, for state derived from the corpus
+_ingestion_listeners = []
+
+def on_documents_ingested(callback: Callable[[], Any]):
+    """Register a callback to run whenever the document corpus changes"""
+    _ingestion_listeners.append(callback)
+
+def notify_documents_ingested():
+    """Invalidate corpus-derived caches after ingestion"""
+    invalidate_retrieval_cache()
+    metadata_cache.invalidate()
+    for callback in list(_ingestion_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error running ingestion listener: {str(e)}")
+
+# Presigned stage URLs expire after URL_EXPIRY_SECONDS; entries are dropped a
+# safety margin early so a link shown to the user is never already stale.
+URL_EXPIRY_SECONDS = 360
+URL_EXPIRY_MARGIN_SECONDS = 60
+document_url_cache = LRUCache(
+    max_entries=int(os.getenv("CARECONNECT_URL_CACHE_SIZE", "1024")),
+    ttl=URL_EXPIRY_SECONDS - URL_EXPIRY_MARGIN_SECONDS,
+)
@@ -1,25 +1,239 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict
 from dotenv import load_dotenv
-from snowflake.connector import connect
-from snowflake.snowpark import Session
-from snowflake.core import Root
+
+if TYPE_CHECKING:
+    # Snowpark and snowflake.core take seconds to import; they are loaded on first connect
+    from snowflake.snowpark import Session
+
+class SessionPool:
+    """Bounded pool of Snowpark sessions shared by every user of the process.
+
+    Sessions are created lazily up to ``max_size``. A session that has sat
+    idle longer than ``health_check_interval`` is pinged on checkout and
+    replaced if the ping fails; a background thread keeps idle sessions
+    alive every ``keepalive_interval`` seconds.
+    """
+
+    def __init__(self, factory: Callable[[], "Session"], min_size: int = 1, max_size: int = 4,
+                 checkout_timeout: float = 30.0, health_check_interval: float = 30.0,
+                 keepalive_interval: float = 300.0):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.keepalive_interval = keepalive_interval
+
+        self._idle = deque()  # (session, last_used)
+        self._pinned = []  # sessions owned elsewhere, only kept alive
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._keepalive_thread = None
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.created = 0
+        self.reconnects = 0
+
+    def warm(self):
+        """Create min_size sessions up front and start the keepalive thread"""
+        sessions = [self.acquire() for _ in range(self.min_size - self._size)]
+        for session in sessions:
+            self.release(session)
+        self._start_keepalive()
+
+    def acquire(self, timeout: float = None) -> "Session":
+        """Check out a healthy session, waiting up to timeout for one to free up"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Session pool is closed")
+                if self._idle:
+                    session, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    session, last_used = None, None
+                    break
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    raise TimeoutError(f"No Snowflake session available after {timeout:.1f}s")
+                waited = True
+                self._cond.wait(remaining)
+
+        try:
+            if session is None:
+                session = self._create()
+            elif time.monotonic() - last_used > self.health_check_interval and not self._ping(session):
+                self._discard(session)
+                with self._cond:
+                    self.reconnects += 1
+                session = self._create()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        wait_time = time.perf_counter() - start
+        with self._cond:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        return session
+
+    def release(self, session: "Session"):
+        """Return a session to the pool"""
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._discard(session)
+                return
+            self._idle.append((session, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, timeout: float = None):
+        """Borrow a session for the duration of a with block"""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def _create(self) -> "Session":
+        session = self.factory()
+        with self._cond:
+            self.created += 1
+        return session
+
+    @staticmethod
+    def _ping(session: "Session") -> bool:
+        try:
+            session.sql("select 1").collect()
+            return True
+        except Exception as e:
+            print(f"Snowflake session failed health check: {str(e)}")
+            return False
+
+    @staticmethod
+    def _discard(session: "Session"):
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    def pin(self, session: "Session"):
+        """Keep a session that is never checked out alive with the idle ones.
+
+        A pinned session that fails its ping is reported, not replaced: its
+        owner holds on to it, so only the owner can reconnect.
+        """
+        with self._cond:
+            self._pinned.append(session)
+        self._start_keepalive()
+
+    def _start_keepalive(self):
+        with self._cond:
+            if self._keepalive_thread is not None or not self.keepalive_interval:
+                return
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, name="snowflake-keepalive", daemon=True
+            )
+        self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """Ping pinned sessions and those idle for a full keepalive interval"""
+        while True:
+            time.sleep(self.keepalive_interval)
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                stale = [entry for entry in self._idle if now - entry[1] >= self.keepalive_interval]
+                for entry in stale:
+                    self._idle.remove(entry)
+                pinned = list(self._pinned)
+            for session in pinned:
+                self._ping(session)
+            for session, _ in stale:
+                if self._ping(session):
+                    self.release(session)
+                else:
+                    self._discard(session)
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool size and checkout metrics"""
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                "created": self.created,
+                "reconnects": self.reconnects,
+                "checkouts": self.checkouts,
+                "checkout_waits": self.waits,
+                "avg_checkout_wait": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                "max_checkout_wait": self.wait_time_max,
+            }
+
+    def close(self):
+        """Close every idle session; sessions in use are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for session, _ in idle:
+            self._discard(session)
 
 class SnowflakeConnection:
-    def __init__(self):
+    def __init__(self, backend=None):
         load_dotenv()
+        # Offline stand-in (see fake_backend.py) used instead of a live account
+        if backend is None and os.getenv("CARECONNECT_BACKEND") == "fake":
+            from fake_backend import FakeBackend
+            backend = FakeBackend.with_sample_data()
+        self.backend = backend
         self.user = os.getenv("SNOWFLAKE_USER")
         self.password = os.getenv("SNOWFLAKE_PASSWORD")
         self.account = os.getenv("SNOWFLAKE_ACCOUNT")
         self.warehouse = os.getenv("SNOWFLAKE_WAREHOUSE", "COMPUTE_WH")
         self.database = os.getenv("SNOWFLAKE_DATABASE", "MEDICAL_CORTEX_SEARCH_APP")
         self.schema = os.getenv("SNOWFLAKE_SCHEMA", "DATA")
-        
-        self.connection = None
+
+        self.pool = SessionPool(
+            self.create_session,
+            min_size=int(os.getenv("SNOWFLAKE_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("SNOWFLAKE_POOL_MAX_SIZE", "4")),
+        )
+        # Dedicated session behind Root, used for Cortex Search REST calls
         self.session = None
         self.root = None
 
-    def create_session(self) -> Session:
+    def create_session(self) -> "Session":
         """Create Snowpark session"""
+        if self.backend is not None:
+            return self.backend.create_session()
+        from snowflake.snowpark import Session
         connection_parameters = {
             "account": self.account,
             "user": self.user,
@@ -33,44 +247,45 @@ class SnowflakeConnection:
     def connect(self):
         """Establish connection to Snowflake"""
         try:
-            # Create Snowpark session
-            self.session = self.create_session()
-            
-            # Create regular connection
-            self.connection = connect(
-                user=self.user,
-                password=self.password,
-                account=self.account,
-                warehouse=self.warehouse,
-                database=self.database,
-                schema=self.schema
-            )
-            
-            # Initialize Root object
-            self.root = Root(self.session)
+            # Log in the minimum number of pooled sessions
+            self.pool.warm()
             return True
         except Exception as e:
             print(f"Error connecting to Snowflake: {str(e)}")
             return False
 
+    def get_pool(self) -> SessionPool:
+        """Return the session pool"""
+        return self.pool
+
     def get_session(self):
-        """Return active session"""
+        """Return the dedicated session behind the Root object.
+
+        Root keeps its session for its whole lifetime, so this session cannot
+        be checked out of the pool and replaced on a failed health check. It
+        is pinned instead, so the pool's keepalive stops it expiring while the
+        app is idle.
+        """
         if not self.session:
-            self.connect()
+            self.session = self.create_session()
+            self.pool.pin(self.session)
         return self.session
 
     def get_root(self):
         """Return root object"""
         if not self.root:
-            self.connect()
+            if self.backend is not None:
+                self.root = self.backend.create_root()
+            else:
+                from snowflake.core import Root
+                self.root = Root(self.get_session())
         return self.root
 
     def close(self):
         """Close Snowflake connection"""
+        self.pool.close()
         if self.session:
             self.session.close()
-        if self.connection:
-            self.connection.close()
     '''
     def upload_to_snowflake(self, file_path: str, file_name: str):
         try:
@@ -1,18 +1,32 @@
-from dataclasses import dataclass
+import uuid
 from typing import List, Optional
-import pandas as pd
+from admission import AdmissionController, admission as default_admission
+from cache import metadata_cache
+from conversation_store import ConversationStore, Message, get_conversation_store
+from metrics import metrics
+from tokens import context_window, count_tokens, truncate_to_tokens
 
-@dataclass
-class Message:
-    role: str
-    content: str
+class ConversationHandler:
+    """Conversation state of one Streamlit session.
 
-history = []
+    Messages live in the conversation store under ``session_id``; with the
+    shared on-disk store a session survives a restart. Recent turns are rendered verbatim within a
+    per-model token budget; turns that fall out of that window are folded
+    into a rolling summary.
+    """
 
-class ConversationHandler:
-    def __init__(self, session):
-        self.session = session
-        self.history: List[Message] = []
+    def __init__(self, pool, history_budget_ratio: float = 0.1, max_history_tokens: int = 2000,
+                 summary_model: str = 'mistral-7b', session_id: str = None, store: ConversationStore = None,
+                 admission: AdmissionController = None):
+        self.pool = pool
+        self.admission = admission or default_admission
+        self.store = store or get_conversation_store()
+        self.session_id = session_id or uuid.uuid4().hex
+        self.history_budget_ratio = history_budget_ratio
+        self.max_history_tokens = max_history_tokens
+        self.summary_model = summary_model
+        # Messages with seq below summarized_seq are folded into the summary
+        self.summary, self.summarized_seq = self.store.load_summary(self.session_id)
         self.available_models = [
             'mixtral-8x7b',
             'snowflake-arctic',
@@ -27,45 +41,142 @@ class ConversationHandler:
 
     def add_message(self, role: str, content: str):
         """Add a message to the conversation history"""
-        self.history.append(Message(role=role, content=content))
-        history.append(Message(role=role, content=content))
+        self.store.append(self.session_id, role, content)
 
     def get_history(self) -> List[Message]:
-        """Get conversation history"""
-        return self.history
-    
-    def fetch_history():
-        return history
+        """Get the whole conversation history; prefer get_page for display"""
+        return self.store.range(self.session_id, 0, 2 ** 62)
+
+    def get_page(self, page_size: int = 20, before_seq: int = None) -> List[Message]:
+        """Up to page_size messages older than before_seq (default: the newest), oldest first"""
+        return self.store.page(self.session_id, page_size, before_seq)
+
+    def message_count(self) -> int:
+        return self.store.count(self.session_id)
 
     def clear_history(self):
         """Clear conversation history"""
-        self.history = []
+        self.store.clear(self.session_id)
+        self.summary = ""
+        self.summarized_seq = 0
+
+    def history_budget(self, model_name: str) -> int:
+        """Token budget for the chat history part of a prompt to model_name"""
+        return min(self.max_history_tokens, int(context_window(model_name) * self.history_budget_ratio))
+
+    def render_history(self, model_name: str) -> str:
+        """Render the conversation for a prompt within the model's history budget"""
+        budget = self.history_budget(model_name)
+        summary_budget = budget // 4
+
+        # Walk back from the newest message while the verbatim window fits;
+        # only the rows walked over are read from the store
+        verbatim_budget = budget - summary_budget
+        lines = []
+        costs = []
+        seqs = []
+        newest_seq = None
+        overflow = False
+        for message in self.store.iter_tail(self.session_id, after_seq=self.summarized_seq - 1):
+            if newest_seq is None:
+                newest_seq = message.seq
+            line = message.render()
+            cost = count_tokens(line) + 1
+            if sum(costs) + cost > verbatim_budget:
+                overflow = True
+                break
+            lines.append(line)
+            costs.append(cost)
+            seqs.append(message.seq)
+
+        if overflow:
+            # Fold down to half the window so the summary is refreshed every
+            # few turns rather than on every turn once the budget is reached
+            while lines and sum(costs) > verbatim_budget // 2:
+                lines.pop()
+                costs.pop()
+                seqs.pop()
+            start = seqs[-1] if seqs else newest_seq + 1
+            self._update_summary(self.store.range(self.session_id, self.summarized_seq, start), summary_budget)
+            self.summarized_seq = start
+            self.store.save_summary(self.session_id, self.summary, self.summarized_seq)
+
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        parts.extend(reversed(lines))
+        return "\n".join(parts)
+
+    def _update_summary(self, messages: List[Message], max_tokens: int):
+        """Fold messages that left the verbatim window into the rolling summary"""
+        conversation = "\n".join(msg.render() for msg in messages)
+        prompt = (
+            f"Update the summary of a patient conversation in at most {max(max_tokens * 3 // 4, 20)} words. "
+            "Keep medications, dosages, symptoms and facts the patient shared.\n"
+            f"<summary>{self.summary}</summary>\n"
+            f"<new_messages>\n{conversation}\n</new_messages>\n"
+            "Updated summary:"
+        )
+        try:
+            with self.admission.admit("complete"), self.pool.session() as session:
+                rows = session.sql(
+                    "select snowflake.cortex.complete(?, ?) as response",
+                    params=[self.summary_model, prompt]
+                ).collect()
+            summary = str(rows[0].RESPONSE).strip() if rows else ""
+        except Exception as e:
+            print(f"Error summarizing history: {str(e)}")
+            summary = ""
+        if not summary:
+            # Keep the newest part of the raw text rather than losing the turns
+            summary = f"{self.summary} {' '.join(conversation.split())}".strip()
+            summary = summary[-max_tokens * 4:]
+        self.summary = truncate_to_tokens(summary, max_tokens)
 
     @property
     def last_message(self) -> Optional[Message]:
         """Get the last message in the conversation"""
-        return self.history[-1] if self.history else None
+        return self.store.last(self.session_id)
 
+    @metrics.timed("get_available_categories")
     def get_available_categories(self) -> List[str]:
         """Get available document categories with caching"""
+        cached = metadata_cache.get("categories")
+        if cached is not None:
+            return list(cached)
+        def query():
+            with self.pool.session() as session:
+                return session.sql(
+                    "select category from data.docs_chunks_table group by category"
+                ).collect()
+
         try:
-            categories = self.session.sql(
-                "select category from data.docs_chunks_table group by category"
-            ).collect()
+            # Sessions that miss the cache together run the group-by once
+            categories = self.admission.run("metadata", "categories", query)
             
             cat_list = ['ALL']
             for cat in categories:
                 cat_list.append(cat.CATEGORY)
-            return cat_list
+            metadata_cache.set("categories", cat_list)
+            return list(cat_list)
         except Exception as e:
             print(f"Error getting categories: {str(e)}")
             return ['ALL']
 
-    def get_available_documents(self) -> pd.DataFrame:
+    def get_available_documents(self) -> "pd.DataFrame":
         """Get list of available documents"""
-        try:
-            docs_available = self.session.sql("ls @data.docs").collect()
-            return pd.DataFrame([{"name": doc["name"]} for doc in docs_available])
-        except Exception as e:
-            print(f"Error getting documents: {str(e)}")
-            return pd.DataFrame(columns=["name"])
+        import pandas as pd
+        names = metadata_cache.get("documents")
+        if names is None:
+            def query():
+                with self.pool.session() as session:
+                    return session.sql("ls @data.docs").collect()
+
+            try:
+                docs_available = self.admission.run("metadata", "documents", query)
+                names = [doc["name"] for doc in docs_available]
+                metadata_cache.set("documents", names)
+            except Exception as e:
+                print(f"Error getting documents: {str(e)}")
+                names = []
+        return pd.DataFrame({"name": names})
@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+class Message:
+    """One stored chat message; ``seq`` is its position in the session"""
+
+    __slots__ = ("role", "content", "seq")
+
+    def __init__(self, role: str, content: str, seq: int = -1):
+        self.role = role
+        self.content = content
+        self.seq = seq
+
+    def __eq__(self, other):
+        return isinstance(other, Message) and (self.role, self.content, self.seq) == (
+            other.role, other.content, other.seq)
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r}, seq={self.seq})"
+
+    def render(self) -> str:
+        """Render the message as a single compact prompt line"""
+        return f"{self.role.capitalize()}: {' '.join(self.content.split())}"
+
+class ConversationStore:
+    """Append-only message log partitioned by session id, in SQLite.
+
+    Messages are keyed by (session_id, seq), so a page or a tail is a range
+    scan of the primary key. Without ``db_path`` the store lives in memory.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or ":memory:"
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Next seq per session, so an append needs no read
+        self._next_seq: Dict[str, int] = {}
+        if self.db_path != ":memory:":
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute("pragma synchronous=normal")
+        self._db.execute(
+            "create table if not exists messages (session_id text not null, seq integer not null, "
+            "role text not null, content text not null, created_at real not null, "
+            "primary key (session_id, seq)) without rowid"
+        )
+        self._db.execute(
+            "create table if not exists summaries (session_id text primary key, summary text not null, "
+            "summarized_seq integer not null)"
+        )
+        self._db.commit()
+
+    def _fetch(self, sql: str, params: tuple) -> List[Message]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [Message(role, content, seq) for seq, role, content in rows]
+
+    def append(self, session_id: str, role: str, content: str) -> int:
+        """Add a message at the end of the session; returns its seq"""
+        with self._lock:
+            seq = self._next_seq.get(session_id)
+            if seq is None:
+                row = self._db.execute(
+                    "select max(seq) from messages where session_id = ?", (session_id,)
+                ).fetchone()
+                seq = 0 if row[0] is None else row[0] + 1
+            self._db.execute(
+                "insert into messages (session_id, seq, role, content, created_at) values (?, ?, ?, ?, ?)",
+                (session_id, seq, role, content, time.time()),
+            )
+            self._db.commit()
+            self._next_seq[session_id] = seq + 1
+        return seq
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "select count(*) from messages where session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def page(self, session_id: str, limit: int = 20, before_seq: Optional[int] = None) -> List[Message]:
+        """Up to limit messages before before_seq (default: the newest), oldest first"""
+        if before_seq is None:
+            messages = self._fetch(
+                "select seq, role, content from messages where session_id = ? order by seq desc limit ?",
+                (session_id, limit),
+            )
+        else:
+            messages = self._fetch(
+                "select seq, role, content from messages where session_id = ? and seq < ? "
+                "order by seq desc limit ?",
+                (session_id, before_seq, limit),
+            )
+        messages.reverse()
+        return messages
+
+    def range(self, session_id: str, start_seq: int, end_seq: int) -> List[Message]:
+        """Messages with start_seq <= seq < end_seq, oldest first"""
+        return self._fetch(
+            "select seq, role, content from messages where session_id = ? and seq >= ? and seq < ? order by seq",
+            (session_id, start_seq, end_seq),
+        )
+
+    def iter_tail(self, session_id: str, after_seq: int = -1, batch_size: int = 16) -> Iterator[Message]:
+        """Yield messages newest first, stopping at after_seq.
+
+        Rows are read in small batches, so a caller that stops early (for
+        instance once a token budget is spent) never loads the whole history.
+        """
+        before = None
+        while True:
+            batch = self.page(session_id, batch_size, before)
+            for message in reversed(batch):
+                if message.seq <= after_seq:
+                    return
+                yield message
+            if len(batch) < batch_size:
+                return
+            before = batch[0].seq
+
+    def last(self, session_id: str) -> Optional[Message]:
+        messages = self.page(session_id, 1)
+        return messages[0] if messages else None
+
+    def load_summary(self, session_id: str) -> Tuple[str, int]:
+        """Rolling summary and the seq up to which messages are folded into it"""
+        with self._lock:
+            row = self._db.execute(
+                "select summary, summarized_seq from summaries where session_id = ?", (session_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_summary(self, session_id: str, summary: str, summarized_seq: int):
+        with self._lock:
+            self._db.execute(
+                "insert or replace into summaries (session_id, summary, summarized_seq) values (?, ?, ?)",
+                (session_id, summary, summarized_seq),
+            )
+            self._db.commit()
+
+    def clear(self, session_id: str):
+        """Delete a session's messages and summary"""
+        with self._lock:
+            self._db.execute("delete from messages where session_id = ?", (session_id,))
+            self._db.execute("delete from summaries where session_id = ?", (session_id,))
+            self._db.commit()
+            self._next_seq.pop(session_id, None)
+
+# Outside any checkout, so neither the working directory nor a module import decides where history lands
+DEFAULT_CONVERSATION_DB = os.path.join(os.path.expanduser("~"), ".careconnect", "conversations.sqlite")
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+def get_conversation_store() -> ConversationStore:
+    """Process-wide store, opened on first use.
+
+    CARECONNECT_CONVERSATION_DB sets the file (resolved to an absolute path
+    once); set it to "" to keep history in memory.
+    """
+    global _conversation_store
+    with _conversation_store_lock:
+        if _conversation_store is None:
+            db_path = os.getenv("CARECONNECT_CONVERSATION_DB", DEFAULT_CONVERSATION_DB)
+            if db_path:
+                db_path = os.path.abspath(os.path.expanduser(db_path))
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            _conversation_store = ConversationStore(db_path or None)
+        return _conversation_store
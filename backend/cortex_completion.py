@@ -1,116 +1,377 @@
+import asyncio
+import functools
+import hashlib
 import json
-from typing import Tuple, List, Dict, Any
-#  add historcial chat data
-from conversation_handler import ConversationHandler
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Tuple, List, Dict, Any, Iterator
+from admission import AdmissionController, Overloaded, admission as default_admission
+from bm25 import BM25Index
+from cache import (
+    CompletionCache,
+    LRUCache,
+    URL_EXPIRY_SECONDS,
+    metadata_cache,
+    completion_cache as default_completion_cache,
+    document_url_cache as default_document_url_cache,
+    retrieval_cache as default_retrieval_cache,
+)
+from metrics import metrics
+from model_router import ModelRouter, model_router as default_model_router
+from prompt_builder import build_prompt, parse_results
+from rerank import Reranker
+from semantic_cache import SemanticCache, semantic_cache as default_semantic_cache
+from tokens import count_tokens
+
+# Bounded pool that runs blocking Snowpark calls for the async API; shared by
+# every session in the process so concurrent users overlap their I/O
+io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CARECONNECT_IO_THREADS", "8")),
+    thread_name_prefix="cortex-io",
+)
 
 class CortexCompletion:
-    def __init__(self, session, root):
-        self.session = session
+    NO_RESPONSE_TEXT = "Sorry, I couldn't generate a response."
+
+    def __init__(self, pool, root, completion_cache: CompletionCache = None, retrieval_cache: LRUCache = None,
+                 document_url_cache: LRUCache = None, router: ModelRouter = None,
+                 semantic_cache: SemanticCache = None, admission: AdmissionController = None):
+        self.pool = pool
         self.root = root
+        # An empty LRUCache is falsy, so test for None rather than using `or`
+        self.completion_cache = default_completion_cache if completion_cache is None else completion_cache
+        self.retrieval_cache = default_retrieval_cache if retrieval_cache is None else retrieval_cache
+        self.document_url_cache = default_document_url_cache if document_url_cache is None else document_url_cache
+        self.executor = io_executor
+        self.router = router or default_model_router
+        self.semantic_cache = semantic_cache or default_semantic_cache
+        # Identical concurrent backend calls share one result; each operation has a concurrency limit
+        self.admission = admission or default_admission
         self.NUM_CHUNKS = 3
+        # Two-stage retrieval: fetch a wider candidate set, rerank it locally on CPU
+        self.reranker = None
+        if os.getenv("CARECONNECT_RERANK", "0") == "1":
+            self.reranker = Reranker(
+                candidates=int(os.getenv("CARECONNECT_RERANK_CANDIDATES", "20")),
+                threshold=float(os.getenv("CARECONNECT_RERANK_THRESHOLD", "0.1")),
+                max_tokens=int(os.getenv("CARECONNECT_RERANK_MAX_TOKENS", "1500")),
+                baseline_chunks=self.NUM_CHUNKS,
+            )
         self.CORTEX_SEARCH_DATABASE = "MEDICAL_CORTEX_SEARCH_APP"
         self.CORTEX_SEARCH_SCHEMA = "DATA"
         self.CORTEX_SEARCH_SERVICE = "CC_SEARCH_SERVICE_CS"
         self.COLUMNS = ["chunk", "relative_path", "category"]
+        self.last_stream_stats: Dict[str, Any] = {}
+        self.last_prompt_stats: Dict[str, Any] = {}
+        self.last_rerank_stats: Dict[str, Any] = {}
+        self.last_model_used = None
+        # Set by a RetrievalPrefetcher: turns naming a prefetched drug reuse its search results
+        self.prefetcher = None
+        # Unpinned streams move on to the next routed model if no token arrives in time
+        self.first_token_deadline = float(os.getenv("CARECONNECT_FIRST_TOKEN_DEADLINE_SECONDS", "10"))
         
         self.search_service = self.root.databases[self.CORTEX_SEARCH_DATABASE].schemas[
             self.CORTEX_SEARCH_SCHEMA
         ].cortex_search_services[self.CORTEX_SEARCH_SERVICE]
+        # "remote" (Cortex Search), "local" (local_search snapshot) or "local-first"
+        self.retrieval_mode = os.getenv("CARECONNECT_RETRIEVAL_MODE", "remote")
+        self.local_index = None
+        if self.retrieval_mode != "remote":
+            from local_search import get_local_index
+            self.local_index = get_local_index(pool)
+        # Search results can be reused until the service could have refreshed
+        self.retrieval_cache.ttl = self.get_search_target_lag()
+
+    def get_search_target_lag(self, default: float = 60.0) -> float:
+        """Return the search service's TARGET_LAG in seconds"""
+        cached = metadata_cache.get("search_target_lag")
+        if cached is not None:
+            return cached
+        def show_service():
+            with self.pool.session() as session:
+                return session.sql(
+                    f"show cortex search services like '{self.CORTEX_SEARCH_SERVICE}'"
+                ).collect()
 
-    def get_similar_chunks(self, query: str, category: str = "ALL") -> Dict[str, Any]:
-        """Get similar chunks from the search service"""
         try:
-            if category == "ALL":
-                response = self.search_service.search(query, self.COLUMNS, limit=self.NUM_CHUNKS)
-            else:
-                filter_obj = {"@eq": {"category": category}}
-                response = self.search_service.search(
-                    query, self.COLUMNS, filter=filter_obj, limit=self.NUM_CHUNKS
-                )
-            
-            # Convert response to dictionary if it's not already
-            if not isinstance(response, dict):
-                response_data = response.json()
-            else:
-                response_data = response
-                
+            rows = self.admission.run("metadata", "search_target_lag", show_service)
+            if rows:
+                target_lag = _parse_target_lag(rows[0]["target_lag"], default)
+                metadata_cache.set("search_target_lag", target_lag)
+                return target_lag
+        except Exception as e:
+            print(f"Error getting search service target lag: {str(e)}")
+        return default
+
+    def _retrieval_key(self, query: str, category: str, rerank_query: str = None) -> str:
+        """Hash the normalized search request"""
+        normalized = " ".join(query.split())
+        request = [normalized, category, self.NUM_CHUNKS, self.COLUMNS]
+        if self.reranker is not None and self.reranker.enabled:
+            request += [self.reranker.candidates, " ".join((rerank_query or query).split())]
+        payload = json.dumps(request, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def invalidate_retrieval_cache(self):
+        """Forget cached search results after new documents are ingested"""
+        self.retrieval_cache.invalidate()
+        if self.local_index is not None:
+            self.executor.submit(self.local_index.sync)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Return hit/miss statistics of the completion and retrieval caches"""
+        return {
+            "completion": self.completion_cache.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+            "document_urls": self.document_url_cache.stats(),
+            "semantic": self.semantic_cache.stats() if self.semantic_cache else None,
+        }
+
+    @metrics.timed("get_similar_chunks")
+    def get_similar_chunks(self, query: str, category: str = "ALL", use_cache: bool = True,
+                           rerank_query: str = None) -> Dict[str, Any]:
+        """Get similar chunks from the search service.
+
+        With reranking on, a wider candidate set is rescored against
+        rerank_query (default: query). The reranker's statistics for this
+        call are left in ``last_rerank_stats``, outside the cached response,
+        so a cache hit reports no reranking time.
+        """
+        retrieval_key = self._retrieval_key(query, category, rerank_query)
+        self.last_rerank_stats = {}
+        if use_cache:
+            cached = self.retrieval_cache.get(retrieval_key)
+            if cached is not None:
+                if self.reranker is not None and self.reranker.enabled:
+                    self.last_rerank_stats = {"rerank_seconds": 0.0}
+                return cached
+        try:
+            # Concurrent identical searches share one request
+            response_data, self.last_rerank_stats = self.admission.run(
+                "search", retrieval_key, self._fetch_chunks, query, category, rerank_query
+            )
+            # Unless reranking was turned off mid-request (the model failed to
+            # load) or failed for this call, the key still describes how the
+            # response was built
+            reranked = self.reranker is None or not self.reranker.enabled or bool(self.last_rerank_stats)
+            if use_cache and reranked and self._retrieval_key(query, category, rerank_query) == retrieval_key:
+                self.retrieval_cache.set(retrieval_key, response_data)
             return response_data
+        except Overloaded:
+            # An answer without its context would be wrong, and cached as if right
+            raise
         except Exception as e:
             print(f"Error getting similar chunks: {str(e)}")
             return {"results": []}
 
-    def create_prompt(self, question: str, use_rag: bool, prescription_text,category: str = "ALL") -> Tuple[str, set]:
-        """Create prompt for completion"""
-        if use_rag:
-            # preprocess the prescription text  remove the special characters and unnecessary spaces
-            # prescription_text = " ".join(prescription_text) if prescription_text else ""
-            question_enriched = question + " \n this prescription \n " + prescription_text
-            prompt_context = self.get_similar_chunks(question_enriched, category)
-            # Extract context information from chunks
-            context_info = []
-            relative_paths = set()
-            # print("debug create prompt")
-            json_data = json.loads(prompt_context)
-            relative_paths = set(item['relative_path'] for item in json_data['results'])
-            # if "results" in prompt_context and isinstance(prompt_context["results"], list):
-            #     for result in prompt_context["results"]:
-            #         # Validate that result is a dictionary
-            #         if isinstance(result, dict):
-            #             # chunk = result.get("chunk", "")
-            #             relative_path = result["relative_path"]
-
-            #             # Append the chunk if available
-            #             # if chunk:
-            #             #     context_info.append(chunk)
-
-            #             # Add the relative path if available
-            #             if relative_path:
-            #                 relative_paths.add(relative_path)
-            #         else:
-            #             print(f"Debug - Invalid result format: {result}")
-            
-            context_text = "\n".join(context_info)
-            # print(prescription_text)
-            combined_text=prompt_context+prescription_text
-            # print("Debug - Context text: ", context_text)
-            chat_history = ConversationHandler.fetch_history()
-            prompt = f"""
-                You are an expert chat assistance that extracts information from the CONTEXT provided
-                between <context> and </context> tags.
-                When answering the question contained between <question> and </question> tags
-                be concise and do not hallucinate. 
-                If you don't have the information just say i do not know.
-                Only answer the question if you can extract it from the CONTEXT provided.
-                
-                Do not mention the CONTEXT used in your answer.
-                <chat_history>
-                {chat_history}
-                </chat_history>
-                <context>          
-                {combined_text}
-                </context>
-                
+    def _fetch_chunks(self, query: str, category: str, rerank_query: str = None) -> Tuple[Any, Dict[str, Any]]:
+        """Search, and rerank the candidates when two-stage retrieval is on; returns (response, rerank stats)"""
+        rerank = self.reranker is not None and self.reranker.enabled
+        limit = self.reranker.candidates if rerank else self.NUM_CHUNKS
+        if category == "ALL":
+            response = self._search(query, limit=limit)
+        else:
+            filter_obj = {"@eq": {"category": category}}
+            response = self._search(query, filter=filter_obj, limit=limit)
+        
+        # Convert response to dictionary if it's not already
+        if not isinstance(response, dict):
+            response_data = response.json()
+        else:
+            response_data = response
+
+        stats = {}
+        if rerank:
+            results, stats = self.reranker.select(rerank_query or query, parse_results(response_data))
+            response_data = json.dumps({"results": results})
+        return response_data, stats
+
+    def _search(self, query: str, **kwargs):
+        """Run a search on the tier selected by retrieval_mode"""
+        if self.local_index is not None:
+            try:
+                response = self.local_index.search(query, self.COLUMNS, **kwargs)
+                if response.results or self.retrieval_mode == "local":
+                    return response
+            except Exception as e:
+                if self.retrieval_mode == "local":
+                    raise
+                print(f"Local search unavailable, using Cortex Search: {str(e)}")
+        return self.search_service.search(query, self.COLUMNS, **kwargs)
 
-                <question>  
-                {question}
-                </question>
-                Answer: 
-                """
+    def search_candidates(self, query: str, category: str = "ALL", limit: int = 20) -> List[Dict[str, Any]]:
+        """Up to limit search results for query, uncached, for a caller that ranks them itself"""
+        kwargs = {"limit": limit}
+        if category != "ALL":
+            kwargs["filter"] = {"@eq": {"category": category}}
+
+        def search():
+            response = self._search(query, **kwargs)
+            return parse_results(response if isinstance(response, dict) else response.json())
+
+        return self.admission.run("search", ("candidates", query, category, limit), search)
+
+    def rank_candidates(self, question: str, results: List[Dict[str, Any]]) -> str:
+        """Search response holding the candidates that best match question.
+
+        Uses the reranker when it is on, otherwise BM25 over the chunk text,
+        keeping search order if no candidate shares a term with the question.
+        """
+        if self.reranker is not None and self.reranker.enabled:
+            kept, self.last_rerank_stats = self.reranker.select(question, results)
+            return json.dumps({"results": kept})
+        ranked = [idx for idx, _ in BM25Index([r.get("chunk") or "" for r in results]).top_k(question, self.NUM_CHUNKS)]
+        if not ranked:
+            ranked = list(range(min(self.NUM_CHUNKS, len(results))))
+        return json.dumps({"results": [results[idx] for idx in ranked]})
+
+    def retrieve(self, question: str, prescription_text: str, category: str = "ALL", use_cache: bool = True):
+        """Search response for a turn, from the prefetched results when the question names a prefetched drug"""
+        self.last_rerank_stats = {}
+        if self.prefetcher is not None:
+            try:
+                prefetched = self.prefetcher.search_response(question, category)
+                if prefetched is not None:
+                    return prefetched
+            except Exception as e:
+                print(f"Error using prefetched results: {str(e)}")
+        return self.get_similar_chunks(
+            self.search_query(question, prescription_text), category, use_cache, rerank_query=question
+        )
+
+    def search_query(self, question: str, prescription_text: str) -> str:
+        """Build the Cortex Search query for a question about a prescription"""
+        return question + " \n this prescription \n " + prescription_text
+
+    @metrics.timed("create_prompt")
+    def create_prompt(self, question: str, use_rag: bool, prescription_text,category: str = "ALL", chat_history: str = "",
+                      search_response=None, model_name: str = None) -> Tuple[str, set]:
+        """Create prompt for completion.
+
+        ``search_response`` lets a caller that already ran retrieval skip it;
+        model_name sets the token budget of the retrieved context.
+        """
+        context_stats = {}
+        if use_rag:
+            if search_response is None:
+                search_response = self.retrieve(question, prescription_text, category)
+            prompt, relative_paths, context_stats = build_prompt(
+                question, search_response, prescription_text, chat_history, model_name, report=metrics.enabled
+            )
         else:     
             prompt = f"Question: {question}\nAnswer:"
             relative_paths = set()
                 
+        if metrics.enabled:
+            self.last_prompt_stats = {"prompt_chars": len(prompt), "prompt_tokens": count_tokens(prompt), **context_stats}
+            if use_rag:
+                self.last_prompt_stats.update(self.last_rerank_stats)
         return prompt, relative_paths
 
-    def complete(self, question: str, model_name: str, use_rag: bool, prescription_text:str, category: str = "ALL") -> Tuple[str, set]:
-        """Complete the prompt using Snowflake Cortex"""
+    def complete(self, question: str, model_name: str, use_rag: bool, prescription_text:str, category: str = "ALL", use_cache: bool = True, chat_history: str = "",
+                 pin_model: bool = True, prescription_key: str = None) -> Tuple[str, set]:
+        """Complete the prompt using Snowflake Cortex.
+
+        With ``pin_model`` off, model_name is only a preference and the router
+        may pick a faster model; the model used is left in ``last_model_used``.
+        prescription_key identifies the upload behind prescription_text (its
+        content hash) for the semantic cache.
+        """
+        self.last_prompt_stats = {}
+        scope = self._semantic_scope(category, use_rag, prescription_key or prescription_text, use_cache, chat_history)
+        hit = self._semantic_get(question, scope)
+        if hit:
+            self.last_model_used = None
+            return hit["response"], set(hit["relative_paths"])
         # print("Debug - Completing prompt")
-        prompt, relative_paths = self.create_prompt(question, use_rag,prescription_text, category)
+        prompt, relative_paths = self.create_prompt(question, use_rag,prescription_text, category, chat_history,
+                                                    model_name=model_name)
         # print(f"Debug - Prompt: {prompt}")
+        response_text = self._complete_routed(model_name, prompt, category, use_rag, use_cache, pin_model)
+        self._semantic_set(question, scope, response_text, relative_paths)
+        return response_text, relative_paths
+
+    def _semantic_scope(self, category: str, use_rag: bool, prescription: str, use_cache: bool,
+                        chat_history: str):
+        """Semantic cache scope of a turn, or None if the turn must not use the cache.
+
+        prescription identifies the upload, not the excerpt chosen for this
+        question, so paraphrases about one prescription share a scope. Follow-up
+        questions depend on the conversation, so only turns without chat
+        history are matched against other sessions' questions.
+        """
+        if not use_cache or chat_history or self.semantic_cache is None:
+            return None
+        return SemanticCache.scope(category, use_rag, prescription)
+
+    def _semantic_get(self, question: str, scope) -> Dict[str, Any]:
+        if scope is None:
+            return None
+        try:
+            with metrics.span("semantic_cache"):
+                return self.semantic_cache.get(question, scope)
+        except Exception as e:
+            print(f"Error reading semantic cache: {str(e)}")
+            return None
+
+    def _semantic_set(self, question: str, scope, response_text: str, relative_paths):
+        if scope is None or response_text == self.NO_RESPONSE_TEXT:
+            return
+        try:
+            self.semantic_cache.set(question, scope, response_text, relative_paths)
+        except Exception as e:
+            print(f"Error writing semantic cache: {str(e)}")
+
+    def _complete_routed(self, model_name: str, prompt: str, category: str, use_rag: bool, use_cache: bool,
+                         pin_model: bool) -> str:
+        """Complete on the pinned model, or on the first routed candidate that answers in time"""
+        prompt_tokens = count_tokens(prompt)
+        candidates = [model_name] if pin_model else self.router.candidates(prompt_tokens, preferred=model_name)
+        if use_cache:
+            # An answer cached for any acceptable model is as good as a new one
+            for model in candidates:
+                cached = self.completion_cache.get(CompletionCache.make_key(model, prompt, category, use_rag))
+                if cached is not None:
+                    self.last_model_used = model
+                    return cached
+
+        if pin_model:
+            # The user's choice is honored as is: no deadline, no fallback
+            start = time.perf_counter()
+            try:
+                response_text = self._complete_blocking(model_name, prompt)
+            except Overloaded:
+                raise
+            except Exception:
+                self.router.observe(model_name, time.perf_counter() - start, prompt_tokens, error=True)
+                raise
+            self.router.observe(model_name, time.perf_counter() - start, prompt_tokens)
+            model = model_name
+        else:
+            response_text, model = self.router.run(
+                lambda candidate: self._complete_blocking(candidate, prompt), candidates, prompt_tokens
+            )
+        self.last_model_used = model
+        if use_cache and response_text != self.NO_RESPONSE_TEXT:
+            self.completion_cache.set(CompletionCache.make_key(model, prompt, category, use_rag), response_text)
+        return response_text
+
+    def _complete_blocking(self, model_name: str, prompt: str) -> str:
+        """Run COMPLETE, sharing the call with identical in-flight requests"""
+        return self.admission.run("complete", (model_name, prompt), self._run_complete, model_name, prompt)
+
+    @metrics.timed("complete")
+    def _run_complete(self, model_name: str, prompt: str) -> str:
+        """Run COMPLETE as a single SQL statement and return the full response"""
         cmd = "select snowflake.cortex.complete(?, ?) as response"
         
         # Execute the completion
-        df_response = self.session.sql(cmd, params=[model_name, prompt]).collect()
+        with self.pool.session() as session:
+            df_response = session.sql(cmd, params=[model_name, prompt]).collect()
         # print(f"Debug - df_response type: {type(df_response)}")
         # print(f"Debug - df_response content: {df_response}")
         # Safely access the response
@@ -120,11 +381,281 @@ class CortexCompletion:
 
             response_text = str(df_response[0].RESPONSE)
         else:
-            response_text = "Sorry, I couldn't generate a response."
+            response_text = self.NO_RESPONSE_TEXT
         # print(f"Debug - Response type: {type(df_response)}")
         # print(f"Debug - Response content: {df_response}")
         
-        return response_text, relative_paths
+        return response_text
+
+    @metrics.timed("complete_many")
+    def complete_many(self, prompts: List[str], model_name: str, category: str = "ALL", use_rag: bool = False,
+                      use_cache: bool = True, max_batch_size: int = 50,
+                      max_batch_bytes: int = 1_000_000) -> List[Dict[str, Any]]:
+        """Complete many prompts with one SQL statement per batch.
+
+        Results come back in input order as dicts with ``response``, ``error``
+        and ``cached``; a failed item does not fail the rest of its batch.
+        Cache keys follow the interactive path, so answers are shared with it.
+        """
+        results: List[Dict[str, Any]] = [None] * len(prompts)
+        pending: Dict[str, List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            if use_cache:
+                cached = self.completion_cache.get(CompletionCache.make_key(model_name, prompt, category, use_rag))
+                if cached is not None:
+                    results[i] = {"response": cached, "error": None, "cached": True}
+                    continue
+            # Identical prompts are sent once
+            pending.setdefault(prompt, []).append(i)
+
+        for batch in _batches(list(pending), max_batch_size, max_batch_bytes):
+            try:
+                responses = self._complete_batch(model_name, batch)
+            except Exception as e:
+                print(f"Error in batched completion: {str(e)}")
+                responses = [e] * len(batch)
+            for prompt, response in zip(batch, responses):
+                if isinstance(response, str):
+                    result = {"response": response, "error": None, "cached": False}
+                    if use_cache:
+                        self.completion_cache.set(CompletionCache.make_key(model_name, prompt, category, use_rag), response)
+                else:
+                    error = str(response) if response is not None else "COMPLETE returned no response"
+                    result = {"response": None, "error": error, "cached": False}
+                for i in pending[prompt]:
+                    results[i] = result
+        return results
+
+    def answer_many(self, questions: List[str], model_name: str, use_rag: bool, prescription_text: str = "",
+                    category: str = "ALL", use_cache: bool = True, **batch_options) -> List[Dict[str, Any]]:
+        """Batched ``complete``: prompts are built exactly as for an interactive turn"""
+        prompts, paths = [], []
+        for question in questions:
+            prompt, relative_paths = self.create_prompt(question, use_rag, prescription_text, category,
+                                                        model_name=model_name)
+            prompts.append(prompt)
+            paths.append(relative_paths)
+        results = self.complete_many(prompts, model_name, category, use_rag, use_cache, **batch_options)
+        for result, relative_paths in zip(results, paths):
+            result["relative_paths"] = relative_paths
+        return results
+
+    def _complete_batch(self, model_name: str, prompts: List[str]) -> List[Any]:
+        """Run TRY_COMPLETE over a VALUES list; None marks an item that failed"""
+        values = ", ".join("(?, ?)" for _ in prompts)
+        params = [model_name] + [item for i, prompt in enumerate(prompts) for item in (i, prompt)]
+        cmd = (
+            "select column1 as idx, snowflake.cortex.try_complete(?, column2) as response "
+            f"from values {values}"
+        )
+        with self.admission.admit("complete"), self.pool.session() as session:
+            rows = session.sql(cmd, params=params).collect()
+        responses: List[Any] = [None] * len(prompts)
+        for row in rows:
+            if row["RESPONSE"] is not None:
+                responses[int(row["IDX"])] = str(row["RESPONSE"])
+        return responses
+
+    def complete_stream(self, question: str, model_name: str, use_rag: bool, prescription_text: str, category: str = "ALL", use_cache: bool = True, chat_history: str = "",
+                        pin_model: bool = True, prescription_key: str = None) -> Tuple[Iterator[str], set]:
+        """Complete the prompt using Snowflake Cortex, yielding text as it is generated.
+
+        The prompt (and retrieval) is built eagerly so the related paths are
+        known up front; the returned generator only drives generation.
+        Timings of the last stream are left in ``last_stream_stats``. Unpinned
+        streams go to the router's first candidate; if it sends no token within
+        ``first_token_deadline`` seconds the next candidate is tried, which is
+        safe since nothing has been shown yet.
+        """
+        self.last_prompt_stats = {}
+        scope = self._semantic_scope(category, use_rag, prescription_key or prescription_text, use_cache, chat_history)
+        hit = self._semantic_get(question, scope)
+        if hit:
+            self.last_model_used = None
+            return self._stream_cached(hit["response"]), set(hit["relative_paths"])
+        prompt, relative_paths = self.create_prompt(question, use_rag, prescription_text, category, chat_history,
+                                                    model_name=model_name)
+        fallbacks = []
+        if not pin_model:
+            model_name, *fallbacks = self.router.candidates(count_tokens(prompt), preferred=model_name)
+        self.last_model_used = model_name
+        cache_key = CompletionCache.make_key(model_name, prompt, category, use_rag) if use_cache else None
+        stream = self._stream_completion(model_name, prompt, cache_key, fallbacks)
+        if scope is not None:
+            stream = self._remember_stream(stream, question, scope, relative_paths)
+        return stream, relative_paths
+
+    def _stream_cached(self, response_text: str) -> Iterator[str]:
+        """Yield a cached answer as a single chunk"""
+        start = time.perf_counter()
+        yield response_text
+        elapsed = time.perf_counter() - start
+        self.last_stream_stats = {
+            "streamed": False,
+            "cached": True,
+            "complete": True,
+            "time_to_first_token": elapsed,
+            "total_time": elapsed,
+        }
+
+    def _remember_stream(self, stream: Iterator[str], question: str, scope: str, relative_paths) -> Iterator[str]:
+        """Pass a stream through and store the full answer in the semantic cache"""
+        parts = []
+        for chunk in stream:
+            parts.append(chunk)
+            yield chunk
+        if self.last_stream_stats.get("complete"):
+            self._semantic_set(question, scope, "".join(parts), relative_paths)
+
+    def _stream_tokens(self, model_name: str, prompt: str) -> Iterator[str]:
+        """Stream COMPLETE output through the Cortex REST API"""
+        with self.admission.admit("complete"), self.pool.session() as session:
+            if hasattr(session, "stream_complete"):
+                # The offline stand-in simulates streaming itself
+                yield from session.stream_complete(model_name, prompt)
+                return
+            from snowflake.cortex import Complete
+            yield from Complete(model_name, prompt, session=session, stream=True)
+
+    def _stream_with_deadline(self, model_name: str, prompt: str, deadline: float) -> Iterator[str]:
+        """Stream model_name's output, raising TimeoutError if no token arrives within deadline.
+
+        Tokens are read on a background thread; an abandoned stream is closed
+        at its next token, which frees its session and admission slot.
+        """
+        chunks: "queue.Queue" = queue.Queue()
+        abandoned = threading.Event()
+
+        def produce():
+            stream = self._stream_tokens(model_name, prompt)
+            try:
+                for chunk in stream:
+                    if abandoned.is_set():
+                        return
+                    chunks.put((chunk, None))
+                chunks.put((None, None))
+            except Exception as e:
+                chunks.put((None, e))
+            finally:
+                stream.close()
+
+        threading.Thread(target=produce, name="cortex-stream", daemon=True).start()
+        started = time.perf_counter()
+        first = True
+        try:
+            while True:
+                timeout = max(deadline - (time.perf_counter() - started), 0) if first else None
+                try:
+                    chunk, error = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No token from {model_name} after {deadline:.1f}s")
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                if chunk:
+                    first = False
+                    yield chunk
+        finally:
+            abandoned.set()
+
+    def _stream_routed(self, models: List[str], prompt: str) -> Iterator[str]:
+        """Stream from the first of models to produce a token in time.
+
+        Every model but the last gets ``first_token_deadline``; the model being
+        streamed is left in ``last_model_used``. Errors other than a missed
+        deadline are raised as they are.
+        """
+        for i, model in enumerate(models):
+            self.last_model_used = model
+            if i == len(models) - 1:
+                yield from self._stream_tokens(model, prompt)
+                return
+            start = time.perf_counter()
+            stream = self._stream_with_deadline(model, prompt, self.first_token_deadline)
+            try:
+                chunk = next(stream)
+            except StopIteration:
+                return
+            except TimeoutError as e:
+                print(f"Streaming with {model} timed out, falling back: {str(e)}")
+                self.router.observe(model, time.perf_counter() - start, count_tokens(prompt), error=True)
+                metrics.observe("model_fallback", 1.0)
+                continue
+            yield chunk
+            yield from stream
+            return
+
+    def _stream_completion(self, model_name: str, prompt: str, cache_key: str = None,
+                           fallbacks: List[str] = ()) -> Iterator[str]:
+        """Yield completion chunks, falling back to the blocking path if streaming is unavailable.
+
+        With fallbacks, the stream moves on to the next model when one misses
+        the first-token deadline. The answer is cached under cache_key only if
+        model_name produced it.
+        """
+        start = time.perf_counter()
+        self.last_stream_stats = {}
+        if cache_key:
+            cached = self.completion_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                elapsed = time.perf_counter() - start
+                self.last_stream_stats = {
+                    "streamed": False,
+                    "cached": True,
+                    "complete": True,
+                    "time_to_first_token": elapsed,
+                    "total_time": elapsed,
+                }
+                return
+
+        first_token_at = None
+        streamed = True
+        complete = True
+        parts = []
+        try:
+            for chunk in self._stream_routed([model_name, *fallbacks], prompt):
+                if not chunk:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(chunk)
+                yield chunk
+        except Overloaded:
+            # Falling back would only queue for the same slots again
+            raise
+        except Exception as e:
+            if first_token_at is not None:
+                # Part of the answer is already on screen, so do not start over
+                print(f"Error while streaming completion: {str(e)}")
+                complete = False
+            else:
+                print(f"Streaming unavailable, falling back to blocking completion: {str(e)}")
+                streamed = False
+                # The model whose stream failed, which is not model_name after a timeout
+                response_text = self._complete_blocking(self.last_model_used, prompt)
+                first_token_at = time.perf_counter()
+                parts.append(response_text)
+                yield response_text
+        end = time.perf_counter()
+        if self.last_model_used != model_name:
+            # A fallback model answered: its answer is not the one cache_key names
+            model_name, cache_key = self.last_model_used, None
+        self.router.observe(model_name, end - start, count_tokens(prompt), error=not complete)
+        metrics.observe("complete_stream_seconds", end - start)
+        metrics.observe("time_to_first_token_seconds", (first_token_at or end) - start)
+
+        response_text = "".join(parts)
+        if cache_key and complete and response_text and response_text != self.NO_RESPONSE_TEXT:
+            self.completion_cache.set(cache_key, response_text)
+        self.last_stream_stats = {
+            "streamed": streamed,
+            "cached": False,
+            "complete": complete,
+            "time_to_first_token": (first_token_at or end) - start,
+            "total_time": end - start,
+        }
 
     # def complete(self, 
     #             question: str, 
@@ -148,12 +679,136 @@ class CortexCompletion:
     #         print(f"Error in completion: {str(e)}")
     #         return "Sorry, I encountered an error processing your request.", set()    
 
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call on the shared I/O pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _timed(self, timings: Dict[str, float], stage: str, func, *args, **kwargs):
+        """Run a blocking call on the I/O pool and record its duration"""
+        start = time.perf_counter()
+        try:
+            return await self._run(func, *args, **kwargs)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    async def aget_similar_chunks(self, query: str, category: str = "ALL", use_cache: bool = True,
+                                  rerank_query: str = None) -> Dict[str, Any]:
+        """Async variant of get_similar_chunks"""
+        return await self._run(self.get_similar_chunks, query, category, use_cache, rerank_query)
+
+    async def aget_document_urls(self, paths) -> Dict[str, str]:
+        """Async variant of get_document_urls"""
+        return await self._run(self.get_document_urls, list(paths))
+
+    async def acomplete(self, question: str, model_name: str, use_rag: bool, prescription_text: str, category: str = "ALL",
+                        use_cache: bool = True, chat_history: str = "",
+                        pin_model: bool = True,
+                        prescription_key: str = None) -> Tuple[str, set, Dict[str, str], Dict[str, float]]:
+        """Answer a question with retrieval, URL resolution and completion overlapped.
+
+        Document URLs are resolved while COMPLETE is generating. Returns the
+        response, the related paths, their URLs and per-stage timings in seconds.
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        self.last_prompt_stats = {}
+
+        scope = self._semantic_scope(category, use_rag, prescription_key or prescription_text, use_cache, chat_history)
+        if scope is not None:
+            hit = await self._timed(timings, "semantic_cache", self._semantic_get, question, scope)
+            if hit:
+                self.last_model_used = None
+                relative_paths = set(hit["relative_paths"])
+                urls = await self._timed(timings, "document_urls", self.get_document_urls, list(relative_paths))
+                timings["total"] = time.perf_counter() - start
+                return hit["response"], relative_paths, urls, timings
+
+        search_response = None
+        if use_rag:
+            search_response = await self._timed(
+                timings, "retrieval", self.retrieve, question, prescription_text, category, use_cache
+            )
+
+        prompt_start = time.perf_counter()
+        prompt, relative_paths = self.create_prompt(
+            question, use_rag, prescription_text, category, chat_history, search_response=search_response,
+            model_name=model_name
+        )
+        timings["prompt"] = time.perf_counter() - prompt_start
+
+        response_text, urls = await asyncio.gather(
+            self._timed(timings, "completion", self._complete_routed, model_name, prompt, category, use_rag,
+                        use_cache, pin_model),
+            self._timed(timings, "document_urls", self.get_document_urls, list(relative_paths)),
+        )
+        self._semantic_set(question, scope, response_text, relative_paths)
+        timings["total"] = time.perf_counter() - start
+        return response_text, relative_paths, urls, timings
+
+    def prefetch_document_urls(self, paths) -> Future:
+        """Start resolving document URLs in the background"""
+        return self.executor.submit(self.get_document_urls, list(paths))
+
     def get_document_url(self, path: str) -> str:
         """Get presigned URL for a document"""
+        return self.get_document_urls([path]).get(path, "")
+
+    @metrics.timed("get_document_url")
+    def get_document_urls(self, paths) -> Dict[str, str]:
+        """Get presigned URLs for several documents in one query.
+
+        Cached URLs are reused until shortly before they expire; the rest
+        are resolved together with a single statement over directory(@docs).
+        """
+        urls = {}
+        missing = []
+        for path in dict.fromkeys(paths):
+            url = self.document_url_cache.get(path)
+            if url is None:
+                missing.append(path)
+            else:
+                urls[path] = url
+        if not missing:
+            return urls
+
+        def resolve():
+            placeholders = ", ".join("?" for _ in missing)
+            cmd = (
+                f"select relative_path, GET_PRESIGNED_URL(@docs, relative_path, {URL_EXPIRY_SECONDS}) as URL_LINK "
+                f"from directory(@docs) where relative_path in ({placeholders})"
+            )
+            with self.pool.session() as session:
+                return session.sql(cmd, params=missing).collect()
+
         try:
-            cmd = f"select GET_PRESIGNED_URL(@docs, '{path}', 360) as URL_LINK from directory(@docs)"
-            df_url_link = self.session.sql(cmd).to_pandas()
-            return df_url_link._get_value(0, 'URL_LINK')
+            # The answer and the prefetcher often ask for the same documents at once
+            rows = self.admission.run("document_urls", tuple(sorted(missing)), resolve)
+            for row in rows:
+                urls[row["RELATIVE_PATH"]] = row["URL_LINK"]
+                self.document_url_cache.set(row["RELATIVE_PATH"], row["URL_LINK"])
         except Exception as e:
-            print(f"Error getting document URL: {str(e)}")
-            return ""
+            print(f"Error getting document URLs: {str(e)}")
+        return urls
+
+def _batches(prompts: List[str], max_size: int, max_bytes: int) -> Iterator[List[str]]:
+    """Group prompts into batches bounded by count and total UTF-8 size"""
+    batch, size = [], 0
+    for prompt in prompts:
+        prompt_bytes = len(prompt.encode("utf-8"))
+        if batch and (len(batch) >= max_size or size + prompt_bytes > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(prompt)
+        size += prompt_bytes
+    if batch:
+        yield batch
+
+
+def _parse_target_lag(target_lag: str, default: float = 60.0) -> float:
+    """Convert a TARGET_LAG such as '1 minute' into seconds"""
+    units = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+    match = re.match(r"\s*(\d+)\s*(second|minute|hour|day)s?", str(target_lag), re.IGNORECASE)
+    if not match:
+        return default
+    return int(match.group(1)) * units[match.group(2).lower()]
@@ -0,0 +1,39 @@
+import os
+import threading
+from typing import List
+
+import numpy as np
+
+# Small CPU-friendly model shipped with sentence-transformers' hub cache
+EMBEDDING_MODEL = os.getenv("CARECONNECT_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+_model = None
+_model_lock = threading.Lock()
+
+class ModelUnavailable(RuntimeError):
+    """A local model could not be loaded: missing package, no hub access, corrupt download"""
+
+def get_embedder():
+    """Load the sentence-transformers model once per process, on CPU"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+                except Exception as e:
+                    raise ModelUnavailable(f"Cannot load {EMBEDDING_MODEL}: {str(e)}") from e
+    return _model
+
+def embed(texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Unit-normalized float32 embeddings, one row per text"""
+    if not texts:
+        return np.zeros((0, embedding_dimension()), dtype=np.float32)
+    vectors = get_embedder().encode(
+        texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+    )
+    return vectors.astype(np.float32, copy=False)
+
+def embedding_dimension() -> int:
+    return get_embedder().get_sentence_embedding_dimension()
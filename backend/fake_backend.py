@@ -0,0 +1,244 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from bm25 import BM25Index
+
+class FakeRow(dict):
+    """Row that supports both ``row.NAME`` and ``row["NAME"]`` like Snowpark rows"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+class FakeDataFrame:
+    def __init__(self, rows: List[FakeRow]):
+        self.rows = rows
+
+    def collect(self) -> List[FakeRow]:
+        return self.rows
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows)
+
+class FakeSearchResponse:
+    def __init__(self, results: List[Dict[str, Any]]):
+        self.results = results
+
+    def json(self) -> str:
+        return json.dumps({"results": self.results})
+
+class FakeSearchService:
+    """Lexical stand-in for a Cortex Search service over the backend's chunk table"""
+
+    def __init__(self, backend: "FakeBackend"):
+        self.backend = backend
+        self.calls = 0
+        self._indexes = {}
+
+    def _index(self, rows: List[Dict[str, Any]], key) -> BM25Index:
+        """BM25 index over rows, rebuilt only when the chunk table changes"""
+        index_key = (id(self.backend.chunks), len(self.backend.chunks), key)
+        index = self._indexes.get(index_key)
+        if index is None:
+            index = self._indexes[index_key] = BM25Index([row["chunk"] for row in rows])
+        return index
+
+    def search(self, query: str, columns: List[str], filter: Optional[dict] = None, limit: int = 10):
+        self.calls += 1
+        self.backend.sleep(self.backend.search_latency)
+        rows = self.backend.chunks
+        key = None
+        if filter and "@eq" in filter:
+            (column, value), = filter["@eq"].items()
+            rows = [row for row in rows if row.get(column) == value]
+            key = (column, value)
+        scores = self._index(rows, key).scores(query)
+        ranked = sorted(range(len(rows)), key=lambda i: scores[i], reverse=True)[:limit]
+        return FakeSearchResponse([{col: rows[i].get(col) for col in columns} for i in ranked])
+
+class _Namespace:
+    """Answers any ``[name]`` lookup with the same object, like Root's collections"""
+
+    def __init__(self, leaf):
+        self.leaf = leaf
+
+    def __getitem__(self, name):
+        return self
+
+    def __getattr__(self, name):
+        if name == "cortex_search_services":
+            return _Services(self.leaf)
+        return self
+
+class _Services:
+    def __init__(self, service):
+        self.service = service
+
+    def __getitem__(self, name):
+        return self.service
+
+class FakeRoot:
+    """Stand-in for ``snowflake.core.Root`` exposing the search service"""
+
+    def __init__(self, backend: "FakeBackend"):
+        self.search_service = FakeSearchService(backend)
+        self.databases = _Namespace(self.search_service)
+
+class FakeSession:
+    """Stand-in for a Snowpark session that answers the app's SQL statements"""
+
+    def __init__(self, backend: "FakeBackend"):
+        self.backend = backend
+        self.closed = False
+
+    def sql(self, cmd: str, params: Optional[list] = None) -> FakeDataFrame:
+        if self.closed:
+            raise RuntimeError("Session is closed")
+        return FakeDataFrame(self.backend.execute(cmd, params or []))
+
+    def stream_complete(self, model_name: str, prompt: str) -> Iterator[str]:
+        """Yield a COMPLETE response token by token at the backend's token rate"""
+        return self.backend.stream_complete(model_name, prompt)
+
+    def close(self):
+        self.closed = True
+
+class FakeBackend:
+    """Offline stand-in for the Snowflake services the backend talks to.
+
+    Plugs into ``SnowflakeConnection(backend=...)`` (or ``CARECONNECT_BACKEND=fake``)
+    and simulates the app's SQL statements, a Cortex Search service over an
+    in-memory chunk table, COMPLETE with configurable latency and token rate,
+    and the @docs stage with presigned URLs.
+    """
+
+    def __init__(self, complete_latency: float = 0.05, tokens_per_second: float = 200.0,
+                 response_tokens: int = 60, search_latency: float = 0.02, sql_latency: float = 0.005,
+                 login_latency: float = 0.0):
+        self.complete_latency = complete_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.search_latency = search_latency
+        self.sql_latency = sql_latency
+        self.login_latency = login_latency
+        self.chunks: List[Dict[str, Any]] = []
+        self.stage: Dict[str, Dict[str, Any]] = {}
+        self.statements = 0
+        self.sessions_created = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sleep(seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def create_session(self) -> FakeSession:
+        self.sleep(self.login_latency)
+        with self._lock:
+            self.sessions_created += 1
+        return FakeSession(self)
+
+    def create_root(self) -> FakeRoot:
+        return FakeRoot(self)
+
+    def add_document(self, relative_path: str, text: str, category: str, chunk_size: int = 1512,
+                     chunk_overlap: int = 256):
+        """Put a file on the fake stage and its chunks in the fake chunk table"""
+        data = text.encode("utf-8")
+        self.stage[relative_path] = {
+            "name": f"docs/{relative_path}",
+            "size": len(data),
+            "md5": hashlib.md5(data).hexdigest(),
+            "last_modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()),
+        }
+        self.chunks = [row for row in self.chunks if row["relative_path"] != relative_path]
+        step = max(chunk_size - chunk_overlap, 1)
+        for start in range(0, max(len(text), 1), step):
+            self.chunks.append({
+                "chunk": text[start:start + chunk_size],
+                "relative_path": relative_path,
+                "category": category,
+                "size": len(data),
+            })
+
+    @classmethod
+    def with_sample_data(cls, documents: int = 20, **kwargs) -> "FakeBackend":
+        """Backend preloaded with synthetic medication leaflets"""
+        backend = cls(**kwargs)
+        drugs = ["amoxicillin", "ibuprofen", "metformin", "lisinopril", "atorvastatin",
+                 "omeprazole", "amlodipine", "paracetamol", "cetirizine", "levothyroxine"]
+        for i in range(documents):
+            drug = drugs[i % len(drugs)]
+            text = " ".join(
+                f"{drug.capitalize()} leaflet {i}, section {s}: the usual adult dosage is {(s + 1) * 100} mg "
+                f"taken {s % 3 + 1} times daily with water. Common side effects of {drug} include nausea, "
+                f"headache and dizziness. Do not combine {drug} with alcohol. Store below 25 degrees."
+                for s in range(12)
+            )
+            category = "ANTIBIOTIC" if drug == "amoxicillin" else "GENERAL"
+            backend.add_document(f"{drug}_leaflet_{i}.pdf", text, category)
+        return backend
+
+    def _response_text(self, prompt: str) -> str:
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return " ".join(f"token{seed}{i}" for i in range(self.response_tokens))
+
+    def stream_complete(self, model_name: str, prompt: str) -> Iterator[str]:
+        self.sleep(self.complete_latency)
+        for word in self._response_text(prompt).split(" "):
+            self.sleep(1.0 / self.tokens_per_second)
+            yield word + " "
+
+    def execute(self, cmd: str, params: list) -> List[FakeRow]:
+        """Simulate one SQL statement"""
+        with self._lock:
+            self.statements += 1
+        normalized = " ".join(cmd.split()).lower()
+
+        if "snowflake.cortex.try_complete" in normalized and "from values" in normalized:
+            self.sleep(self.complete_latency + self.response_tokens / self.tokens_per_second)
+            pairs = zip(params[1::2], params[2::2])
+            return [FakeRow(IDX=idx, RESPONSE=self._response_text(prompt)) for idx, prompt in pairs]
+        if "snowflake.cortex.complete" in normalized:
+            self.sleep(self.complete_latency + self.response_tokens / self.tokens_per_second)
+            return [FakeRow(RESPONSE=self._response_text(params[-1] if params else cmd))]
+
+        self.sleep(self.sql_latency)
+        if normalized == "select 1":
+            return [FakeRow({"1": 1})]
+        if normalized.startswith("show cortex search services"):
+            return [FakeRow(name="CC_SEARCH_SERVICE_CS", target_lag="1 minute")]
+        if "group by relative_path" in normalized and "fingerprint" in normalized:
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for row in self.chunks:
+                groups.setdefault(row["relative_path"], []).append(row)
+            return [
+                FakeRow(RELATIVE_PATH=path, FINGERPRINT=hashlib.md5(
+                    (str(len(rows)) + str(rows[0]["category"]) + "".join(sorted(r["chunk"] for r in rows))).encode("utf-8")
+                ).hexdigest())
+                for path, rows in groups.items()
+            ]
+        if normalized.startswith("select chunk, relative_path, category from"):
+            wanted = set(params)
+            return [
+                FakeRow(CHUNK=row["chunk"], RELATIVE_PATH=row["relative_path"], CATEGORY=row["category"])
+                for row in self.chunks if row["relative_path"] in wanted
+            ]
+        if "group by category" in normalized:
+            return [FakeRow(CATEGORY=c) for c in sorted({row["category"] for row in self.chunks})]
+        if normalized.startswith("ls @"):
+            return [FakeRow(info) for info in self.stage.values()]
+        if "get_presigned_url" in normalized:
+            paths = params or re.findall(r"'([^']+)'", cmd)
+            return [
+                FakeRow(RELATIVE_PATH=path, URL_LINK=f"https://fake-stage.local/docs/{path}?expires=360")
+                for path in paths if path in self.stage
+            ]
+        raise ValueError(f"Fake backend cannot run statement: {cmd}")
@@ -0,0 +1,242 @@
+"""Incremental ingestion of the @docs stage into docs_chunks_table.
+
+    python ingestion.py --workers 4 --batch-size 50
+
+Only files that are new or changed since the last run (by name, size, md5 and
+last_modified from ``ls @docs``) are parsed and chunked; chunks of files that
+left the stage are deleted, and categories are classified for files that do
+not have one yet. Re-running after a failure redoes just the files that did
+not finish, including a classification that failed.
+
+Ingestion runs from this command line on its own connection, so parsing
+never holds the pooled sessions that serve the app's chat turns.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+from cache import notify_documents_ingested
+
+MANIFEST_TABLE = "data.docs_ingest_manifest"
+CHUNKS_TABLE = "data.docs_chunks_table"
+CATEGORY_MODEL = "mistral-large"
+CATEGORY_PROMPT = (
+    "Given the name of the file between <file> and </file> determine if it is related to bikes or snow. "
+    "Use only one word <file> "
+)
+
+def ensure_manifest(session):
+    """Create the manifest table that records what has been ingested"""
+    session.sql(
+        f"create table if not exists {MANIFEST_TABLE} ("
+        "relative_path varchar primary key, size number(38,0), md5 varchar, "
+        "last_modified varchar, category varchar, ingested_at timestamp_ltz)"
+    ).collect()
+
+def list_stage(session) -> Dict[str, Dict[str, Any]]:
+    """Files on @docs keyed by relative path"""
+    files = {}
+    for row in session.sql("ls @data.docs").collect():
+        # ls returns "docs/<relative path>"
+        relative_path = row["name"].split("/", 1)[1] if "/" in row["name"] else row["name"]
+        files[relative_path] = {
+            "size": int(row["size"]),
+            "md5": row["md5"],
+            "last_modified": str(row["last_modified"]),
+        }
+    return files
+
+def load_manifest(session) -> Dict[str, Dict[str, Any]]:
+    """Previously ingested files keyed by relative path"""
+    rows = session.sql(
+        f"select relative_path, size, md5, last_modified, category from {MANIFEST_TABLE}"
+    ).collect()
+    return {
+        row["RELATIVE_PATH"]: {
+            "size": int(row["SIZE"]),
+            "md5": row["MD5"],
+            "last_modified": row["LAST_MODIFIED"],
+            "category": row["CATEGORY"],
+        }
+        for row in rows
+    }
+
+def diff(stage: Dict[str, Dict[str, Any]], manifest: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Split stage files into new, changed and removed relative to the manifest.
+
+    ``unclassified`` lists unchanged files whose category is still NULL, i.e.
+    whose classification failed or never ran after their chunks were stored.
+    """
+    new, changed, unclassified = [], [], []
+    for path, info in stage.items():
+        known = manifest.get(path)
+        if known is None:
+            new.append(path)
+        elif any(known[key] != info[key] for key in ("size", "md5", "last_modified")):
+            changed.append(path)
+        elif known["category"] is None:
+            unclassified.append(path)
+    removed = [path for path in manifest if path not in stage]
+    return {"new": sorted(new), "changed": sorted(changed), "removed": sorted(removed),
+            "unclassified": sorted(unclassified)}
+
+def ingest_file(pool, relative_path: str, info: Dict[str, Any], category: str = None) -> Dict[str, Any]:
+    """Replace a file's chunks and record it in the manifest"""
+    start = time.perf_counter()
+    with pool.session() as session:
+        # One transaction per file so a failed parse never leaves it without chunks
+        session.sql("begin").collect()
+        try:
+            session.sql(f"delete from {CHUNKS_TABLE} where relative_path = ?", params=[relative_path]).collect()
+            session.sql(
+                f"insert into {CHUNKS_TABLE} (relative_path, size, file_url, scoped_file_url, chunk, category) "
+                "select relative_path, size, file_url, build_scoped_file_url(@docs, relative_path) as scoped_file_url, "
+                "func.chunk as chunk, ? as category "
+                "from directory(@docs), "
+                "TABLE(DOCS_CHUNKS_TABLEtext_chunker(TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@docs, "
+                "relative_path, {'mode': 'LAYOUT'})))) as func "
+                "where relative_path = ?",
+                params=[category, relative_path],
+            ).collect()
+            chunks = session.sql(
+                f"select count(*) as n from {CHUNKS_TABLE} where relative_path = ?", params=[relative_path]
+            ).collect()[0]["N"]
+            session.sql(
+                f"merge into {MANIFEST_TABLE} m using (select ? as relative_path, ? as size, ? as md5, "
+                "? as last_modified, ? as category) s on m.relative_path = s.relative_path "
+                "when matched then update set size = s.size, md5 = s.md5, last_modified = s.last_modified, "
+                "category = s.category, ingested_at = current_timestamp() "
+                "when not matched then insert (relative_path, size, md5, last_modified, category, ingested_at) "
+                "values (s.relative_path, s.size, s.md5, s.last_modified, s.category, current_timestamp())",
+                params=[relative_path, info["size"], info["md5"], info["last_modified"], category],
+            ).collect()
+            session.sql("commit").collect()
+        except Exception:
+            session.sql("rollback").collect()
+            raise
+    return {"relative_path": relative_path, "chunks": int(chunks), "seconds": time.perf_counter() - start}
+
+def remove_files(pool, paths: List[str]):
+    """Delete chunks and manifest rows of files no longer on the stage"""
+    if not paths:
+        return
+    placeholders = ", ".join("?" for _ in paths)
+    with pool.session() as session:
+        session.sql(f"delete from {CHUNKS_TABLE} where relative_path in ({placeholders})", params=paths).collect()
+        session.sql(f"delete from {MANIFEST_TABLE} where relative_path in ({placeholders})", params=paths).collect()
+
+def classify_categories(pool, paths: List[str], batch_size: int = 50) -> Dict[str, str]:
+    """Classify file categories with one TRY_COMPLETE statement per batch.
+
+    Files whose completion fails, alone or with their whole batch, are left
+    out of the result and stay unclassified until the next run.
+    """
+    categories = {}
+    for i in range(0, len(paths), batch_size):
+        batch = paths[i:i + batch_size]
+        values = ", ".join("(?)" for _ in batch)
+        try:
+            with pool.session() as session:
+                rows = session.sql(
+                    "select column1 as relative_path, "
+                    f"TRIM(snowflake.cortex.TRY_COMPLETE(?, ? || column1 || '</file>'), '\\n') as category "
+                    f"from values {values}",
+                    params=[CATEGORY_MODEL, CATEGORY_PROMPT, *batch],
+                ).collect()
+        except Exception as e:
+            print(f"Error classifying categories: {str(e)}")
+            continue
+        for row in rows:
+            if row["CATEGORY"]:
+                categories[row["RELATIVE_PATH"]] = row["CATEGORY"]
+    return categories
+
+def apply_categories(pool, categories: Dict[str, str]):
+    """Write classified categories to the chunk table and the manifest"""
+    if not categories:
+        return
+    values = ", ".join("(?, ?)" for _ in categories)
+    params = [item for pair in categories.items() for item in pair]
+    with pool.session() as session:
+        for table in (CHUNKS_TABLE, MANIFEST_TABLE):
+            session.sql(
+                f"update {table} t set category = c.column2 from (select * from values {values}) c "
+                "where t.relative_path = c.column1",
+                params=params,
+            ).collect()
+
+def run_ingestion(pool, workers: int = 4, batch_size: int = 50, dry_run: bool = False) -> Dict[str, Any]:
+    """Ingest new and changed files from @docs; returns a report with per-file timings"""
+    start = time.perf_counter()
+    with pool.session() as session:
+        ensure_manifest(session)
+        stage = list_stage(session)
+        manifest = load_manifest(session)
+    plan = diff(stage, manifest)
+    report: Dict[str, Any] = {**plan, "files": [], "errors": []}
+    if dry_run:
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    remove_files(pool, plan["removed"])
+
+    todo = plan["new"] + plan["changed"]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            # Changed files keep the category they were classified with
+            executor.submit(ingest_file, pool, path, stage[path], manifest.get(path, {}).get("category")): path
+            for path in todo
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                report["files"].append(future.result())
+            except Exception as e:
+                print(f"Error ingesting {path}: {str(e)}")
+                report["errors"].append({"relative_path": path, "error": str(e)})
+
+    # Files are recorded with a NULL category until classified, so a file whose
+    # classification fails here is picked up again as unclassified next run
+    failed = {error["relative_path"] for error in report["errors"]}
+    to_classify = [
+        path for path in todo if path not in failed and manifest.get(path, {}).get("category") is None
+    ] + plan["unclassified"]
+    classify_start = time.perf_counter()
+    categories = classify_categories(pool, to_classify, batch_size)
+    try:
+        apply_categories(pool, categories)
+    except Exception as e:
+        print(f"Error applying categories: {str(e)}")
+        categories = {}
+    report["errors"].extend({"relative_path": path, "error": "classification failed"}
+                            for path in to_classify if path not in categories)
+    report["classification_seconds"] = time.perf_counter() - classify_start
+    report["categories"] = categories
+
+    # Chunks may have changed even if a later step failed
+    if todo or plan["removed"] or categories:
+        notify_documents_ingested()
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="files parsed in parallel")
+    parser.add_argument("--batch-size", type=int, default=50, help="files classified per COMPLETE statement")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+
+    from connection import SnowflakeConnection
+    connection = SnowflakeConnection()
+    if not connection.connect():
+        raise SystemExit("Failed to connect to Snowflake")
+    try:
+        report = run_ingestion(connection.get_pool(), args.workers, args.batch_size, args.dry_run)
+    finally:
+        connection.close()
+    print(json.dumps(report, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
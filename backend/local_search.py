@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bm25 import BM25Index
+from cache import on_documents_ingested
+from embeddings import ModelUnavailable
+
+class LocalSearchResponse:
+    """Mirrors the Cortex Search response object: ``json()`` returns the payload string"""
+
+    def __init__(self, results: List[Dict[str, Any]]):
+        self.results = results
+
+    def json(self) -> str:
+        return json.dumps({"results": self.results})
+
+class _Snapshot:
+    """Immutable view of the synced corpus; swapped as a whole after each sync"""
+
+    def __init__(self, rows: List[Dict[str, Any]], embeddings: Optional[np.ndarray]):
+        self.rows = rows
+        self.embeddings = embeddings
+        self.bm25 = BM25Index([row["chunk"] for row in rows])
+        self.by_category: Dict[str, np.ndarray] = {}
+        categories = np.array([row.get("category") or "" for row in rows], dtype=object)
+        for category in set(categories):
+            self.by_category[category] = np.flatnonzero(categories == category)
+
+class LocalSearchIndex:
+    """Local hybrid (BM25 + dense) retrieval over a snapshot of docs_chunks_table.
+
+    The snapshot lives in ``cache_dir`` (row metadata as JSON, embeddings as a
+    NumPy array opened memory-mapped) so a restart starts serving at once.
+    ``sync`` re-fetches only the relative paths whose chunks changed.
+    """
+
+    COLUMNS = ["chunk", "relative_path", "category"]
+
+    def __init__(self, pool, cache_dir: str, table: str = "data.docs_chunks_table", use_embeddings: bool = True,
+                 dense_weight: float = 0.5):
+        self.pool = pool
+        self.cache_dir = cache_dir
+        self.table = table
+        self.use_embeddings = use_embeddings
+        self.dense_weight = dense_weight
+        self.fingerprints: Dict[str, str] = {}
+        self.snapshot: Optional[_Snapshot] = None
+        self.last_sync = 0.0
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def ready(self) -> bool:
+        return self.snapshot is not None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def load(self) -> bool:
+        """Load the on-disk snapshot, if there is one"""
+        try:
+            with open(self._path("manifest.json")) as f:
+                manifest = json.load(f)
+            embeddings = None
+            if self.use_embeddings and os.path.exists(self._path("embeddings.npy")):
+                embeddings = np.load(self._path("embeddings.npy"), mmap_mode="r")
+                if embeddings.shape[0] != len(manifest["rows"]):
+                    embeddings = None
+            self.fingerprints = manifest["fingerprints"]
+            self.snapshot = _Snapshot(manifest["rows"], embeddings)
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"No usable local search snapshot: {str(e)}")
+            return False
+
+    def _save(self, rows: List[Dict[str, Any]], embeddings: Optional[np.ndarray]):
+        """Write the snapshot atomically and reopen the embeddings memory-mapped"""
+        if embeddings is not None:
+            tmp = self._path("embeddings.tmp.npy")
+            np.save(tmp, embeddings)
+            os.replace(tmp, self._path("embeddings.npy"))
+            embeddings = np.load(self._path("embeddings.npy"), mmap_mode="r")
+        else:
+            # Never pair the new rows with vectors of an older snapshot
+            try:
+                os.remove(self._path("embeddings.npy"))
+            except FileNotFoundError:
+                pass
+        tmp = self._path("manifest.tmp.json")
+        with open(tmp, "w") as f:
+            json.dump({"fingerprints": self.fingerprints, "rows": rows}, f)
+        os.replace(tmp, self._path("manifest.json"))
+        return embeddings
+
+    def sync(self) -> Dict[str, int]:
+        """Bring the snapshot up to date, fetching only changed relative paths"""
+        with self._sync_lock:
+            with self.pool.session() as session:
+                remote = {
+                    row["RELATIVE_PATH"]: row["FINGERPRINT"]
+                    for row in session.sql(
+                        "select relative_path, md5(count(*) || max(category) || "
+                        "listagg(md5(chunk), '') within group (order by md5(chunk))) as fingerprint "
+                        f"from {self.table} group by relative_path"
+                    ).collect()
+                }
+                changed = [path for path, fp in remote.items() if self.fingerprints.get(path) != fp]
+                removed = [path for path in self.fingerprints if path not in remote]
+                fetched = []
+                if changed:
+                    placeholders = ", ".join("?" for _ in changed)
+                    fetched = [
+                        {"chunk": row["CHUNK"], "relative_path": row["RELATIVE_PATH"], "category": row["CATEGORY"]}
+                        for row in session.sql(
+                            f"select chunk, relative_path, category from {self.table} "
+                            f"where relative_path in ({placeholders})",
+                            params=changed,
+                        ).collect()
+                    ]
+
+            stats = {"changed": len(changed), "removed": len(removed), "rows_fetched": len(fetched)}
+            # A snapshot left without vectors by a failed embedding run is rebuilt
+            missing_vectors = self.use_embeddings and self.snapshot is not None and self.snapshot.embeddings is None
+            if not changed and not removed and self.snapshot is not None and not missing_vectors:
+                self.last_sync = time.time()
+                return stats
+
+            stale = set(changed) | set(removed)
+            old = self.snapshot
+            keep = [i for i, row in enumerate(old.rows) if row["relative_path"] not in stale] if old else []
+            rows = [old.rows[i] for i in keep] + fetched
+
+            embeddings = None
+            if self.use_embeddings:
+                try:
+                    from embeddings import embed
+                    if old is not None and old.embeddings is not None:
+                        # Reuse vectors of unchanged rows; only new chunks are embedded
+                        embeddings = np.vstack([np.asarray(old.embeddings[keep]), embed([r["chunk"] for r in fetched])])
+                    else:
+                        embeddings = embed([row["chunk"] for row in rows])
+                except ModelUnavailable as e:
+                    print(f"Dense retrieval disabled: {str(e)}")
+                    self.use_embeddings = False
+                except Exception as e:
+                    # The lexical index is still saved; the next sync embeds every row again
+                    print(f"Error embedding chunks, saving the index without vectors: {str(e)}")
+
+            self.fingerprints = remote
+            embeddings = self._save(rows, embeddings)
+            self.snapshot = _Snapshot(rows, embeddings)
+            self.last_sync = time.time()
+            return stats
+
+    def start_background_sync(self, interval: float = 3600.0):
+        """Sync now, then again every interval seconds.
+
+        Ingestion in this process syncs at once through notify_documents_ingested;
+        the timer only catches ingestion run elsewhere. The fingerprint query
+        scans the whole chunk table, so a short interval would keep the
+        warehouse from ever suspending.
+        """
+        if self._sync_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Error syncing local search index: {str(e)}")
+                time.sleep(interval)
+
+        self._sync_thread = threading.Thread(target=loop, name="local-search-sync", daemon=True)
+        self._sync_thread.start()
+
+    def search(self, query: str, columns: List[str], filter: Optional[dict] = None, limit: int = 3) -> LocalSearchResponse:
+        """Rank chunks by a weighted mix of BM25 and cosine similarity"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise RuntimeError("Local search index is not loaded")
+
+        candidates = np.arange(len(snapshot.rows))
+        if filter and "@eq" in filter:
+            (column, value), = filter["@eq"].items()
+            if column != "category":
+                raise ValueError(f"Local search only filters on category, not {column}")
+            candidates = snapshot.by_category.get(value, np.zeros(0, dtype=int))
+        if len(candidates) == 0:
+            return LocalSearchResponse([])
+
+        lexical = np.asarray(snapshot.bm25.scores(query), dtype=np.float32)[candidates]
+        if lexical.max() > 0:
+            lexical /= lexical.max()
+        scores = lexical
+        if self.use_embeddings and snapshot.embeddings is not None:
+            try:
+                from embeddings import embed
+                dense = np.asarray(snapshot.embeddings[candidates]) @ embed([query])[0]
+                scores = self.dense_weight * dense + (1 - self.dense_weight) * lexical
+            except ModelUnavailable as e:
+                # A snapshot loaded from disk can have vectors while the model cannot load
+                print(f"Dense retrieval disabled: {str(e)}")
+                self.use_embeddings = False
+            except Exception as e:
+                print(f"Error embedding query, ranking it lexically: {str(e)}")
+
+        top = np.argsort(-scores)[:limit]
+        return LocalSearchResponse([
+            {col: snapshot.rows[candidates[i]].get(col) for col in columns} for i in top
+        ])
+
+# Outside any checkout, like the conversation store, so the working directory does not decide where it lands
+DEFAULT_LOCAL_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".careconnect", "index")
+
+_local_index = None
+_local_index_lock = threading.Lock()
+
+def get_local_index(pool) -> LocalSearchIndex:
+    """Process-wide local index: loads the on-disk snapshot and keeps it synced"""
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            cache_dir = os.getenv("CARECONNECT_LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR)
+            index = LocalSearchIndex(
+                pool,
+                cache_dir=os.path.abspath(os.path.expanduser(cache_dir)),
+                use_embeddings=os.getenv("CARECONNECT_LOCAL_DENSE", "1") != "0",
+            )
+            index.load()
+            index.start_background_sync(float(os.getenv("CARECONNECT_LOCAL_SYNC_SECONDS", "3600")))
+            on_documents_ingested(lambda: threading.Thread(target=index.sync, daemon=True).start())
+            _local_index = index
+        return _local_index
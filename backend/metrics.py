@@ -0,0 +1,148 @@
+import functools
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Mean and nearest-rank p50/p95/p99 of the samples"""
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.5),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+    }
+
+class RollingHistogram:
+    """Keeps the most recent observations of a value for percentile queries"""
+
+    def __init__(self, window: int = 1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)) -> Dict[float, float]:
+        """Nearest-rank percentiles over the rolling window"""
+        ordered = sorted(self.values)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+class Metrics:
+    """Span timings, per-turn records and rolling histograms for the chat backend.
+
+    When disabled, ``span`` and ``timed`` reduce to a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 1000, max_turns: int = 1000):
+        self.enabled = enabled
+        self.window = window
+        self.histograms: Dict[str, RollingHistogram] = {}
+        self.turns = deque(maxlen=max_turns)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        """Add one observation to a named histogram"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram(self.window)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block as ``<name>_seconds``"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """Decorator that records each call of the function as a span"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(f"{name}_seconds", time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def record_turn(self, **fields):
+        """Store a chat turn's record; numeric fields also feed histograms"""
+        if not self.enabled:
+            return
+        record = {"timestamp": time.time(), **fields}
+        with self._lock:
+            self.turns.append(record)
+        for key, value in fields.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.observe(f"turn_{key}", value)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and p50/p95/p99 of every histogram"""
+        with self._lock:
+            items = list(self.histograms.items())
+        result = {}
+        for name, histogram in sorted(items):
+            p = histogram.percentiles()
+            result[name] = {
+                "count": histogram.count,
+                "mean": histogram.total / histogram.count if histogram.count else 0.0,
+                "p50": p[0.5],
+                "p95": p[0.95],
+                "p99": p[0.99],
+            }
+        return result
+
+    def to_jsonl(self) -> str:
+        """Export the recorded turns as JSON lines"""
+        with self._lock:
+            turns: List[Dict[str, Any]] = list(self.turns)
+        return "".join(json.dumps(turn, default=str) + "\n" for turn in turns)
+
+    def to_prometheus(self, prefix: str = "careconnect") -> str:
+        """Export the histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            items = list(self.histograms.items())
+        for name, histogram in sorted(items):
+            metric = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+            lines.append(f"# TYPE {metric} summary")
+            for quantile, value in histogram.percentiles().items():
+                lines.append(f'{metric}{{quantile="{quantile}"}} {value}')
+            lines.append(f"{metric}_sum {histogram.total}")
+            lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Forget every observation"""
+        with self._lock:
+            self.histograms.clear()
+            self.turns.clear()
+
+# Shared by every session in the process; CARECONNECT_METRICS=0 turns it off
+metrics = Metrics(enabled=os.getenv("CARECONNECT_METRICS", "1") != "0")
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from admission import Overloaded
+from metrics import RollingHistogram, metrics
+from tokens import MODEL_CONTEXT_WINDOWS, RESPONSE_RESERVE_TOKENS, context_window
+
+# Expected seconds for a short prompt before any latency has been observed,
+# roughly ordered by model size
+PRIOR_LATENCY_SECONDS = {
+    'mistral-7b': 1.5,
+    'llama3-8b': 1.5,
+    'gemma-7b': 1.5,
+    'reka-flash': 2.0,
+    'mixtral-8x7b': 2.5,
+    'snowflake-arctic': 3.0,
+    'llama3-70b': 4.0,
+    'llama2-70b-chat': 4.5,
+    'mistral-large2': 5.0,
+}
+DEFAULT_PRIOR_LATENCY_SECONDS = 5.0
+# Latency is assumed to grow linearly with prompt size, doubling every this many tokens
+TOKENS_PER_LATENCY_UNIT = 4000
+
+class ModelStats:
+    """Observed latency and error rate of one model"""
+
+    def __init__(self, window: int = 200, error_decay: float = 0.2):
+        # Latencies normalized to a short prompt, see TOKENS_PER_LATENCY_UNIT
+        self.latency = RollingHistogram(window)
+        self.error_rate = 0.0
+        self.error_decay = error_decay
+
+    def observe_latency(self, seconds: float, prompt_tokens: int):
+        self.latency.observe(seconds / (1 + prompt_tokens / TOKENS_PER_LATENCY_UNIT))
+
+    def observe_outcome(self, error: bool):
+        self.error_rate += self.error_decay * ((1.0 if error else 0.0) - self.error_rate)
+
+class ModelRouter:
+    """Picks a model per call from observed latency, error rate and prompt size.
+
+    Candidates that fit the prompt are ordered by predicted p95 latency; the
+    caller's preferred model goes first while it meets the latency SLO, and
+    always until ``min_samples`` calls to it have been observed. ``run``
+    enforces a per-attempt deadline, falls back to the next (faster) candidate
+    on a timeout or error, and can hedge a slow attempt with a second request.
+    """
+
+    def __init__(self, models: List[str], slo_seconds: float = 8.0, deadline_seconds: float = 20.0,
+                 hedge: bool = False, min_samples: int = 5, max_workers: int = 8):
+        self.models = list(models)
+        self.slo_seconds = slo_seconds
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.stats: Dict[str, ModelStats] = {model: ModelStats() for model in self.models}
+        self._lock = threading.Lock()
+        # Own threads: callers may already be running on the shared I/O executor
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+
+    def _stats(self, model: str) -> ModelStats:
+        with self._lock:
+            if model not in self.stats:
+                self.stats[model] = ModelStats()
+            return self.stats[model]
+
+    def observe(self, model: str, seconds: float, prompt_tokens: int, error: bool = False):
+        """Record a finished call made outside ``run``"""
+        stats = self._stats(model)
+        with self._lock:
+            stats.observe_latency(seconds, prompt_tokens)
+            stats.observe_outcome(error)
+
+    def predicted_latency(self, model: str, prompt_tokens: int, quantile: float = 0.95) -> float:
+        """Expected seconds for a prompt of prompt_tokens tokens"""
+        stats = self._stats(model)
+        with self._lock:
+            if len(stats.latency.values) >= self.min_samples:
+                base = stats.latency.percentiles((quantile,))[quantile]
+            else:
+                base = PRIOR_LATENCY_SECONDS.get(model, DEFAULT_PRIOR_LATENCY_SECONDS)
+        return base * (1 + prompt_tokens / TOKENS_PER_LATENCY_UNIT)
+
+    def candidates(self, prompt_tokens: int, preferred: Optional[str] = None) -> List[str]:
+        """Models able to take the prompt, in the order they should be tried"""
+        fits = [m for m in self.models if context_window(m) >= prompt_tokens + RESPONSE_RESERVE_TOKENS]
+        if not fits:
+            # Nothing fits: the largest window is the best remaining bet
+            fits = [max(self.models, key=context_window)]
+        # Unreliable models rank as if they were slower
+        score = {m: self.predicted_latency(m, prompt_tokens) * (1 + 4 * self._stats(m).error_rate) for m in fits}
+        ordered = sorted(fits, key=lambda m: score[m])
+        # The priors are rough guesses: only observed latency may demote the user's choice
+        observed = len(self._stats(preferred).latency.values) >= self.min_samples if preferred in score else False
+        if preferred in score and (score[preferred] <= self.slo_seconds or not observed):
+            # Fall back only to models expected to be faster than the preferred one
+            return [preferred] + [m for m in ordered if m != preferred and score[m] < score[preferred]]
+        return ordered
+
+    def run(self, call: Callable[[str], Any], candidates: List[str], prompt_tokens: int = 0,
+            deadline_seconds: Optional[float] = None) -> Tuple[Any, str]:
+        """Run call(model) over candidates until one succeeds; returns (result, model).
+
+        An attempt that outlives the deadline is abandoned (its thread finishes in
+        the background) and the next candidate is started. Once no candidate is
+        left to fall back to, the remaining attempts are awaited without a
+        deadline. With hedging on, the next candidate is also started once an
+        attempt exceeds its model's p95.
+        """
+        deadline_seconds = deadline_seconds or self.deadline_seconds
+        queue = list(candidates)
+        pending: Dict[Any, Tuple[str, float]] = {}
+        abandoned = set()
+        errors: List[str] = []
+        refused = 0
+
+        def launch():
+            model = queue.pop(0)
+            started = time.perf_counter()
+            future = self.executor.submit(call, model)
+            pending[future] = (model, started)
+
+            def done(f, model=model, started=started):
+                stats = self._stats(model)
+                if isinstance(f.exception(), Overloaded):
+                    # Refused by admission control before reaching the model
+                    return
+                with self._lock:
+                    stats.observe_latency(time.perf_counter() - started, prompt_tokens)
+                    if f not in abandoned:
+                        stats.observe_outcome(f.exception() is not None)
+            future.add_done_callback(done)
+
+        launch()
+        while pending or queue:
+            if not pending:
+                launch()
+            now = time.perf_counter()
+            # The last candidates are waited for: abandoning them would discard the answer
+            wake_at = [started + deadline_seconds for _, started in pending.values()] if queue else []
+            if self.hedge and queue and len(pending) == 1:
+                (model, started), = pending.values()
+                wake_at.append(started + self.predicted_latency(model, prompt_tokens))
+            timeout = max(min(wake_at) - now, 0) if wake_at else None
+            finished, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                model, _ = pending.pop(future)
+                if future.exception() is None:
+                    if model != candidates[0]:
+                        metrics.observe("model_fallback", 1.0)
+                    return future.result(), model
+                print(f"Error completing with {model}: {str(future.exception())}")
+                errors.append(f"{model}: {future.exception()}")
+                refused += isinstance(future.exception(), Overloaded)
+
+            now = time.perf_counter()
+            for future, (model, started) in list(pending.items()):
+                if queue and now - started >= deadline_seconds:
+                    print(f"Completion with {model} exceeded {deadline_seconds:.1f}s, falling back")
+                    errors.append(f"{model}: timed out after {deadline_seconds:.1f}s")
+                    abandoned.add(future)
+                    del pending[future]
+                    stats = self._stats(model)
+                    with self._lock:
+                        stats.observe_outcome(True)
+            if self.hedge and queue and len(pending) == 1:
+                (model, started), = pending.values()
+                if now - started >= self.predicted_latency(model, prompt_tokens):
+                    metrics.observe("model_hedge", 1.0)
+                    launch()
+        if errors and refused == len(errors):
+            raise Overloaded("All candidate models refused: " + "; ".join(errors))
+        raise RuntimeError("All candidate models failed: " + "; ".join(errors))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Per-model routing inputs, for display"""
+        with self._lock:
+            return {
+                model: {
+                    "samples": len(stats.latency.values),
+                    "p95_seconds": stats.latency.percentiles((0.95,))[0.95],
+                    "error_rate": stats.error_rate,
+                }
+                for model, stats in self.stats.items()
+            }
+
+model_router = ModelRouter(
+    list(MODEL_CONTEXT_WINDOWS),
+    slo_seconds=float(os.getenv("CARECONNECT_LATENCY_SLO_SECONDS", "8")),
+    deadline_seconds=float(os.getenv("CARECONNECT_COMPLETE_DEADLINE_SECONDS", "20")),
+    hedge=os.getenv("CARECONNECT_HEDGE_REQUESTS", "0") == "1",
+)
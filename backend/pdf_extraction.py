@@ -0,0 +1,131 @@
+"""Text extraction for uploaded documents, with OCR of scanned pages in worker processes.
+
+Kept free of Streamlit and LangChain imports: OCR runs in worker processes,
+which import this module.
+"""
+import importlib.util
+import io
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+MAX_UPLOAD_BYTES = int(os.getenv("CARECONNECT_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_PAGES = int(os.getenv("CARECONNECT_MAX_PAGES", "200"))
+EXTRACT_WORKERS = int(os.getenv("CARECONNECT_EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 4))))
+OCR_DPI = 300
+# Pages with less text than this are treated as scans
+MIN_TEXT_CHARS = 10
+
+class DocumentTooLarge(ValueError):
+    pass
+
+# One OCR pool per process, started on the first scanned page and shared by
+# every Streamlit session; starting workers costs far more than reading a page
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool_lock = threading.Lock()
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            # Forking the multi-threaded Streamlit server could copy locks held by other threads
+            _ocr_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _ocr_pool
+
+def _ocr_available() -> bool:
+    return importlib.util.find_spec("pytesseract") is not None
+
+def _render_page(page) -> bytes:
+    """PNG of a page at OCR resolution"""
+    return page.get_pixmap(dpi=OCR_DPI).tobytes("png")
+
+def _ocr_image(png: bytes, number: int) -> str:
+    """Text of a rendered page via Tesseract; empty if OCR fails"""
+    try:
+        import pytesseract
+        from PIL import Image
+        return pytesseract.image_to_string(Image.open(io.BytesIO(png)))
+    except Exception as e:
+        print(f"OCR failed for page {number + 1}: {str(e)}")
+        return ""
+
+def iter_pages(data: bytes, file_name: str, max_pages: int = MAX_PAGES, workers: int = EXTRACT_WORKERS,
+               on_progress: Optional[Callable[[int, int], None]] = None,
+               on_truncated: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[int, str, bool]]:
+    """Yield (page number, text, used OCR) in page order as pages are extracted.
+
+    Text layers are read in-process, which takes about a millisecond a page.
+    Pages without one are rendered and OCR'd in the shared worker pool while
+    later pages are read, with at most two pages per worker in flight.
+    ``on_progress(done, total)`` is called after every page and
+    ``on_truncated(page_count, max_pages)`` once if pages past max_pages are skipped.
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise DocumentTooLarge(
+            f"{file_name} is {len(data) / 1e6:.1f} MB, the limit is {MAX_UPLOAD_BYTES / 1e6:.1f} MB"
+        )
+    filetype = os.path.splitext(file_name)[1].lstrip(".").lower() or "pdf"
+    ocr = _ocr_available()
+    with fitz.open(stream=data, filetype=filetype) as document:
+        page_count = document.page_count
+        if page_count > max_pages:
+            print(f"{file_name} has {page_count} pages, extracting the first {max_pages}")
+            if on_truncated:
+                on_truncated(page_count, max_pages)
+        total = min(page_count, max_pages)
+
+        # (page number, text, used OCR, pending OCR or None), oldest first
+        pending = deque()
+        done = 0
+
+        def finished(entry) -> Tuple[int, str, bool]:
+            number, text, used_ocr, future = entry
+            if future is not None:
+                text = future.result() or text
+            return number, text, used_ocr
+
+        for number in range(total):
+            page = document[number]
+            text = page.get_text()
+            used_ocr = ocr and len(text.strip()) < MIN_TEXT_CHARS
+            future = None
+            if used_ocr and workers > 1:
+                future = _get_ocr_pool().submit(_ocr_image, _render_page(page), number)
+            elif used_ocr:
+                text = _ocr_image(_render_page(page), number) or text
+            pending.append((number, text, used_ocr, future))
+            # Oldest page first keeps pages in order; block on it once enough OCR is in flight
+            while pending and (pending[0][3] is None or pending[0][3].done()
+                               or sum(entry[3] is not None for entry in pending) > 2 * workers):
+                done += 1
+                yield finished(pending.popleft())
+                if on_progress:
+                    on_progress(done, total)
+        while pending:
+            done += 1
+            yield finished(pending.popleft())
+            if on_progress:
+                on_progress(done, total)
+
+def iter_chunks(pages: Iterator[Tuple[int, str, bool]], splitter) -> Iterator[str]:
+    """Split page text into chunks as pages arrive.
+
+    The last chunk of what has been read so far may still continue on the next
+    page, so it is held back and re-split together with that page.
+    """
+    carry = ""
+    for _, text, _ in pages:
+        carry = f"{carry}\n{text}" if carry else text
+        chunks = splitter.split_text(carry)
+        if not chunks:
+            continue
+        yield from chunks[:-1]
+        carry = chunks[-1]
+    if carry.strip():
+        yield carry
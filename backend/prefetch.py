@@ -0,0 +1,161 @@
+import re
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Set
+
+from metrics import metrics
+
+# "Amoxicillin 500 mg", "metformin 1,000mg", "Insulin glargine 10 units"
+DOSAGE_PATTERN = re.compile(
+    r"\b([A-Za-z][A-Za-z\-]{3,}(?:\s+[A-Za-z][A-Za-z\-]{3,})?)\s+(\d[\d,.]*\s?(?:mg|mcg|µg|g|ml|mL|iu|IU|units?))\b"
+)
+# Words common on prescriptions that are never the drug itself
+STOP_WORDS = {
+    "take", "tablet", "tablets", "capsule", "capsules", "daily", "patient", "doctor", "date", "name",
+    "address", "signature", "refills", "refill", "dose", "dosage", "with", "after", "before", "each",
+    "every", "once", "twice", "times", "apply", "inject", "oral", "orally", "mouth", "pharmacy",
+}
+
+def extract_entities(chunks: List[str], limit: int = 5) -> List[str]:
+    """Likely drug names with their dosages, most frequent first.
+
+    Falls back to the most frequent capitalized words when no dosage is
+    written next to a name.
+    """
+    text = "\n".join(chunks)
+    found = Counter()
+    for name, dose in DOSAGE_PATTERN.findall(text):
+        words = [word for word in name.split() if word.lower() not in STOP_WORDS]
+        if words:
+            found[f"{' '.join(words).lower()} {' '.join(dose.split())}"] += 1
+    if not found:
+        for word in re.findall(r"\b[A-Z][a-z]{4,}\b", text):
+            if word.lower() not in STOP_WORDS:
+                found[word.lower()] += 1
+    return [entity for entity, _ in found.most_common(limit)]
+
+def _words(text: str) -> Set[str]:
+    return set(re.findall(r"[a-z][a-z\-]+", text.lower()))
+
+class RetrievalPrefetcher:
+    """Searches an uploaded prescription's drugs before the first question.
+
+    ``start`` runs one wide search per main entity in the background and keeps
+    the results; a newer ``start`` or ``cancel`` stops the previous run between
+    queries. A turn whose question names a prefetched drug is answered from
+    those results, ranked against the question locally, instead of waiting on
+    its own search (see ``CortexCompletion.retrieve``). The documents found
+    also have their presigned URLs resolved ahead of time.
+    """
+
+    def __init__(self, cortex, max_queries: int = 5, candidates: int = 20):
+        self.cortex = cortex
+        self.max_queries = max_queries
+        self.candidates = candidates
+        self.key = None
+        self.category = None
+        self.entities: List[str] = []
+        # entity -> search results, filled in as the run progresses
+        self.results: Dict[str, List[Dict[str, Any]]] = {}
+        self.prefetched_paths: Set[str] = set()
+        self._cancelled = threading.Event()
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        cortex.prefetcher = self
+
+    def start(self, key, chunks: List[str], category: str = "ALL") -> Optional[Future]:
+        """Prefetch for an upload, unless it is already prefetched under the same key"""
+        if key == self.key:
+            return self._future
+        self.cancel()
+        self.key = key
+        cancelled = self._cancelled = threading.Event()
+        entities = extract_entities(chunks, self.max_queries)
+        with self._lock:
+            self.category = category
+            self.entities = entities
+            self.results = {}
+            self.prefetched_paths = set()
+        self.counts["started"] += 1
+        self._future = self.cortex.executor.submit(self._run, entities, category, cancelled)
+        return self._future
+
+    def cancel(self):
+        """Stop the running prefetch after its current query and forget its results"""
+        if self._future is not None and not self._future.done():
+            self._cancelled.set()
+            self.counts["cancelled"] += 1
+        self.key = None
+        with self._lock:
+            self.results = {}
+
+    def _run(self, entities: List[str], category: str, cancelled: threading.Event):
+        paths: Set[str] = set()
+        for entity in entities:
+            if cancelled.is_set():
+                return
+            try:
+                results = self.cortex.search_candidates(entity, category, self.candidates)
+            except Exception as e:
+                print(f"Error prefetching {entity}: {str(e)}")
+                continue
+            found = {result["relative_path"] for result in results if result.get("relative_path")}
+            paths |= found
+            with self._lock:
+                self.counts["queries"] += 1
+                # A cancelled run must not hand its results to the newer upload
+                if cancelled.is_set():
+                    return
+                self.results[entity] = results
+                self.prefetched_paths |= found
+        if paths and not cancelled.is_set():
+            self.cortex.get_document_urls(list(paths))
+
+    def _named_entities(self, words: Set[str]) -> List[str]:
+        return [entity for entity in self.entities if entity.split()[0] in words]
+
+    def search_response(self, question: str, category: str) -> Optional[str]:
+        """Search response for a question naming prefetched drugs; None if it names none"""
+        if self.key is None:
+            return None
+        words = _words(question)
+        with self._lock:
+            if category != self.category:
+                return None
+            results = {}
+            for entity in self._named_entities(words):
+                for result in self.results.get(entity, []):
+                    results.setdefault((result.get("relative_path"), result.get("chunk")), result)
+        if not results:
+            return None
+        self.counts["served"] += 1
+        return self.cortex.rank_candidates(question, list(results.values()))
+
+    def record_turn(self, question: str, relative_paths) -> Dict[str, Any]:
+        """Score a turn against the prefetch; returns this turn's hits.
+
+        An entity hit is a question naming a prefetched drug; a document hit
+        is a cited document whose URL the prefetch already resolved.
+        """
+        if self.key is None:
+            return {}
+        with self._lock:
+            entity_hit = bool(self._named_entities(_words(question)))
+            document_hits = len(set(relative_paths) & self.prefetched_paths)
+        self.counts["turns"] += 1
+        self.counts["entity_hits"] += entity_hit
+        self.counts["documents"] += len(relative_paths)
+        self.counts["document_hits"] += document_hits
+        metrics.observe("prefetch_document_hit_ratio", document_hits / len(relative_paths) if relative_paths else 0.0)
+        return {"entity_hit": entity_hit, "document_hits": document_hits}
+
+    def stats(self) -> Dict[str, Any]:
+        counts = self.counts
+        return {
+            **counts,
+            "running": self._future is not None and not self._future.done(),
+            "entity_hit_rate": counts["entity_hits"] / counts["turns"] if counts["turns"] else 0.0,
+            "document_hit_rate": counts["document_hits"] / counts["documents"] if counts["documents"] else 0.0,
+        }
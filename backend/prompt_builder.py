@@ -0,0 +1,116 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+from tokens import RESPONSE_RESERVE_TOKENS, context_window, count_tokens, truncate_to_tokens
+
+PROMPT_TEMPLATE = (
+    "You are an expert chat assistant that extracts information from the CONTEXT provided "
+    "between <context> and </context> tags. "
+    "When answering the question contained between <question> and </question> tags "
+    "be concise and do not hallucinate. If you don't have the information just say i do not know. "
+    "Only answer the question if you can extract it from the CONTEXT provided. "
+    "Do not mention the CONTEXT used in your answer.\n"
+    "<chat_history>\n{chat_history}\n</chat_history>\n"
+    "<context>\n{context}\n</context>\n"
+    "<question>\n{question}\n</question>\n"
+    "Answer:"
+)
+# Shortest suffix/prefix match treated as chunker overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+def _overlap(left: str, right: str, max_overlap: int) -> int:
+    """Length of the longest suffix of left that is also a prefix of right"""
+    for size in range(min(len(left), len(right), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def merge_chunks(chunks: List[str], max_overlap: int = 512) -> List[str]:
+    """Drop chunks contained in another and stitch overlapping neighbours together.
+
+    Order follows the first appearance of each span, so the best ranked chunk
+    stays first.
+    """
+    merged: List[str] = []
+    for chunk in chunks:
+        if not chunk or any(chunk in kept for kept in merged):
+            continue
+        for i, kept in enumerate(merged):
+            size = _overlap(kept, chunk, max_overlap)
+            if size:
+                merged[i] = kept + chunk[size:]
+                break
+            size = _overlap(chunk, kept, max_overlap)
+            if size:
+                merged[i] = chunk + kept[size:]
+                break
+        else:
+            merged.append(chunk)
+    return merged
+
+def parse_results(search_response) -> List[Dict[str, Any]]:
+    """Results list of a search response given as a JSON string or a dict"""
+    if isinstance(search_response, str):
+        search_response = json.loads(search_response)
+    return search_response.get("results", [])
+
+def context_passages(results: List[Dict[str, Any]]) -> List[str]:
+    """Chunk text only, with overlap removed per relative path, in rank order"""
+    by_path: Dict[str, List[str]] = {}
+    for result in results:
+        by_path.setdefault(result.get("relative_path"), []).append(normalize_whitespace(result.get("chunk") or ""))
+    return [passage for chunks in by_path.values() for passage in merge_chunks(chunks)]
+
+def fit_to_budget(passages: List[str], budget: int) -> List[str]:
+    """Keep passages in order until the token budget is spent, cutting the last one short"""
+    kept = []
+    used = 0
+    for passage in passages:
+        tokens = count_tokens(passage)
+        if used + tokens > budget:
+            if budget - used > 0:
+                kept.append(truncate_to_tokens(passage, budget - used))
+            break
+        kept.append(passage)
+        used += tokens
+    return kept
+
+def build_prompt(question: str, search_response, prescription_text: str = "", chat_history: str = "",
+                 model_name: str = None, max_context_tokens: int = 6000,
+                 report: bool = True) -> Tuple[str, set, Dict[str, int]]:
+    """Assemble the RAG prompt; returns the prompt, the related paths and token statistics.
+
+    Only chunk text goes into <context>, overlapping chunks of one document are
+    merged, and retrieved text is cut to what the model's window leaves after
+    the rest of the prompt. With ``report`` off the statistics are left empty.
+    """
+    if isinstance(search_response, str):
+        search_response = json.loads(search_response)
+    results = parse_results(search_response)
+    relative_paths = set(result["relative_path"] for result in results if result.get("relative_path"))
+    prescription_text = normalize_whitespace(prescription_text or "")
+    question = normalize_whitespace(question)
+
+    fixed_tokens = count_tokens(
+        PROMPT_TEMPLATE.format(chat_history=chat_history, context=prescription_text, question=question)
+    )
+    budget = min(max_context_tokens, context_window(model_name) - RESPONSE_RESERVE_TOKENS - fixed_tokens)
+    passages = fit_to_budget(context_passages(results), max(budget, 0))
+    if prescription_text:
+        passages.append(prescription_text)
+    context = "\n\n".join(passages)
+
+    prompt = PROMPT_TEMPLATE.format(chat_history=chat_history, context=context, question=question)
+    if not report:
+        return prompt, relative_paths, {}
+    context_tokens = count_tokens(context)
+    # What the raw search JSON plus prescription text would have cost
+    raw_tokens = count_tokens(json.dumps({"results": results}) + prescription_text)
+    stats = {
+        "context_tokens": context_tokens,
+        "context_tokens_saved": max(raw_tokens - context_tokens, 0),
+    }
+    return prompt, relative_paths, stats
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from embeddings import ModelUnavailable
+from metrics import metrics
+from tokens import count_tokens
+
+# Small MS MARCO cross-encoder; fast enough on CPU for a few dozen candidates
+RERANK_MODEL = os.getenv("CARECONNECT_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_cross_encoder():
+    """Load the cross-encoder once per process, on CPU"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    _model = CrossEncoder(RERANK_MODEL, device="cpu")
+                except Exception as e:
+                    raise ModelUnavailable(f"Cannot load {RERANK_MODEL}: {str(e)}") from e
+    return _model
+
+def score(query: str, passages: List[str], batch_size: int = 32) -> np.ndarray:
+    """Relevance of each passage to the query, in [0, 1]"""
+    if not passages:
+        return np.zeros(0, dtype=np.float32)
+    logits = get_cross_encoder().predict(
+        [(query, passage) for passage in passages], batch_size=batch_size, show_progress_bar=False
+    )
+    return 1.0 / (1.0 + np.exp(-np.asarray(logits, dtype=np.float32)))
+
+class Reranker:
+    """Second retrieval stage: rescores a wide candidate set and keeps the best.
+
+    Candidates are kept in score order while they clear ``threshold`` and fit
+    in ``max_tokens``; the best candidate is always kept.
+    """
+
+    def __init__(self, candidates: int = 20, threshold: float = 0.1, max_tokens: int = 1500,
+                 baseline_chunks: int = 3):
+        self.candidates = candidates
+        self.threshold = threshold
+        self.max_tokens = max_tokens
+        # What a single-stage search would have sent, for the tokens-saved figure
+        self.baseline_chunks = baseline_chunks
+        self.enabled = True
+
+    def select(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Reranked subset of results and statistics about the cut"""
+        baseline = results[:self.baseline_chunks]
+        if not self.enabled or not results:
+            return baseline, {}
+        start = time.perf_counter()
+        try:
+            with metrics.span("rerank"):
+                scores = score(query, [result.get("chunk") or "" for result in results])
+        except ModelUnavailable as e:
+            print(f"Reranking disabled: {str(e)}")
+            self.enabled = False
+            return baseline, {}
+        except Exception as e:
+            print(f"Error reranking, keeping the top {len(baseline)} results: {str(e)}")
+            return baseline, {}
+
+        kept = []
+        used = 0
+        for i in np.argsort(-scores):
+            tokens = count_tokens(results[i].get("chunk") or "")
+            if kept and (scores[i] < self.threshold or used + tokens > self.max_tokens):
+                break
+            kept.append(results[i])
+            used += tokens
+        baseline_tokens = sum(count_tokens(result.get("chunk") or "") for result in baseline)
+        return kept, {
+            "rerank_candidates": len(results),
+            "rerank_kept": len(kept),
+            "rerank_top_score": float(scores.max()),
+            # Kept candidates can be longer than the baseline chunks
+            "rerank_tokens_saved": max(baseline_tokens - used, 0),
+            "rerank_seconds": time.perf_counter() - start,
+        }
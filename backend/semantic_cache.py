@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from cache import LRUCache, on_documents_ingested
+from embeddings import ModelUnavailable
+
+class SemanticCache:
+    """Answer cache that also matches paraphrased questions.
+
+    Questions are embedded locally and kept as rows of one float32 matrix;
+    a lookup is a single matrix-vector product over the rows of the same
+    scope (category, RAG setting and prescription). Expired rows are freed
+    first; when full, the least recently used row is overwritten. A scope
+    is forgotten once none of its rows is left.
+    """
+
+    def __init__(self, capacity: int = 2048, threshold: float = 0.92, ttl: float = 24 * 3600):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.vectors: Optional[np.ndarray] = None
+        self.scopes = np.full(capacity, -1, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.answers: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._scope_ids: Dict[str, int] = {}
+        self._next_scope_id = 0
+        # Vectors of recently looked-up questions, so storing the answer does not re-embed
+        self._recent_vectors = LRUCache(max_entries=128)
+        self._lock = threading.Lock()
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope(category: str, use_rag: bool, prescription: str) -> str:
+        """Hash of what, besides the question, an answer depends on.
+
+        prescription identifies the uploaded prescription, e.g. its content hash.
+        """
+        prescription_hash = hashlib.sha256((prescription or "").encode("utf-8")).hexdigest()
+        return json.dumps([category, bool(use_rag), prescription_hash])
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        normalized = " ".join(question.lower().split())
+        vector = self._recent_vectors.get(normalized)
+        if vector is None:
+            try:
+                from embeddings import embed
+                vector = embed([normalized])[0]
+            except ModelUnavailable as e:
+                print(f"Semantic cache disabled: {str(e)}")
+                self.enabled = False
+                return None
+            except Exception as e:
+                # Only this lookup or store is skipped
+                print(f"Error embedding question for the semantic cache: {str(e)}")
+                return None
+            self._recent_vectors.set(normalized, vector)
+        return vector
+
+    def get(self, question: str, scope: str) -> Optional[Dict[str, Any]]:
+        """Cached answer of the most similar question in scope, if similar enough.
+
+        Returns a dict with ``response``, ``relative_paths`` and ``similarity``.
+        """
+        if not self.enabled:
+            return None
+        vector = self._embed(question)
+        if vector is None:
+            return None
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None or self.vectors is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            rows = np.flatnonzero((self.scopes == scope_id) & (now - self.created < self.ttl))
+            if len(rows) == 0:
+                self.misses += 1
+                return None
+            similarities = self.vectors[rows] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            row = rows[best]
+            self.last_used[row] = now
+            self.hits += 1
+            return {**self.answers[row], "similarity": float(similarities[best])}
+
+    def set(self, question: str, scope: str, response: str, relative_paths):
+        """Remember the answer to question in scope"""
+        if not self.enabled:
+            return
+        vector = self._embed(question)
+        if vector is None:
+            return
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            now = time.time()
+            expired = np.flatnonzero((self.scopes != -1) & (now - self.created >= self.ttl))
+            self.scopes[expired] = -1
+            for row in expired:
+                self.answers[row] = None
+            free = np.flatnonzero(self.scopes == -1)
+            if len(free):
+                row = free[0]
+            else:
+                row = int(np.argmin(self.last_used))
+                self.evictions += 1
+            self.scopes[row] = -1
+            self._prune_scopes()
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                scope_id = self._scope_ids[scope] = self._next_scope_id
+                self._next_scope_id += 1
+            self.vectors[row] = vector
+            self.scopes[row] = scope_id
+            self.last_used[row] = now
+            self.created[row] = now
+            self.answers[row] = {"response": response, "relative_paths": sorted(relative_paths)}
+
+    def _prune_scopes(self):
+        """Forget scopes without rows; the caller holds the lock"""
+        live = set(np.unique(self.scopes[self.scopes != -1]).tolist())
+        self._scope_ids = {scope: scope_id for scope, scope_id in self._scope_ids.items() if scope_id in live}
+
+    def clear(self):
+        """Drop every cached answer, e.g. after the document corpus changed"""
+        with self._lock:
+            self.scopes[:] = -1
+            self.answers = [None] * self.capacity
+            self._scope_ids.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(np.count_nonzero(self.scopes != -1)),
+                "scopes": len(self._scope_ids),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "enabled": self.enabled,
+            }
+
+# Shared across sessions; None when turned off with CARECONNECT_SEMANTIC_CACHE=0
+semantic_cache = None
+if os.getenv("CARECONNECT_SEMANTIC_CACHE", "1") != "0":
+    semantic_cache = SemanticCache(
+        capacity=int(os.getenv("CARECONNECT_SEMANTIC_CACHE_SIZE", "2048")),
+        threshold=float(os.getenv("CARECONNECT_SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    )
+    # Cached answers quote the corpus they were generated from
+    on_documents_ingested(semantic_cache.clear)
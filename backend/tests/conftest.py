@@ -0,0 +1,42 @@
+import os
+import sys
+
+# Backend modules import each other by bare name, as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the suite offline and off disk: no embedding model, no SQLite files
+os.environ.setdefault("CARECONNECT_SEMANTIC_CACHE", "0")
+os.environ.setdefault("CARECONNECT_CONVERSATION_DB", "")
+os.environ.setdefault("CARECONNECT_COMPLETION_CACHE_DB", "")
+
+import pytest
+
+from admission import AdmissionController
+from cache import CompletionCache, LRUCache, metadata_cache
+from connection import SnowflakeConnection
+from cortex_completion import CortexCompletion
+from fake_backend import FakeBackend
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend.with_sample_data(documents=10, complete_latency=0.01, tokens_per_second=1000,
+                                        response_tokens=10, search_latency=0.0, sql_latency=0.0)
+
+
+@pytest.fixture
+def connection(backend):
+    connection = SnowflakeConnection(backend=backend)
+    assert connection.connect()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def cortex(connection):
+    """CortexCompletion with private caches and admission controller"""
+    metadata_cache.invalidate()
+    return CortexCompletion(
+        connection.get_pool(), connection.get_root(),
+        completion_cache=CompletionCache(), retrieval_cache=LRUCache(), document_url_cache=LRUCache(),
+        admission=AdmissionController(),
+    )
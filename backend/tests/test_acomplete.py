@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+
+def test_matches_the_blocking_path(cortex):
+    answer, paths = cortex.complete("ibuprofen dose", "mistral-large2", True, "", use_cache=False)
+    response, relative_paths, urls, timings = asyncio.run(
+        cortex.acomplete("ibuprofen dose", "mistral-large2", True, "", use_cache=False))
+    assert (response, relative_paths) == (answer, paths)
+    assert sorted(urls) == sorted(paths)
+    assert {"retrieval", "prompt", "completion", "document_urls", "total"} <= set(timings)
+
+
+def test_urls_are_resolved_while_complete_runs(cortex, backend, monkeypatch):
+    backend.complete_latency = 0.2
+    resolve = cortex.get_document_urls
+
+    def slow(paths):
+        time.sleep(0.2)
+        return resolve(paths)
+    monkeypatch.setattr(cortex, "get_document_urls", slow)
+    *_, timings = asyncio.run(cortex.acomplete("metformin dose", "mistral-large2", True, "", use_cache=False))
+    assert timings["completion"] >= 0.2 and timings["document_urls"] >= 0.2
+    assert timings["total"] < timings["completion"] + timings["document_urls"]
+
+
+def test_concurrent_turns_share_the_io_pool(cortex, backend):
+    backend.complete_latency = 0.3
+
+    async def turns():
+        return await asyncio.gather(*(
+            cortex.acomplete(f"{drug} dose", "mistral-large2", False, "", use_cache=False)
+            for drug in ("ibuprofen", "metformin", "amoxicillin")))
+    start = time.perf_counter()
+    results = asyncio.run(turns())
+    assert time.perf_counter() - start < 0.75
+    assert len({response for response, *_ in results}) == 3
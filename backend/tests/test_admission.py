@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from admission import AdmissionController, Overloaded, SingleFlight
+
+
+def test_single_flight_runs_identical_calls_once():
+    flight = SingleFlight()
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: flight.do("key", work), range(8)))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert {result for result, _ in results} == {"result"}
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_shares_the_exception():
+    flight = SingleFlight()
+    barrier = threading.Barrier(4)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    def call(_):
+        barrier.wait()
+        with pytest.raises(ValueError):
+            flight.do("key", fail)
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(call, range(4)))
+
+
+def test_queue_beyond_limit_is_refused():
+    admission = AdmissionController(limits={"op": 2}, max_queue=3, queue_timeout=5)
+
+    def call(i):
+        try:
+            return admission.run("op", i, time.sleep, 0.2) or "done"
+        except Overloaded:
+            return "refused"
+
+    with ThreadPoolExecutor(10) as executor:
+        outcomes = list(executor.map(call, range(10)))
+    assert outcomes.count("done") == 5
+    assert outcomes.count("refused") == 5
+    stats = admission.stats()["operations"]["op"]
+    assert stats["running"] == stats["queued"] == 0
+    assert stats["rejected"] == 5
+
+
+def test_queue_wait_times_out():
+    admission = AdmissionController(limits={"op": 1}, queue_timeout=0.05)
+    with admission.admit("op"):
+        with pytest.raises(Overloaded):
+            with admission.admit("op"):
+                pass
+    assert admission.stats()["operations"]["op"]["timed_out"] == 1
+
+
+def test_concurrent_identical_turns_share_backend_calls(cortex, backend):
+    # Slow enough that every turn arrives while the first one is in flight
+    backend.search_latency = 0.2
+    backend.complete_latency = 0.3
+    with ThreadPoolExecutor(8) as executor:
+        answers = list(executor.map(
+            lambda _: cortex.complete("What is ibuprofen?", "mistral-large2", True, "", use_cache=False),
+            range(8)))
+    assert len({text for text, _ in answers}) == 1
+    stats = cortex.admission.stats()["operations"]
+    assert stats["search"]["admitted"] == 1
+    assert stats["complete"]["admitted"] == 1
+
+
+def test_refused_search_is_not_answered_without_context(cortex):
+    cortex.admission = AdmissionController(limits={"search": 0}, max_queue=0)
+    with pytest.raises(Overloaded):
+        cortex.complete("What is ibuprofen?", "mistral-large2", True, "")
@@ -0,0 +1,68 @@
+import pytest
+
+from cortex_completion import _batches
+from fake_backend import FakeRow
+
+
+@pytest.fixture
+def batches(backend, monkeypatch):
+    """Prompts of every TRY_COMPLETE batch statement, in order"""
+    sent = []
+    execute = backend.execute
+
+    def recording(cmd, params):
+        if "try_complete" in cmd.lower():
+            sent.append(params[2::2])
+        return execute(cmd, params)
+    monkeypatch.setattr(backend, "execute", recording)
+    return sent
+
+
+def test_batches_are_bounded_by_count_and_bytes():
+    assert list(_batches(["a", "b", "c"], max_size=2, max_bytes=100)) == [["a", "b"], ["c"]]
+    assert list(_batches(["aaaa", "bb", "cc", "dddddd"], max_size=10, max_bytes=4)) == [
+        ["aaaa"], ["bb", "cc"], ["dddddd"]]
+
+
+def test_results_come_back_in_input_order(cortex, backend, batches):
+    prompts = [f"prompt {i}" for i in range(5)] + ["prompt 1"]
+    results = cortex.complete_many(prompts, "mistral-large2", max_batch_size=2)
+    assert [result["response"] for result in results] == [backend._response_text(p) for p in prompts]
+    # The repeated prompt is sent once
+    assert batches == [["prompt 0", "prompt 1"], ["prompt 2", "prompt 3"], ["prompt 4"]]
+    assert not any(result["cached"] or result["error"] for result in results)
+
+
+def test_cached_prompts_are_not_sent_again(cortex, batches):
+    cortex.complete_many(["prompt 0", "prompt 1"], "mistral-large2")
+    results = cortex.complete_many(["prompt 0", "prompt 2"], "mistral-large2")
+    assert [result["cached"] for result in results] == [True, False]
+    assert batches[-1] == ["prompt 2"]
+
+
+def test_a_failed_item_or_batch_only_fails_its_own_prompts(cortex, backend, monkeypatch):
+    execute = backend.execute
+
+    def failing(cmd, params):
+        prompts = params[2::2]
+        if "prompt 2" in prompts:
+            raise ConnectionError("batch dropped")
+        rows = execute(cmd, params)
+        # TRY_COMPLETE returns NULL for an item it could not answer
+        return [FakeRow(IDX=row["IDX"], RESPONSE=None) if prompts[row["IDX"]] == "prompt 1" else row for row in rows]
+    monkeypatch.setattr(backend, "execute", failing)
+    results = cortex.complete_many([f"prompt {i}" for i in range(4)], "mistral-large2", max_batch_size=2)
+    assert [bool(result["response"]) for result in results] == [True, False, False, False]
+    assert results[1]["error"] == "COMPLETE returned no response"
+    assert results[2]["error"] == results[3]["error"] == "batch dropped"
+    # Failures are not cached
+    assert len(cortex.completion_cache.memory) == 1
+
+
+def test_answers_share_the_interactive_cache(cortex, batches):
+    questions = ["ibuprofen dose", "metformin dose"]
+    results = cortex.answer_many(questions, "mistral-large2", True)
+    assert len(batches) == 1
+    for question, result in zip(questions, results):
+        assert cortex.complete(question, "mistral-large2", True, "") == (result["response"], result["relative_paths"])
+    assert cortex.completion_cache.stats()["hits"] == 2
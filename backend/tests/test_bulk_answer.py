@@ -0,0 +1,24 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+import bulk_answer
+
+
+def test_answers_are_written_without_resolving_document_urls(cortex, tmp_path, monkeypatch):
+    monkeypatch.setattr(cortex, "get_document_urls", lambda *args, **kwargs: pytest.fail("URLs resolved"))
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text("".join(json.dumps({"question": q}) + "\n" for q in ("ibuprofen dose", "metformin dose")))
+    args = argparse.Namespace(input=str(questions), output=str(tmp_path / "answers.jsonl"), model="mistral-large2",
+                              category="ALL", concurrency=2, rate=0.0, use_rag=True, use_cache=True, resume=True)
+    stats = asyncio.run(bulk_answer.run(cortex, args))
+    assert stats["answered"] == 2 and stats["errors"] == 0
+    assert stats["latency_seconds"]["count"] == 2
+    records = [json.loads(line) for line in open(args.output)]
+    assert sorted(record["id"] for record in records) == ["1", "2"]
+    assert all(record["answer"] and record["relative_paths"] for record in records)
+
+    # A second run finds every question answered
+    assert asyncio.run(bulk_answer.run(cortex, args))["skipped"] == 2
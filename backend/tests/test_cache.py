@@ -0,0 +1,63 @@
+from cache import CompletionCache, LRUCache, retrieval_cache as shared_retrieval_cache
+
+
+def test_private_caches_are_used_even_when_empty(cortex):
+    assert isinstance(cortex.retrieval_cache, LRUCache)
+    assert cortex.retrieval_cache is not shared_retrieval_cache
+    cortex.get_similar_chunks("ibuprofen dosage")
+    assert len(cortex.retrieval_cache) == 1
+
+
+def test_lru_eviction_and_ttl():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    cache.set("d", 4, ttl=0)
+    assert cache.get("d") is None
+
+
+def test_completion_key_covers_every_input():
+    key = CompletionCache.make_key("mistral-large2", "prompt", "ALL", True)
+    assert key == CompletionCache.make_key("mistral-large2", "prompt", "ALL", 1)
+    assert len({key,
+                CompletionCache.make_key("llama3.1-8b", "prompt", "ALL", True),
+                CompletionCache.make_key("mistral-large2", "prompt ", "ALL", True),
+                CompletionCache.make_key("mistral-large2", "prompt", "GENERAL", True),
+                CompletionCache.make_key("mistral-large2", "prompt", "ALL", False)}) == 5
+
+
+def test_completions_survive_a_restart_until_they_expire(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    cache = CompletionCache(db_path=path, ttl=60)
+    cache.set("fresh", "200 mg")
+    cache.set("stale", "old answer")
+    cache._db.execute("update completions set created_at = created_at - 120 where key = 'stale'")
+    cache._db.commit()
+
+    restarted = CompletionCache(db_path=path, ttl=60)
+    assert restarted.get("fresh") == "200 mg"
+    assert restarted.get("stale") is None
+    # The second lookup is served from memory
+    assert restarted.get("fresh") == "200 mg"
+    stats = restarted.stats()
+    assert stats["persistent"] and stats["disk_hits"] == 1 and stats["hits"] == 2 and stats["misses"] == 1
+
+
+def test_repeated_question_skips_complete(cortex, backend, monkeypatch):
+    completions = []
+    execute = backend.execute
+
+    def counting(cmd, params):
+        if "cortex.complete" in cmd.lower():
+            completions.append(params)
+        return execute(cmd, params)
+    monkeypatch.setattr(backend, "execute", counting)
+    first = cortex.complete("ibuprofen dose", "mistral-large2", True, "")
+    assert cortex.complete("ibuprofen dose", "mistral-large2", True, "") == first
+    assert len(completions) == 1
+    cortex.complete("ibuprofen dose", "mistral-large2", True, "", use_cache=False)
+    assert len(completions) == 2
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import conversation_store
+from conversation_handler import ConversationHandler
+from conversation_store import ConversationStore, Message, get_conversation_store
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_handler_creates_no_database(tmp_path):
+    env = {**os.environ, "HOME": str(tmp_path / "home")}
+    env.pop("CARECONNECT_CONVERSATION_DB", None)
+    subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {BACKEND!r}); import conversation_handler"],
+                   cwd=tmp_path, env=env, check=True)
+    assert not any(path.name.endswith(".sqlite") for path in tmp_path.rglob("*"))
+
+
+def test_store_is_opened_lazily_at_an_absolute_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation_store, "_conversation_store", None)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CARECONNECT_CONVERSATION_DB", "history/conversations.sqlite")
+    store = get_conversation_store()
+    assert os.path.isabs(store.db_path)
+    assert store.db_path == str(tmp_path / "history" / "conversations.sqlite")
+    assert get_conversation_store() is store
+    monkeypatch.setattr(conversation_store, "_conversation_store", None)
+
+
+def test_messages_and_summary_survive_reopening(tmp_path):
+    db_path = str(tmp_path / "conversations.sqlite")
+    store = ConversationStore(db_path)
+    for i in range(5):
+        store.append("session", "user", f"question {i}")
+    store.save_summary("session", "asked about ibuprofen", 2)
+
+    reopened = ConversationStore(db_path)
+    assert reopened.count("session") == 5
+    assert reopened.append("session", "assistant", "answer") == 5
+    assert [m.seq for m in reopened.page("session", limit=2, before_seq=3)] == [1, 2]
+    assert [m.seq for m in reopened.iter_tail("session", after_seq=3)] == [5, 4]
+    assert reopened.load_summary("session") == ("asked about ibuprofen", 2)
+    assert reopened.count("other") == 0
+
+
+def test_history_is_rendered_within_the_token_budget(connection):
+    handler = ConversationHandler(connection.get_pool(), max_history_tokens=200, store=ConversationStore())
+    for i in range(40):
+        handler.add_message("user", f"Is it safe to take ibuprofen number {i} with food and water?")
+        handler.add_message("assistant", f"Yes, take ibuprofen {i} with food to protect the stomach.")
+    rendered = handler.render_history("mistral-large2")
+    assert rendered.startswith("Summary of earlier conversation:")
+    assert "ibuprofen 39 with food" in rendered
+    assert handler.summarized_seq > 0
+    assert handler.last_message == Message("assistant", "Yes, take ibuprofen 39 with food to protect the stomach.", 79)
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from cache import URL_EXPIRY_SECONDS, LRUCache, document_url_cache
+
+
+@pytest.fixture
+def url_queries(backend, monkeypatch):
+    """Parameters of every presigned URL statement the backend runs"""
+    queries = []
+    execute = backend.execute
+
+    def counting(cmd, params):
+        if "get_presigned_url" in cmd.lower():
+            queries.append(list(params))
+        return execute(cmd, params)
+    monkeypatch.setattr(backend, "execute", counting)
+    return queries
+
+
+def test_urls_are_resolved_together_and_reused(cortex, backend, url_queries):
+    paths = sorted(backend.stage)[:3]
+    urls = cortex.get_document_urls(paths + paths[:1] + ["missing.pdf"])
+    assert sorted(urls) == paths
+    assert url_queries == [paths + ["missing.pdf"]]
+    assert cortex.get_document_urls(paths) == urls
+    assert len(url_queries) == 1
+    # Only the path without a cached URL is resolved
+    cortex.get_document_urls(paths + [sorted(backend.stage)[3]])
+    assert url_queries[1] == [sorted(backend.stage)[3]]
+
+
+def test_cached_urls_expire_before_the_links_do(cortex, backend, url_queries):
+    assert document_url_cache.ttl < URL_EXPIRY_SECONDS
+    cortex.document_url_cache = LRUCache(ttl=0.05)
+    path = sorted(backend.stage)[0]
+    cortex.get_document_url(path)
+    time.sleep(0.1)
+    assert cortex.get_document_url(path)
+    assert url_queries == [[path], [path]]
@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+
+import pytest
+
+import ingestion
+
+FILE = {"size": 10, "md5": "abc", "last_modified": "2024-01-01"}
+
+
+class Pool:
+    @contextmanager
+    def session(self):
+        yield None
+
+
+@pytest.fixture
+def stage(monkeypatch):
+    """Stubs out every Snowflake statement; returns the state the run reads and writes"""
+    state = {"stage": {}, "manifest": {}, "ingested": [], "applied": {}, "notified": 0, "classify_fails": False}
+    monkeypatch.setattr(ingestion, "ensure_manifest", lambda session: None)
+    monkeypatch.setattr(ingestion, "list_stage", lambda session: dict(state["stage"]))
+    monkeypatch.setattr(ingestion, "load_manifest", lambda session: {k: dict(v) for k, v in state["manifest"].items()})
+    monkeypatch.setattr(ingestion, "remove_files", lambda pool, paths: None)
+
+    def ingest_file(pool, path, info, category=None):
+        state["ingested"].append(path)
+        state["manifest"][path] = {**info, "category": category}
+        return {"relative_path": path, "chunks": 1, "seconds": 0.0}
+
+    def classify_categories(pool, paths, batch_size=50):
+        if state["classify_fails"]:
+            return {}
+        return {path: "GENERAL" for path in paths}
+
+    def apply_categories(pool, categories):
+        state["applied"].update(categories)
+        for path, category in categories.items():
+            state["manifest"][path]["category"] = category
+
+    def notify():
+        state["notified"] += 1
+
+    monkeypatch.setattr(ingestion, "ingest_file", ingest_file)
+    monkeypatch.setattr(ingestion, "classify_categories", classify_categories)
+    monkeypatch.setattr(ingestion, "apply_categories", apply_categories)
+    monkeypatch.setattr(ingestion, "notify_documents_ingested", notify)
+    return state
+
+
+def test_diff_reports_unclassified_files():
+    manifest = {"a.pdf": {**FILE, "category": None}, "b.pdf": {**FILE, "category": "GENERAL"}}
+    plan = ingestion.diff({"a.pdf": FILE, "b.pdf": FILE, "c.pdf": FILE}, manifest)
+    assert plan == {"new": ["c.pdf"], "changed": [], "removed": [], "unclassified": ["a.pdf"]}
+
+
+def test_failed_classification_is_retried_on_the_next_run(stage):
+    stage["stage"] = {"a.pdf": FILE}
+    stage["classify_fails"] = True
+    report = ingestion.run_ingestion(Pool())
+    assert report["errors"] and report["errors"][0]["relative_path"] == "a.pdf"
+    # The chunks changed, so corpus-derived caches are still invalidated
+    assert stage["notified"] == 1
+
+    stage["classify_fails"] = False
+    report = ingestion.run_ingestion(Pool())
+    assert report["unclassified"] == ["a.pdf"]
+    assert report["categories"] == {"a.pdf": "GENERAL"}
+    assert stage["ingested"] == ["a.pdf"]
+    assert stage["notified"] == 2
+
+    report = ingestion.run_ingestion(Pool())
+    assert report["unclassified"] == [] and report["categories"] == {}
+    assert stage["notified"] == 2
+
+
+def test_classification_skips_rows_and_batches_that_fail():
+    class Session:
+        def sql(self, cmd, params):
+            assert "TRY_COMPLETE" in cmd
+            batch = params[2:]
+            if "c.pdf" in batch:
+                raise RuntimeError("statement failed")
+            return self
+
+        def collect(self):
+            return [{"RELATIVE_PATH": "a.pdf", "CATEGORY": "GENERAL"}, {"RELATIVE_PATH": "b.pdf", "CATEGORY": None}]
+
+    class SessionPool:
+        @contextmanager
+        def session(self):
+            yield Session()
+
+    categories = ingestion.classify_categories(SessionPool(), ["a.pdf", "b.pdf", "c.pdf"], batch_size=2)
+    assert categories == {"a.pdf": "GENERAL"}
+
+
+def test_changed_file_keeps_its_category(stage):
+    stage["stage"] = {"a.pdf": {**FILE, "md5": "new"}}
+    stage["manifest"] = {"a.pdf": {**FILE, "category": "ANTIBIOTIC"}}
+    report = ingestion.run_ingestion(Pool())
+    assert report["changed"] == ["a.pdf"]
+    assert report["categories"] == {}
+    assert stage["manifest"]["a.pdf"]["category"] == "ANTIBIOTIC"
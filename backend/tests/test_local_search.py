@@ -0,0 +1,85 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import embeddings
+import local_search
+from embeddings import ModelUnavailable
+from local_search import LocalSearchIndex, get_local_index
+
+
+def unavailable(texts, batch_size=64):
+    raise ModelUnavailable("cannot reach the model hub")
+
+
+def flaky(texts, batch_size=64):
+    raise RuntimeError("out of memory")
+
+
+def ones(texts, batch_size=64):
+    return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_failed_model_load_still_loads_the_lexical_index(connection, tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "embed", unavailable)
+    index = LocalSearchIndex(connection.get_pool(), str(tmp_path))
+    index.sync()
+    assert index.ready
+    assert not index.use_embeddings
+    assert not (tmp_path / "embeddings.npy").exists()
+    results = index.search("metformin side effects", LocalSearchIndex.COLUMNS, limit=3).results
+    assert len(results) == 3
+    assert all("metformin" in result["relative_path"] for result in results)
+
+
+def test_failed_embedding_run_is_retried_on_the_next_sync(connection, tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "embed", flaky)
+    index = LocalSearchIndex(connection.get_pool(), str(tmp_path))
+    index.sync()
+    assert index.ready and index.snapshot.embeddings is None
+    assert index.use_embeddings
+
+    monkeypatch.setattr(embeddings, "embed", ones)
+    index.sync()
+    assert index.snapshot.embeddings is not None
+    assert (tmp_path / "embeddings.npy").exists()
+
+
+@pytest.mark.parametrize("error, disabled", [(unavailable, True), (flaky, False)])
+def test_query_falls_back_to_lexical_when_embedding_fails(connection, tmp_path, monkeypatch, error, disabled):
+    monkeypatch.setattr(embeddings, "embed", ones)
+    index = LocalSearchIndex(connection.get_pool(), str(tmp_path))
+    index.sync()
+    assert index.snapshot.embeddings is not None
+
+    # A restart with the snapshot on disk; only a model that cannot load turns dense retrieval off
+    monkeypatch.setattr(embeddings, "embed", error)
+    restarted = LocalSearchIndex(connection.get_pool(), str(tmp_path))
+    assert restarted.load()
+    results = restarted.search("ibuprofen alcohol", LocalSearchIndex.COLUMNS, limit=2).results
+    assert len(results) == 2
+    assert restarted.use_embeddings is not disabled
+
+
+def test_index_directory_is_resolved_to_an_absolute_path(connection, tmp_path, monkeypatch):
+    assert os.path.isabs(local_search.DEFAULT_LOCAL_INDEX_DIR)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CARECONNECT_LOCAL_INDEX_DIR", "index")
+    monkeypatch.delenv("CARECONNECT_LOCAL_SYNC_SECONDS", raising=False)
+    monkeypatch.setattr(local_search, "_local_index", None)
+    monkeypatch.setattr(local_search, "on_documents_ingested", lambda callback: None)
+    intervals = []
+    monkeypatch.setattr(LocalSearchIndex, "start_background_sync", lambda self, interval: intervals.append(interval))
+    index = get_local_index(connection.get_pool())
+    assert index.cache_dir == str(tmp_path / "index")
+    assert intervals == [3600.0]
+
+
+def test_embedder_load_failure_is_reported_as_model_unavailable(monkeypatch):
+    monkeypatch.setattr(embeddings, "_model", None)
+    # A None entry makes the import fail, as if the package were missing
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    with pytest.raises(ModelUnavailable):
+        embeddings.embed(["metformin"])
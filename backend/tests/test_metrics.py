@@ -0,0 +1,56 @@
+import json
+
+from metrics import Metrics, percentiles
+
+
+def test_turns_export_as_json_lines_and_feed_histograms():
+    metrics = Metrics()
+    metrics.record_turn(model="mistral-large2", total_seconds=1.5, cached=False)
+    metrics.record_turn(model="llama3.1-8b", total_seconds=0.5, cached=True)
+    turns = [json.loads(line) for line in metrics.to_jsonl().splitlines()]
+    assert [turn["model"] for turn in turns] == ["mistral-large2", "llama3.1-8b"]
+    assert all("timestamp" in turn for turn in turns)
+    # Booleans are fields, not observations
+    assert set(metrics.summary()) == {"turn_total_seconds"}
+    assert metrics.summary()["turn_total_seconds"]["mean"] == 1.0
+
+
+def test_prometheus_export():
+    metrics = Metrics()
+    for value in (0.1, 0.2, 0.3, 0.4):
+        metrics.observe("retrieval-seconds", value)
+    lines = metrics.to_prometheus().splitlines()
+    assert lines[0] == "# TYPE careconnect_retrieval_seconds summary"
+    assert 'careconnect_retrieval_seconds{quantile="0.5"} 0.3' in lines
+    assert 'careconnect_retrieval_seconds{quantile="0.99"} 0.4' in lines
+    assert lines[-2:] == [f"careconnect_retrieval_seconds_sum {0.1 + 0.2 + 0.3 + 0.4}",
+                          "careconnect_retrieval_seconds_count 4"]
+
+
+def test_spans_and_timed_calls_are_recorded():
+    metrics = Metrics(window=2)
+
+    @metrics.timed("lookup")
+    def lookup():
+        return "hit"
+    assert lookup() == "hit"
+    for _ in range(3):
+        with metrics.span("retrieval"):
+            pass
+    summary = metrics.summary()
+    assert summary["lookup_seconds"]["count"] == 1
+    # The count is lifetime, the percentiles cover the window
+    assert summary["retrieval_seconds"]["count"] == 3
+    assert len(metrics.histograms["retrieval_seconds"].values) == 2
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.span("retrieval"):
+        pass
+    metrics.record_turn(total_seconds=1.0)
+    assert metrics.to_jsonl() == "" and metrics.summary() == {}
+
+
+def test_sample_percentiles():
+    assert percentiles([4.0, 1.0, 3.0, 2.0]) == {"count": 4, "mean": 2.5, "p50": 3.0, "p95": 4.0, "p99": 4.0}
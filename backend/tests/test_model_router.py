@@ -0,0 +1,84 @@
+import time
+
+from cache import CompletionCache
+from model_router import ModelRouter
+
+MODELS = ["mistral-large2", "llama3-8b", "mistral-7b"]
+
+
+def test_preferred_model_is_kept_until_it_has_been_observed():
+    router = ModelRouter(MODELS, slo_seconds=8.0, min_samples=5)
+    # mistral-large2's prior alone predicts more than the SLO for this prompt
+    assert router.candidates(3000, preferred="mistral-large2")[0] == "mistral-large2"
+
+    for _ in range(5):
+        router.observe("mistral-large2", 12.0, 3000)
+    assert router.candidates(3000, preferred="mistral-large2")[0] != "mistral-large2"
+
+
+def test_fast_preferred_model_falls_back_only_to_faster_models():
+    router = ModelRouter(MODELS, slo_seconds=8.0, min_samples=1)
+    for model, seconds in (("mistral-large2", 2.0), ("llama3-8b", 1.0), ("mistral-7b", 3.0)):
+        router.observe(model, seconds, 100)
+    assert router.candidates(100, preferred="mistral-large2") == ["mistral-large2", "llama3-8b"]
+
+
+def test_run_falls_back_after_an_error():
+    router = ModelRouter(MODELS, deadline_seconds=1.0)
+
+    def call(model):
+        if model == "mistral-large2":
+            raise RuntimeError("model unavailable")
+        return f"answer from {model}"
+    assert router.run(call, ["mistral-large2", "llama3-8b"]) == ("answer from llama3-8b", "llama3-8b")
+
+
+def test_run_waits_for_the_last_candidate_past_the_deadline():
+    router = ModelRouter(MODELS, deadline_seconds=0.2)
+
+    def call(model):
+        time.sleep(0.4)
+        return f"answer from {model}"
+    assert router.run(call, ["mistral-7b"]) == ("answer from mistral-7b", "mistral-7b")
+
+
+def test_run_abandons_a_slow_attempt_when_another_candidate_is_left():
+    router = ModelRouter(MODELS, deadline_seconds=0.2)
+
+    def call(model):
+        if model == "mistral-large2":
+            time.sleep(1.0)
+        else:
+            time.sleep(0.4)
+        return f"answer from {model}"
+    assert router.run(call, ["mistral-large2", "llama3-8b"]) == ("answer from llama3-8b", "llama3-8b")
+
+
+def test_stream_moves_to_the_next_model_when_the_first_token_is_late(cortex):
+    def stream_tokens(model_name, prompt):
+        if model_name == "mistral-large2":
+            time.sleep(1.0)
+        yield f"{model_name} "
+        yield "answer"
+    cortex._stream_tokens = stream_tokens
+    cortex.first_token_deadline = 0.1
+
+    key = CompletionCache.make_key("mistral-large2", "prompt", "ALL", True)
+    start = time.perf_counter()
+    chunks = list(cortex._stream_completion("mistral-large2", "prompt", key, ["llama3-8b"]))
+    assert chunks == ["llama3-8b ", "answer"]
+    assert time.perf_counter() - start < 0.5
+    assert cortex.last_model_used == "llama3-8b"
+    assert cortex.last_stream_stats["complete"]
+    # The answer came from another model than the one the key names
+    assert cortex.completion_cache.get(key) is None
+
+
+def test_pinned_stream_has_no_deadline(cortex):
+    def stream_tokens(model_name, prompt):
+        time.sleep(0.2)
+        yield "late answer"
+    cortex._stream_tokens = stream_tokens
+    cortex.first_token_deadline = 0.05
+    assert list(cortex._stream_completion("mistral-large2", "prompt")) == ["late answer"]
+    assert cortex.last_model_used == "mistral-large2"
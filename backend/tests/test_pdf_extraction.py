@@ -0,0 +1,89 @@
+import threading
+
+import fitz
+import pytest
+
+import pdf_extraction
+from pdf_extraction import DocumentTooLarge, iter_chunks, iter_pages
+
+
+def make_pdf(label: str, pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f"{label} page {number} amoxicillin 500 mg twice daily")
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def test_pages_come_back_in_order_with_progress():
+    progress = []
+    pages = list(iter_pages(make_pdf("alpha", 3), "alpha.pdf", on_progress=lambda done, total: progress.append(done)))
+    assert [number for number, _, _ in pages] == [0, 1, 2]
+    assert all(f"alpha page {number}" in text for number, text, _ in pages)
+    assert progress == [1, 2, 3]
+
+
+def test_concurrent_in_process_extractions_do_not_mix_documents():
+    # Streamlit sessions are threads of one process; each must only see its own upload
+    errors = []
+
+    def extract(label):
+        data = make_pdf(label, 3)
+        try:
+            for _ in range(30):
+                for number, text, _ in iter_pages(data, f"{label}.pdf"):
+                    if f"{label} page {number}" not in text:
+                        errors.append(f"{label} page {number} read {text!r}")
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=extract, args=(label,)) for label in ("alpha", "bravo", "charlie")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_text_pages_are_read_without_the_ocr_pool(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "_ocr_available", lambda: True)
+    monkeypatch.setattr(pdf_extraction, "_get_ocr_pool", lambda: pytest.fail("OCR pool started"))
+    pages = list(iter_pages(make_pdf("delta", 12), "delta.pdf", workers=4))
+    assert [number for number, _, ocr in pages if not ocr] == list(range(12))
+
+
+def test_scanned_pages_are_ocrd_in_the_pool_in_page_order(monkeypatch):
+    # Blank pages stand in for scans; without Tesseract the workers return no text
+    monkeypatch.setattr(pdf_extraction, "_ocr_available", lambda: True)
+    document = fitz.open()
+    for number in range(6):
+        page = document.new_page()
+        if number % 2 == 0:
+            page.insert_text((72, 72), f"foxtrot page {number} amoxicillin 500 mg")
+    data = document.tobytes()
+    document.close()
+
+    pages = list(iter_pages(data, "foxtrot.pdf", workers=2))
+    assert [number for number, _, _ in pages] == list(range(6))
+    assert [ocr for _, _, ocr in pages] == [False, True] * 3
+    assert all(f"foxtrot page {number}" in text for number, text, ocr in pages if not ocr)
+
+
+def test_page_limit_and_size_limit():
+    truncated = []
+    pages = list(iter_pages(make_pdf("echo", 6), "echo.pdf", max_pages=2,
+                            on_truncated=lambda count, limit: truncated.append((count, limit))))
+    assert len(pages) == 2
+    assert truncated == [(6, 2)]
+    with pytest.raises(DocumentTooLarge):
+        list(iter_pages(b"x" * (50 * 1024 * 1024), "huge.pdf"))
+
+
+def test_chunks_carry_over_page_breaks():
+    class Splitter:
+        def split_text(self, text):
+            return [text[i:i + 20] for i in range(0, len(text), 20)]
+
+    pages = [(0, "a" * 30, False), (1, "b" * 30, False)]
+    assert "".join(iter_chunks(iter(pages), Splitter())).replace("\n", "") == "a" * 30 + "b" * 30
@@ -0,0 +1,73 @@
+import time
+
+from prefetch import RetrievalPrefetcher, extract_entities
+
+PRESCRIPTION = ["Rx: Amoxicillin 500 mg three times daily. Take ibuprofen 200 mg as needed for pain."]
+
+
+def wait_for(prefetcher, timeout=5.0):
+    prefetcher._future.result(timeout)
+
+
+def test_extract_entities_reads_drug_and_dose():
+    assert extract_entities(PRESCRIPTION) == ["amoxicillin 500 mg", "ibuprofen 200 mg"]
+
+
+def test_prefetch_warms_document_urls_and_scores_turns(cortex):
+    prefetcher = RetrievalPrefetcher(cortex)
+    prefetcher.start("upload", PRESCRIPTION)
+    wait_for(prefetcher)
+    assert prefetcher.counts["queries"] == 2
+    assert prefetcher.prefetched_paths
+    assert all(cortex.document_url_cache.get(path) for path in prefetcher.prefetched_paths)
+
+    path = sorted(prefetcher.prefetched_paths)[0]
+    assert prefetcher.record_turn("How much amoxicillin can I take?", [path]) == {
+        "entity_hit": True, "document_hits": 1}
+    assert prefetcher.record_turn("Is it safe with alcohol?", ["other.pdf"]) == {
+        "entity_hit": False, "document_hits": 0}
+    stats = prefetcher.stats()
+    assert stats["entity_hit_rate"] == 0.5
+    assert stats["document_hit_rate"] == 0.5
+
+
+def test_turn_naming_a_prefetched_drug_skips_its_own_search(cortex):
+    prefetcher = RetrievalPrefetcher(cortex)
+    prefetcher.start("upload", PRESCRIPTION)
+    wait_for(prefetcher)
+    searches = cortex.search_service.calls
+
+    response, paths = cortex.complete("What are the side effects of amoxicillin?", "mistral-large2", True,
+                                      PRESCRIPTION[0])
+    assert cortex.search_service.calls == searches
+    assert paths and all("amoxicillin" in path for path in paths)
+    assert prefetcher.counts["served"] == 1
+
+    # A question naming no prefetched drug searches as usual
+    cortex.complete("Can I drink alcohol?", "mistral-large2", True, PRESCRIPTION[0])
+    assert cortex.search_service.calls == searches + 1
+
+
+def test_other_category_does_not_use_the_prefetch(cortex):
+    prefetcher = RetrievalPrefetcher(cortex)
+    prefetcher.start("upload", PRESCRIPTION, "ANTIBIOTIC")
+    wait_for(prefetcher)
+    assert prefetcher.search_response("amoxicillin dosage", "ANTIBIOTIC") is not None
+    assert prefetcher.search_response("amoxicillin dosage", "ALL") is None
+    prefetcher.cancel()
+    assert prefetcher.search_response("amoxicillin dosage", "ANTIBIOTIC") is None
+
+
+def test_new_upload_cancels_the_running_prefetch(cortex, backend):
+    backend.search_latency = 0.2
+    prefetcher = RetrievalPrefetcher(cortex)
+    first = prefetcher.start("first", PRESCRIPTION)
+    time.sleep(0.05)
+    prefetcher.start("second", ["Metformin 850 mg twice daily"])
+    first.result(5)
+    wait_for(prefetcher)
+    assert prefetcher.counts["cancelled"] == 1
+    assert prefetcher.entities == ["metformin 850 mg"]
+    assert list(prefetcher.results) == ["metformin 850 mg"]
+    assert prefetcher.prefetched_paths == {
+        result["relative_path"] for result in prefetcher.results["metformin 850 mg"]}
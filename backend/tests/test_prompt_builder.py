@@ -0,0 +1,49 @@
+import json
+
+from prompt_builder import build_prompt, context_passages, fit_to_budget, merge_chunks
+from tokens import RESPONSE_RESERVE_TOKENS, context_window, count_tokens
+
+OVERLAP = "take with food to protect the stomach lining"
+
+
+def test_overlapping_chunks_are_stitched_together():
+    first = "Ibuprofen 200 mg every six hours, " + OVERLAP
+    second = OVERLAP + ", and never more than 1200 mg a day."
+    assert merge_chunks([first, second]) == [first + second[len(OVERLAP):]]
+    # Either order: the later chunk may hold the earlier span
+    assert merge_chunks([second, first]) == [first + second[len(OVERLAP):]]
+
+
+def test_contained_and_short_overlaps_are_not_merged():
+    chunk = "Metformin 850 mg twice daily with meals. " + OVERLAP
+    assert merge_chunks([chunk, "twice daily with meals", ""]) == [chunk]
+    # A shared word is coincidence, not chunker overlap
+    assert merge_chunks(["take it daily", "daily doses vary"]) == ["take it daily", "daily doses vary"]
+
+
+def test_passages_are_merged_per_document_only():
+    results = [
+        {"relative_path": "a.pdf", "chunk": "Dose one. " + OVERLAP},
+        {"relative_path": "b.pdf", "chunk": OVERLAP + " in b."},
+        {"relative_path": "a.pdf", "chunk": OVERLAP + " in a."},
+    ]
+    assert context_passages(results) == ["Dose one. " + OVERLAP + " in a.", OVERLAP + " in b."]
+
+
+def test_fit_to_budget_keeps_order_and_cuts_the_last_passage():
+    passages = ["alpha " * 50, "bravo " * 50, "charlie " * 50]
+    first = count_tokens(passages[0])
+    kept = fit_to_budget(passages, first + 10)
+    assert kept[0] == passages[0]
+    assert len(kept) == 2 and kept[1].startswith("bravo") and count_tokens(kept[1]) <= 10
+    assert fit_to_budget(passages, 0) == []
+
+
+def test_prompt_leaves_room_for_the_answer():
+    results = [{"relative_path": f"doc{i}.pdf", "chunk": f"Leaflet {i}: " + "dosage details " * 400}
+               for i in range(20)]
+    prompt, paths, stats = build_prompt("What is the dose?", json.dumps({"results": results}),
+                                        model_name="llama2-70b-chat", max_context_tokens=100000)
+    assert count_tokens(prompt) <= context_window("llama2-70b-chat") - RESPONSE_RESERVE_TOKENS
+    assert len(paths) == 20
+    assert stats["context_tokens_saved"] > 0
@@ -0,0 +1,72 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import rerank
+from embeddings import ModelUnavailable
+from prompt_builder import parse_results
+from rerank import Reranker
+
+
+@pytest.fixture
+def reranking(cortex):
+    cortex.reranker = Reranker(candidates=10, threshold=0.5, max_tokens=1500, baseline_chunks=cortex.NUM_CHUNKS)
+    return cortex
+
+
+def test_keeps_candidates_above_threshold(reranking, monkeypatch):
+    monkeypatch.setattr(rerank, "score", lambda query, passages, batch_size=32: np.array(
+        [0.9 if "metformin" in passage else 0.1 for passage in passages], dtype=np.float32))
+    response = json.loads(reranking.get_similar_chunks("metformin dosage", use_cache=False))
+    assert response["results"]
+    assert all("metformin" in result["chunk"] for result in response["results"])
+    assert "rerank" not in response
+    assert reranking.last_rerank_stats["rerank_candidates"] == 10
+    assert reranking.last_rerank_stats["rerank_kept"] == len(response["results"])
+    assert reranking.last_rerank_stats["rerank_tokens_saved"] >= 0
+
+
+def test_cached_retrieval_reports_no_rerank_time(reranking, monkeypatch):
+    monkeypatch.setattr(rerank, "score", lambda query, passages, batch_size=32: np.linspace(
+        1.0, 0.5, len(passages), dtype=np.float32))
+    reranking.get_similar_chunks("metformin dosage")
+    assert reranking.last_rerank_stats["rerank_seconds"] > 0
+    cached = json.loads(reranking.get_similar_chunks("metformin dosage"))
+    assert "rerank" not in cached
+    assert reranking.last_rerank_stats == {"rerank_seconds": 0.0}
+
+
+def test_model_load_failure_falls_back_to_top_chunks(reranking, monkeypatch):
+    def fail(query, passages, batch_size=32):
+        raise ModelUnavailable("cannot reach the model hub")
+    monkeypatch.setattr(rerank, "score", fail)
+    results = parse_results(reranking.get_similar_chunks("metformin dosage"))
+    assert len(results) == reranking.NUM_CHUNKS
+    assert not reranking.reranker.enabled
+
+    # Later turns skip the reranker and search for NUM_CHUNKS directly
+    monkeypatch.setattr(rerank, "score", lambda *args, **kwargs: pytest.fail("reranker retried"))
+    assert len(parse_results(reranking.get_similar_chunks("ibuprofen dosage"))) == reranking.NUM_CHUNKS
+
+
+def test_failed_rerank_call_is_neither_cached_nor_disabling(reranking, monkeypatch):
+    def fail(query, passages, batch_size=32):
+        raise RuntimeError("out of memory")
+    monkeypatch.setattr(rerank, "score", fail)
+    assert len(parse_results(reranking.get_similar_chunks("metformin dosage"))) == reranking.NUM_CHUNKS
+    assert reranking.reranker.enabled
+    assert len(reranking.retrieval_cache) == 0
+
+    monkeypatch.setattr(rerank, "score", lambda query, passages, batch_size=32: np.full(
+        len(passages), 0.9, dtype=np.float32))
+    reranking.get_similar_chunks("metformin dosage")
+    assert reranking.last_rerank_stats["rerank_candidates"] == 10
+
+
+def test_cross_encoder_load_failure_is_reported_as_model_unavailable(monkeypatch):
+    monkeypatch.setattr(rerank, "_model", None)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    with pytest.raises(ModelUnavailable):
+        rerank.score("metformin", ["metformin dosage"])
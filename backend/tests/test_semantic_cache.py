@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import ModelUnavailable
+from semantic_cache import SemanticCache
+
+SCOPE = SemanticCache.scope("ALL", True, "")
+
+
+@pytest.fixture
+def fake_embed(monkeypatch):
+    """Bag-of-words vectors, so questions with the same words match exactly"""
+    vocabulary = {}
+
+    def embed(texts, batch_size=64):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.replace("?", "").split():
+                vectors[row, vocabulary.setdefault(word, len(vocabulary) % 64)] += 1
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    monkeypatch.setattr(embeddings, "embed", embed)
+
+
+def test_paraphrase_in_scope_hits(fake_embed):
+    cache = SemanticCache(capacity=4)
+    cache.set("What is the dose of ibuprofen?", SCOPE, "200 mg", ["ibuprofen.pdf"])
+    hit = cache.get("what is the DOSE of ibuprofen", SCOPE)
+    assert hit["response"] == "200 mg"
+    assert cache.get("What is the dose of ibuprofen?", SemanticCache.scope("GENERAL", True, "")) is None
+
+
+def test_least_recently_used_row_is_overwritten(fake_embed):
+    cache = SemanticCache(capacity=2)
+    cache.set("ibuprofen dose", SCOPE, "a", [])
+    cache.set("metformin dose", SCOPE, "b", [])
+    cache.get("ibuprofen dose", SCOPE)
+    cache.set("amoxicillin dose", SCOPE, "c", [])
+    assert cache.get("metformin dose", SCOPE) is None
+    assert cache.get("ibuprofen dose", SCOPE)["response"] == "a"
+
+
+def test_failed_model_load_disables_the_cache_once(monkeypatch):
+    calls = []
+
+    def embed(texts, batch_size=64):
+        calls.append(texts)
+        raise ModelUnavailable("cannot reach the model hub")
+    monkeypatch.setattr(embeddings, "embed", embed)
+    cache = SemanticCache()
+    assert cache.get("What is ibuprofen?", SCOPE) is None
+    assert cache.get("What is metformin?", SCOPE) is None
+    assert not cache.enabled
+    assert len(calls) == 1
+
+
+def test_failed_lookup_only_skips_that_call(fake_embed, monkeypatch):
+    cache = SemanticCache()
+    cache.set("ibuprofen dose", SCOPE, "a", [])
+    working = embeddings.embed
+
+    def flaky(texts, batch_size=64):
+        raise RuntimeError("out of memory")
+    monkeypatch.setattr(embeddings, "embed", flaky)
+    assert cache.get("metformin dose", SCOPE) is None
+    assert cache.enabled
+    monkeypatch.setattr(embeddings, "embed", working)
+    assert cache.get("ibuprofen dose", SCOPE)["response"] == "a"
+
+
+def test_scopes_are_forgotten_with_their_last_row(fake_embed):
+    cache = SemanticCache(capacity=2)
+    for upload in range(10):
+        cache.set("ibuprofen dose", SemanticCache.scope("ALL", True, f"upload-{upload}"), "a", [])
+    assert cache.stats()["scopes"] == 2
+    assert cache.get("ibuprofen dose", SemanticCache.scope("ALL", True, "upload-9"))["response"] == "a"
+    assert cache.get("ibuprofen dose", SemanticCache.scope("ALL", True, "upload-0")) is None
+
+
+def test_expired_rows_are_reused_before_live_ones(fake_embed):
+    cache = SemanticCache(capacity=2, ttl=60)
+    cache.set("ibuprofen dose", SCOPE, "a", [])
+    cache.set("metformin dose", SCOPE, "b", [])
+    cache.created[0] -= 120
+    cache.set("amoxicillin dose", SCOPE, "c", [])
+    assert cache.evictions == 0
+    assert cache.get("metformin dose", SCOPE)["response"] == "b"
+
+
+def test_paraphrases_about_one_upload_share_a_scope(fake_embed, cortex, monkeypatch):
+    monkeypatch.setattr(cortex, "semantic_cache", SemanticCache())
+    answer, _ = cortex.complete("ibuprofen dose", "mistral-large2", True, "Ibuprofen 200 mg with food",
+                                prescription_key="upload")
+    cortex.last_prompt_stats = {"prompt_tokens": 999}
+    # Another question selects another excerpt of the same upload
+    cached, _ = cortex.complete("dose ibuprofen", "mistral-large2", True, "Take ibuprofen 200 mg",
+                                prescription_key="upload")
+    assert cached == answer
+    assert cortex.semantic_cache.hits == 1
+    # The cached turn built no prompt, so it reports no prompt stats
+    assert cortex.last_prompt_stats == {}
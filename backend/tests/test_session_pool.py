@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from connection import SessionPool
+
+
+class Session:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+        self.queries = 0
+
+    def sql(self, cmd):
+        if not self.healthy:
+            raise ConnectionError("session expired")
+        self.queries += 1
+        return self
+
+    def collect(self):
+        return [1]
+
+    def close(self):
+        self.closed = True
+
+
+def test_concurrent_users_never_exceed_max_size():
+    created = []
+    pool = SessionPool(lambda: created.append(Session()) or created[-1], max_size=3, keepalive_interval=0)
+    in_use = []
+    peak = []
+    lock = threading.Lock()
+
+    def use(_):
+        with pool.session() as session:
+            with lock:
+                assert session not in in_use
+                in_use.append(session)
+                peak.append(len(in_use))
+            time.sleep(0.02)
+            with lock:
+                in_use.remove(session)
+
+    with ThreadPoolExecutor(12) as executor:
+        list(executor.map(use, range(36)))
+    assert len(created) == 3
+    assert max(peak) == 3
+    stats = pool.stats()
+    assert stats["checkouts"] == 36 and stats["in_use"] == 0
+    assert stats["checkout_waits"] > 0
+
+
+def test_checkout_times_out_when_exhausted():
+    pool = SessionPool(Session, max_size=1, checkout_timeout=0.05, keepalive_interval=0)
+    with pool.session():
+        with pytest.raises(TimeoutError):
+            pool.acquire()
+
+
+def test_stale_session_failing_its_health_check_is_replaced():
+    sessions = [Session(healthy=False), Session()]
+    pool = SessionPool(lambda: sessions.pop(0), max_size=1, health_check_interval=0, keepalive_interval=0)
+    broken = pool.acquire()
+    pool.release(broken)
+    time.sleep(0.01)
+    with pool.session() as session:
+        assert session is not broken and session.healthy
+    assert broken.closed
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_failed_login_frees_its_slot():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("login failed")
+        return Session()
+
+    pool = SessionPool(factory, max_size=1, keepalive_interval=0)
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    with pool.session() as session:
+        assert session.healthy
+
+
+def test_pinned_session_is_kept_alive_but_never_checked_out():
+    pool = SessionPool(Session, max_size=1, keepalive_interval=0.05)
+    root_session = Session()
+    pool.pin(root_session)
+    with pool.session() as session:
+        assert session is not root_session
+    time.sleep(0.2)
+    assert root_session.queries >= 2
+    pool.close()
+
+
+def test_counters_are_exact_under_concurrent_reconnects():
+    pool = SessionPool(lambda: Session(healthy=False), max_size=8, health_check_interval=0, keepalive_interval=0)
+
+    def use(_):
+        with pool.session():
+            time.sleep(0.001)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(use, range(400)))
+    stats = pool.stats()
+    # Every checkout of an idle session found it expired and replaced it
+    assert stats["created"] == stats["size"] + stats["reconnects"]
+    assert stats["checkouts"] == 400
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from cache import CompletionCache
+
+
+def delayed_chunks(delays, fail_after=None):
+    """Stub for CortexCompletion._stream_tokens: one chunk after each delay"""
+    def stream(model_name, prompt):
+        for i, delay in enumerate(delays):
+            if i == fail_after:
+                raise ConnectionError("stream dropped")
+            time.sleep(delay)
+            yield f"chunk{i} "
+    return stream
+
+
+def test_time_to_first_token_and_total_time(cortex):
+    cortex._stream_tokens = delayed_chunks([0.1, 0.05, 0.05])
+    chunks = list(cortex._stream_completion("mistral-large2", "prompt"))
+    stats = cortex.last_stream_stats
+    assert chunks == ["chunk0 ", "chunk1 ", "chunk2 "]
+    assert stats["streamed"] and stats["complete"] and not stats["cached"]
+    assert 0.1 <= stats["time_to_first_token"] < 0.15
+    assert stats["total_time"] >= 0.2
+    assert stats["time_to_first_token"] < stats["total_time"]
+
+
+def test_fake_backend_streams_token_by_token(cortex, backend):
+    chunks = list(cortex._stream_completion("mistral-large2", "prompt"))
+    assert len(chunks) == backend.response_tokens
+    assert cortex.last_stream_stats["streamed"]
+
+
+def test_falls_back_to_blocking_before_first_token(cortex, backend):
+    cortex._stream_tokens = delayed_chunks([0.01], fail_after=0)
+    chunks = list(cortex._stream_completion("mistral-large2", "prompt"))
+    assert chunks == [backend._response_text("prompt")]
+    assert not cortex.last_stream_stats["streamed"]
+    assert cortex.last_stream_stats["complete"]
+
+
+def test_partial_stream_is_not_restarted_or_cached(cortex):
+    cortex._stream_tokens = delayed_chunks([0.01, 0.01, 0.01], fail_after=2)
+
+    def no_restart(model_name, prompt):
+        pytest.fail("a partially shown answer must not be regenerated")
+    cortex._complete_blocking = no_restart
+
+    key = CompletionCache.make_key("mistral-large2", "prompt", "ALL", True)
+    chunks = list(cortex._stream_completion("mistral-large2", "prompt", key))
+    assert chunks == ["chunk0 ", "chunk1 "]
+    assert cortex.last_stream_stats["streamed"]
+    assert not cortex.last_stream_stats["complete"]
+    assert cortex.completion_cache.get(key) is None
+
+
+def test_cached_answer_is_replayed(cortex):
+    key = CompletionCache.make_key("mistral-large2", "prompt", "ALL", True)
+    cortex.completion_cache.set(key, "cached answer")
+    assert list(cortex._stream_completion("mistral-large2", "prompt", key)) == ["cached answer"]
+    assert cortex.last_stream_stats["cached"]
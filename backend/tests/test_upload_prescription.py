@@ -0,0 +1,96 @@
+import fitz
+import pytest
+
+import upload_prescription
+from cache import LRUCache
+from tokens import count_tokens
+from upload_prescription import PrescriptionIndex, content_hash, get_prescription_index, upload_and_extract_prescription
+
+
+class Upload:
+    """The parts of Streamlit's UploadedFile the app reads"""
+
+    def __init__(self, data: bytes, file_id: str, name: str = "prescription.pdf"):
+        self.data = data
+        self.file_id = file_id
+        self.name = name
+        self.reads = 0
+
+    def getvalue(self) -> bytes:
+        self.reads += 1
+        return self.data
+
+
+def make_pdf(text: str) -> bytes:
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), text)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    for name in ("extraction_cache", "_upload_hashes", "index_cache"):
+        monkeypatch.setattr(upload_prescription, name, LRUCache())
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    calls = []
+    extract = upload_prescription.extract_text_from_doc
+
+    def counting(data, file_name, on_progress=None, on_chunk=None):
+        calls.append(file_name)
+        return extract(data, file_name, on_progress, on_chunk)
+    monkeypatch.setattr(upload_prescription, "extract_text_from_doc", counting)
+    return calls
+
+
+def test_an_upload_is_extracted_once_per_content(extractions):
+    data = make_pdf("Amoxicillin 500 mg three times daily")
+    chunks = upload_and_extract_prescription(Upload(data, "a"))
+    assert "Amoxicillin 500 mg" in chunks[0]
+    # A rerun, and the same file attached again under a new file_id
+    assert upload_and_extract_prescription(Upload(data, "a")) == chunks
+    assert upload_and_extract_prescription(Upload(data, "b")) == chunks
+    assert extractions == ["prescription.pdf"]
+    upload_and_extract_prescription(Upload(make_pdf("Ibuprofen 200 mg"), "c"))
+    assert len(extractions) == 2
+
+
+def test_failed_extractions_are_retried(extractions):
+    upload = Upload(b"not a pdf", "broken")
+    assert upload_and_extract_prescription(upload) == []
+    assert upload_and_extract_prescription(upload) == []
+    assert len(extractions) == 2
+
+
+def test_content_hash_is_memoized_per_upload():
+    upload = Upload(b"bytes", "a")
+    assert content_hash(upload) == content_hash(upload) == content_hash(Upload(b"bytes", "b"))
+    assert upload.reads == 1
+
+
+def test_index_is_built_once_per_upload():
+    chunks = ["Amoxicillin 500 mg", "Ibuprofen 200 mg"]
+    index = get_prescription_index(Upload(b"bytes", "a"), chunks)
+    assert get_prescription_index(Upload(b"bytes", "b"), chunks) is index
+
+
+def test_relevant_chunks_are_selected_in_document_order():
+    chunks = [f"Section {i}: patient details and pharmacy address." for i in range(6)]
+    chunks[1] = "Ibuprofen 200 mg as needed for pain."
+    chunks[4] = "Amoxicillin 500 mg three times daily for seven days."
+    index = PrescriptionIndex(chunks, top_k=2)
+    assert index.select("amoxicillin and ibuprofen dose") == chunks[1] + "\n" + chunks[4]
+    # Nothing matches lexically, so the opening of the prescription is used
+    assert index.select("explain this") == chunks[0] + "\n" + chunks[1]
+
+
+def test_selection_stays_within_the_token_budget():
+    chunks = ["amoxicillin " * 300, "amoxicillin 500 mg", "amoxicillin daily"]
+    index = PrescriptionIndex(chunks, top_k=3, max_tokens=100)
+    selected = index.select("amoxicillin")
+    assert chunks[0] not in selected
+    assert count_tokens(selected) <= index.token_budget(None)
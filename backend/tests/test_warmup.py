@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+import warmup
+from cache import metadata_cache
+from conversation_handler import ConversationHandler
+from conversation_store import ConversationStore
+from warmup import warm_up
+
+
+@pytest.fixture(autouse=True)
+def cold_metadata():
+    metadata_cache.invalidate()
+    yield
+    metadata_cache.invalidate()
+
+
+def test_first_turn_finds_sessions_and_metadata_ready(connection, backend):
+    timings = warm_up(connection, background=False)
+    assert set(timings) == {"session", "search_service", "categories", "documents", "tokenizer"}
+    pool = connection.get_pool()
+    assert pool.stats()["size"] >= pool.min_size
+
+    statements = backend.statements
+    handler = ConversationHandler(pool, store=ConversationStore())
+    assert handler.get_available_categories() == ["ALL", "ANTIBIOTIC", "GENERAL"]
+    assert len(handler.get_available_documents()) == len(backend.stage)
+    assert backend.statements == statements
+
+
+def test_a_failing_step_does_not_stop_the_rest(connection, monkeypatch):
+    steps = warmup.warm_up_steps
+
+    def failing(connection):
+        return [("broken", lambda: 1 / 0)] + steps(connection)
+    monkeypatch.setattr(warmup, "warm_up_steps", failing)
+    timings = warm_up(connection, background=False)
+    assert "broken" in timings and "documents" in timings
+    assert metadata_cache.get("documents") is not None
+
+
+def test_background_warm_up_returns_immediately(connection, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(warmup, "warm_up_steps", lambda connection: [("slow", lambda: release.wait(5))])
+    timings = warm_up(connection)
+    assert timings == {}
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "careconnect-warmup":
+            thread.join(5)
+    assert "slow" in timings
@@ -0,0 +1,63 @@
+from typing import Optional
+
+# Context window (in tokens) of each model offered in ConversationHandler.available_models
+MODEL_CONTEXT_WINDOWS = {
+    'mixtral-8x7b': 32000,
+    'snowflake-arctic': 4096,
+    'mistral-large2': 128000,
+    'llama3-8b': 8000,
+    'llama3-70b': 8000,
+    'reka-flash': 100000,
+    'mistral-7b': 32000,
+    'llama2-70b-chat': 4096,
+    'gemma-7b': 8000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# Tokens kept free in the context window for the answer
+RESPONSE_RESERVE_TOKENS = 512
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None if tiktoken is unavailable"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable, estimating token counts: {str(e)}")
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def context_window(model_name: Optional[str]) -> int:
+    """Return the context window of a model, in tokens"""
+    return MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
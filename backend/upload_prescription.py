@@ -1,44 +1,126 @@
-import os
-from langchain_community.document_loaders import PyMuPDFLoader # Import LangChain loader for .doc files
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import hashlib
 import streamlit as st
+from bm25 import BM25Index
+from cache import LRUCache
+from metrics import metrics
+from tokens import context_window, count_tokens
+
+# Extracted chunks keyed by a SHA-256 of the uploaded bytes. Streamlit reruns
+# main() on every interaction, so an attached file is only parsed once.
+extraction_cache = LRUCache(max_entries=32)
+# Streamlit file_id -> content hash, so a rerun does not even rehash the bytes
+_upload_hashes = LRUCache(max_entries=64)
+# Lexical index over each upload's chunks, built once and reused every turn
+index_cache = LRUCache(max_entries=32)
+
+class PrescriptionIndex:
+    """Picks the prescription chunks relevant to a question"""
+
+    def __init__(self, chunks: list, top_k: int = 4, budget_ratio: float = 0.1, max_tokens: int = 1500):
+        self.chunks = chunks
+        self.top_k = top_k
+        self.budget_ratio = budget_ratio
+        self.max_tokens = max_tokens
+        self.bm25 = BM25Index(chunks)
+        self.chunk_tokens = [count_tokens(chunk) for chunk in chunks]
+
+    def token_budget(self, model_name: str) -> int:
+        """Token budget for prescription text in a prompt to model_name"""
+        return min(self.max_tokens, int(context_window(model_name) * self.budget_ratio))
+
+    def select(self, question: str, model_name: str = None) -> str:
+        """Return the top-k chunks for the question within the token budget, in document order"""
+        budget = self.token_budget(model_name)
+        ranked = [idx for idx, _ in self.bm25.top_k(question, self.top_k)]
+        if not ranked:
+            # Nothing matched lexically ("explain this prescription"), so use its opening
+            ranked = list(range(min(self.top_k, len(self.chunks))))
+
+        selected = []
+        used = 0
+        for idx in ranked:
+            if used + self.chunk_tokens[idx] > budget:
+                continue
+            selected.append(idx)
+            used += self.chunk_tokens[idx]
+        return "\n".join(self.chunks[idx] for idx in sorted(selected))
+
+@metrics.timed("extract_text_from_doc")
+def extract_text_from_doc(data: bytes, file_name: str, on_progress=None, on_chunk=None) -> list:
+    """Extract text from the uploaded document bytes without writing them to disk.
+
+    Pages are split into chunks as they are read (scanned pages are OCR'd in
+    worker processes); ``on_progress(done, total)`` reports pages and
+    ``on_chunk(chunk)`` receives each chunk as soon as it is complete.
+    """
+    # PyMuPDF and LangChain are only loaded once someone uploads a file
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from pdf_extraction import DocumentTooLarge, iter_chunks, iter_pages
+
+    def on_truncated(page_count: int, max_pages: int):
+        st.warning(f"{file_name} has {page_count} pages; only the first {max_pages} were read.")
 
-def extract_text_from_doc(file_path: str) -> list:
-    """Extract text from the uploaded document using LangChain."""
     try:
-        # Load the document
-        loader = PyMuPDFLoader(file_path)
-        documents = loader.load()
-        
-        # Combine all text from the document
-        full_text = "\n".join([doc.page_content for doc in documents])
-        
-        # Split the text into chunks for better processing
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=100)
-        chunks = text_splitter.split_text(full_text)
-        
+        pages = iter_pages(data, file_name, on_progress=on_progress, on_truncated=on_truncated)
+        chunks = []
+        for chunk in iter_chunks(pages, text_splitter):
+            chunks.append(chunk)
+            if on_chunk:
+                on_chunk(chunk)
         return chunks
+    except DocumentTooLarge as e:
+        st.error(str(e))
+        return []
     except Exception as e:
         st.error(f"Failed to extract text from the document: {e}")
         return []
 
-def upload_and_extract_prescription(uploaded_file) -> list:
-    """Handle prescription upload and extract text."""
+def content_hash(uploaded_file) -> str:
+    """Return the SHA-256 of an uploaded file's bytes, memoized per upload"""
+    file_id = getattr(uploaded_file, "file_id", None)
+    digest = _upload_hashes.get(file_id) if file_id else None
+    if digest is None:
+        digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        if file_id:
+            _upload_hashes.set(file_id, digest)
+    return digest
+
+def get_prescription_index(uploaded_file, chunks: list) -> PrescriptionIndex:
+    """Return the chunk index for an upload, building it on first use"""
+    digest = content_hash(uploaded_file)
+    index = index_cache.get(digest)
+    if index is None:
+        index = PrescriptionIndex(chunks)
+        index_cache.set(digest, index)
+    return index
+
+def upload_and_extract_prescription(uploaded_file, on_chunk=None) -> list:
+    """Handle prescription upload and extract text.
+
+    ``on_chunk`` sees each chunk while a new upload is being extracted; a
+    cached upload returns its chunks without calling it.
+    """
     if uploaded_file is not None:
-        # Save the uploaded file temporarily
-        file_path = f"temp_{uploaded_file.name}"
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
-        
-        # Extract text using LangChain
+        digest = content_hash(uploaded_file)
+        cached = extraction_cache.get(digest)
+        if cached is not None:
+            return cached
+
+        # Extract text straight from the in-memory upload
         with st.spinner("Extracting text from the prescription..."):
-            extracted_chunks = extract_text_from_doc(file_path)
+            progress = st.progress(0.0, text="Reading pages...")
+
+            def on_progress(done: int, total: int):
+                progress.progress(done / total, text=f"Read page {done} of {total}")
+
+            extracted_chunks = extract_text_from_doc(uploaded_file.getvalue(), uploaded_file.name, on_progress, on_chunk)
+            progress.empty()
             if extracted_chunks:
                 st.success(f"Text extracted successfully from {uploaded_file.name}.")
+                extraction_cache.set(digest, extracted_chunks)
             else:
                 st.error(f"Failed to extract text from {uploaded_file.name}.")
-        
-        # Remove the temporary file
-        os.remove(file_path)
+
         return extracted_chunks
     return []
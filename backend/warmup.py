@@ -0,0 +1,54 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from metrics import metrics
+
+def warm_up_steps(connection) -> List[Tuple[str, Callable[[], object]]]:
+    """What the first turn of a cold process would otherwise wait for, in order"""
+    from conversation_handler import ConversationHandler
+    from conversation_store import ConversationStore
+    from cortex_completion import CortexCompletion
+    from semantic_cache import semantic_cache
+    from tokens import count_tokens
+
+    pool = connection.get_pool()
+    # Throwaway in-memory store: warm-up has no conversation of its own
+    handler = ConversationHandler(pool, store=ConversationStore())
+    steps = [
+        ("session", pool.warm),
+        ("search_service", lambda: CortexCompletion(pool, connection.get_root())),
+        ("categories", handler.get_available_categories),
+        ("documents", handler.get_available_documents),
+        ("tokenizer", lambda: count_tokens("warm up")),
+    ]
+    if semantic_cache is not None:
+        def load_embedder():
+            from embeddings import get_embedder
+            get_embedder()
+        steps.append(("embedder", load_embedder))
+    return steps
+
+def warm_up(connection, background: bool = True) -> Dict[str, float]:
+    """Open sessions and fill the metadata caches, by default on a daemon thread.
+
+    Returns per-step seconds, filled in as the steps finish.
+    """
+    timings: Dict[str, float] = {}
+
+    def run():
+        for name, step in warm_up_steps(connection):
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # Warm-up is best effort; the step simply runs again on first use
+                print(f"Error warming up {name}: {str(e)}")
+            timings[name] = time.perf_counter() - start
+            metrics.observe(f"warmup_{name}_seconds", timings[name])
+
+    if background:
+        threading.Thread(target=run, name="careconnect-warmup", daemon=True).start()
+    else:
+        run()
+    return timings
@@ -40,9 +40,9 @@ def main():
         st.error("Failed to connect to Snowflake. Please check your credentials.")
         return
     
-    session = connection.get_session()
-    conversation_handler = ConversationHandler(session)
-    cortex_completion = CortexCompletion(session, connection.get_root())
+    pool = connection.get_pool()
+    conversation_handler = ConversationHandler(pool)
+    cortex_completion = CortexCompletion(pool, connection.get_root())
     
     # Initialize session state
     initialize_session_state()